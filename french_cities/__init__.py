@@ -1,21 +1,84 @@
 # -*- coding: utf-8 -*-
 
+# Note: public functions are imported lazily (on first access), so that
+# heavy dependencies are only loaded by the features which need them.
 
-from dotenv import load_dotenv
-from importlib_metadata import version
+from functools import lru_cache
+import importlib
 
 from .config import DIR_CACHE
-from .city_finder import find_city
-from .departement_finder import find_departements
-from .vintage import set_vintage
 
-load_dotenv(override=True)
+_LAZY_ATTRIBUTES = {
+    "add_metrics_callback": "metrics",
+    "build_reference_store": "reference_store",
+    "cache_stats": "caches",
+    "city_code": "lookup",
+    "collect_metrics": "metrics",
+    "configure_concurrency": "executor",
+    "configure_http_cache": "sessions",
+    "configure_user_agent": "city_finder",
+    "dep_from_postcode": "lookup",
+    "export_cache": "cache_bundle",
+    "find_city": "city_finder",
+    "find_city_in_file": "streaming",
+    "find_city_iter": "streaming",
+    "find_departements": "departement_finder",
+    "find_departements_iter": "streaming",
+    "import_cache": "cache_bundle",
+    "invalidate_cache": "caches",
+    "project_code": "lookup",
+    "remove_metrics_callback": "metrics",
+    "set_vintage": "vintage",
+}
 
-__version__ = version(__package__)
+
+@lru_cache(maxsize=None)
+def _load_dotenv():
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+
+
+def __getattr__(name):
+    if name == "__version__":
+        from importlib_metadata import version
+
+        value = version(__package__)
+    elif name in _LAZY_ATTRIBUTES:
+        _load_dotenv()
+        module = importlib.import_module(
+            f".{_LAZY_ATTRIBUTES[name]}", __name__
+        )
+        value = getattr(module, name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | {"__version__"})
 
 
 __all__ = [
+    "add_metrics_callback",
+    "build_reference_store",
+    "cache_stats",
+    "city_code",
+    "collect_metrics",
+    "configure_concurrency",
+    "configure_http_cache",
+    "configure_user_agent",
+    "dep_from_postcode",
+    "export_cache",
     "find_city",
+    "find_city_in_file",
+    "find_city_iter",
     "find_departements",
+    "find_departements_iter",
+    "import_cache",
+    "invalidate_cache",
+    "project_code",
+    "remove_metrics_callback",
     "set_vintage",
 ]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:02:11 2026
+
+Tools used to pipeline web requests with asyncio.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, to use inside a running event loop.
+
+    Parameters
+    ----------
+    rate : float
+        Number of tokens (ie. requests) allowed per second.
+    capacity : float, optional
+        Maximum number of tokens which can be accumulated (ie. maximum size
+        of a burst). The default is None (one second worth of tokens).
+
+    Example
+    -------
+    >>> async def get(x):
+    ...     await bucket.acquire()
+    ...     ...
+
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        "Wait until a token is available, then consume it"
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def run_coroutine(coro):
+    """
+    Run a coroutine until completion and return its result, whether an event
+    loop is already running in the current thread (in a notebook for
+    instance) or not.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # Note: the coroutine runs in the caller's context (metrics, logs)
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(context.run, asyncio.run, coro).result()
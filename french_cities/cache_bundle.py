@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 26 11:02:47 2026
+
+Cache bundles: export every cache of french-cities (diskcaches, HTTP caches,
+reference store) and pynsee's cache into a single versioned archive, to be
+imported on other machines (workers without internet access for instance).
+
+    python -m french_cities.cache_bundle export bundle.zip
+    python -m french_cities.cache_bundle import bundle.zip
+
+The archive is a zip file holding a manifest (format, versions, checksum of
+each file). SQLite databases are exported through SQLite's backup API, so
+that a bundle can be exported while the caches are in use.
+"""
+
+import argparse
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+from pynsee.utils._create_insee_folder import _create_insee_folder
+
+from french_cities import DIR_CACHE
+from french_cities.constants import BUNDLE_FORMAT
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+# Files identifying the machine (Nominatim's User-Agent), never shared
+LOCAL_FILES = {"french-cities/user-agent"}
+
+
+def _roots() -> dict:
+    "Cache directories to bundle, by name"
+    return {"french-cities": DIR_CACHE, "pynsee": _create_insee_folder()}
+
+
+def _version(package: str) -> str:
+    from importlib_metadata import PackageNotFoundError, version
+
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return None
+
+
+def _is_sqlite(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(16) == b"SQLite format 3\x00"
+
+
+def _backup(path: str, target: str) -> str:
+    "Consistent copy of an SQLite database (even if in use)"
+    if os.path.exists(target):
+        os.unlink(target)
+    src = sqlite3.connect(path)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    return target
+
+
+def _sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024**2), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _iter_files(root: str):
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            # Note: journals are merged by the backup of their database
+            if name.endswith(("-wal", "-shm", "-journal", ".tmp")):
+                continue
+            path = os.path.join(directory, name)
+            yield path, os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def export_cache(path: str) -> dict:
+    """
+    Export the caches of french-cities and pynsee into an archive.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive (zip file)
+
+    Returns
+    -------
+    dict
+        Manifest of the archive
+
+    """
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "versions": {
+            "french-cities": _version("french-cities"),
+            "pynsee": _version("pynsee"),
+        },
+        "files": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(
+        f"{path}.tmp", "w", compression=zipfile.ZIP_DEFLATED
+    ) as archive:
+        for name, root in _roots().items():
+            for file, relpath in _iter_files(root):
+                arcname = f"{name}/{relpath}"
+                if arcname in LOCAL_FILES:
+                    continue
+                if _is_sqlite(file):
+                    file = _backup(file, os.path.join(tmp, "backup.db"))
+                manifest["files"][arcname] = _sha256(file)
+                archive.write(file, arcname)
+        archive.writestr(MANIFEST, json.dumps(manifest, indent=2))
+    os.replace(f"{path}.tmp", path)
+    logger.info("%s files exported to %s", len(manifest["files"]), path)
+    return manifest
+
+
+def import_cache(path: str) -> dict:
+    """
+    Import an archive of caches (see export_cache), replacing the files of
+    the local caches by the archive's.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive (zip file)
+
+    Raises
+    ------
+    ValueError
+        If the archive has an unsupported format, or is corrupted.
+
+    Returns
+    -------
+    dict
+        Manifest of the archive
+
+    """
+    from french_cities.caches import close_caches
+    from french_cities.lookup import clear_indexes
+    from french_cities.referential import clear_referentials
+    from french_cities.sessions import clear_sessions
+
+    roots = _roots()
+    with zipfile.ZipFile(path) as archive:
+        try:
+            manifest = json.loads(archive.read(MANIFEST))
+        except KeyError:
+            raise ValueError(f"{path} is not a cache bundle")
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(
+                f"unsupported cache bundle format: {manifest.get('format')}"
+            )
+
+        # Sessions and diskcaches hold connections to their databases
+        clear_sessions()
+        close_caches()
+        for arcname, checksum in manifest["files"].items():
+            if arcname in LOCAL_FILES:
+                # Note: bundles exported by older versions included them
+                continue
+            name, relpath = arcname.split("/", 1)
+            if name not in roots:
+                raise ValueError(f"invalid path in cache bundle: {arcname}")
+            root = os.path.realpath(roots[name])
+            target = os.path.realpath(os.path.join(root, relpath))
+            if os.path.commonpath([root, target]) != root:
+                raise ValueError(f"invalid path in cache bundle: {arcname}")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with archive.open(arcname) as src, open(
+                f"{target}.tmp", "wb"
+            ) as dst:
+                shutil.copyfileobj(src, dst)
+            if _sha256(f"{target}.tmp") != checksum:
+                os.unlink(f"{target}.tmp")
+                raise ValueError(f"corrupted file in cache bundle: {arcname}")
+            # Note: journals of a replaced database would corrupt it
+            for suffix in ("-wal", "-shm", "-journal"):
+                if os.path.exists(target + suffix):
+                    os.unlink(target + suffix)
+            os.replace(f"{target}.tmp", target)
+
+    # Referentials stored in memory are rebuilt from the imported caches, and
+    # the diskcaches reconnect to their new databases on next use
+    clear_referentials()
+    clear_indexes()
+    close_caches()
+    logger.info("%s files imported from %s", len(manifest["files"]), path)
+    return manifest
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m french_cities.cache_bundle",
+        description="Export or import french-cities' caches",
+    )
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("path", help="path of the archive")
+    args = parser.parse_args(args)
+    if args.action == "export":
+        manifest = export_cache(args.path)
+    else:
+        manifest = import_cache(args.path)
+    print(f"{len(manifest['files'])} files {args.action}ed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 27 10:18:25 2026
+
+Management of french-cities' caches: size limits (the least recently stored
+entries being evicted beyond them) and time-to-live of each cache, statistics
+and selective invalidation.
+
+Tabular values (DataFrames) are stored in the Arrow IPC format and simple
+values (None, tuples of scalars) as JSON, instead of pickles: they are read
+faster, survive pandas upgrades and can be read by any Arrow-compatible tool.
+Previously pickled entries remain readable.
+
+Size limits and time-to-live can be overridden with the
+FRENCH_CITIES_CACHE_SIZE (in MB, for instance "ban=2048,nominatim=64") and
+FRENCH_CITIES_CACHE_TTL (in days, for instance "ban=7,projection=90")
+environment variables.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import weakref
+
+import diskcache
+import pandas as pd
+
+from french_cities import DIR_CACHE
+from french_cities.constants import CACHE_POLICIES, HTTP_CACHES
+from french_cities.executor import _parse_limits
+from french_cities.metrics import cache_totals
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_opened = weakref.WeakSet()
+
+ARROW_MAGIC = b"ARROW1"
+JSON_MAGIC = b"FCJSON1"
+JSON_TYPES = (str, int, float, bool, type(None))
+
+
+class ColumnarDisk(diskcache.Disk):
+    """
+    diskcache's serialization, storing DataFrames as Arrow IPC files and
+    None or tuples of scalars as JSON instead of pickles.
+    """
+
+    def store(self, value, read, key=diskcache.core.UNKNOWN):
+        if isinstance(value, pd.DataFrame):
+            import pyarrow as pa
+
+            try:
+                value = _to_arrow(value)
+            except pa.ArrowException as exc:
+                # Note: mixed columns can't be converted, pickle them then
+                logger.debug("DataFrame pickled into the cache: %s", exc)
+        elif value is None or (
+            type(value) is tuple
+            and all(isinstance(x, JSON_TYPES) for x in value)
+        ):
+            value = JSON_MAGIC + json.dumps(value).encode()
+        return super().store(value, read, key=key)
+
+    def fetch(self, mode, filename, value, read):
+        if mode == diskcache.core.MODE_BINARY and not read:
+            import pyarrow as pa
+
+            path = os.path.join(self._directory, filename)
+            with open(path, "rb") as f:
+                is_arrow = f.read(len(ARROW_MAGIC)) == ARROW_MAGIC
+            if is_arrow:
+                # Note: the file is read into memory owned by Arrow (not
+                # memory-mapped), so that it is closed right away and can
+                # still be evicted or invalidated
+                with pa.OSFile(path) as source:
+                    return _from_arrow(source)
+        value = super().fetch(mode, filename, value, read)
+        if type(value) is bytes:
+            if value.startswith(ARROW_MAGIC):
+                import pyarrow as pa
+
+                return _from_arrow(pa.BufferReader(value))
+            if value.startswith(JSON_MAGIC):
+                value = json.loads(value.removeprefix(JSON_MAGIC))
+                return value if value is None else tuple(value)
+        return value
+
+
+def _to_arrow(df: pd.DataFrame) -> bytes:
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _from_arrow(source) -> pd.DataFrame:
+    import pyarrow as pa
+
+    return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def _policy(name: str) -> dict:
+    policy = dict(CACHE_POLICIES[name])
+    sizes = _parse_limits(
+        os.environ.get("FRENCH_CITIES_CACHE_SIZE", ""), "cache size"
+    )
+    ttls = _parse_limits(
+        os.environ.get("FRENCH_CITIES_CACHE_TTL", ""), "cache TTL"
+    )
+    if name in sizes:
+        policy["size_limit"] = sizes[name] * 1024**2
+    if name in ttls:
+        policy["expire"] = ttls[name] * 3600 * 24
+    return policy
+
+
+def open_cache(name: str) -> diskcache.Cache:
+    """
+    Open one of french-cities' caches, with its size limit.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache (see constants.CACHE_POLICIES)
+
+    Returns
+    -------
+    diskcache.Cache
+        Cache
+
+    """
+    cache = diskcache.Cache(
+        os.path.join(DIR_CACHE, name),
+        disk=ColumnarDisk,
+        size_limit=_policy(name)["size_limit"],
+        eviction_policy="least-recently-stored",
+    )
+    with _lock:
+        _opened.add(cache)
+    return cache
+
+
+def close_caches():
+    """
+    Close the connections of every cache opened by open_cache (they reconnect
+    on next use), before their files are replaced for instance.
+    """
+    with _lock:
+        opened = list(_opened)
+    for cache in opened:
+        cache.close()
+
+
+def cache_expire(name: str) -> int:
+    "Time-to-live (in seconds) of the entries of a cache"
+    return _policy(name)["expire"]
+
+
+def _disk_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(directory, file))
+        for directory, _, files in os.walk(path)
+        for file in files
+    )
+
+
+def cache_stats() -> pd.DataFrame:
+    """
+    Get statistics of french-cities' caches: number of entries, size on disk,
+    size limit, time-to-live, and hits/misses since the process started.
+
+    Returns
+    -------
+    pd.DataFrame
+        Statistics, indexed by cache
+
+    """
+    totals = cache_totals()
+    stats = []
+    for name in CACHE_POLICIES:
+        policy = _policy(name)
+        with open_cache(name) as cache:
+            stats.append(
+                {
+                    "cache": name,
+                    "entries": len(cache),
+                    "size": cache.volume(),
+                    "size_limit": policy["size_limit"],
+                    "ttl_days": policy["expire"] / 3600 / 24,
+                    **totals.get(name, {"hits": 0, "misses": 0}),
+                }
+            )
+
+    # HTTP caches (requests-cache) and reference snapshots
+    http_size = sum(
+        _disk_size(f.path)
+        for f in os.scandir(DIR_CACHE)
+        if f.name.split(".")[0] in HTTP_CACHES
+    )
+    stats.append(
+        {
+            "cache": "requests-cache",
+            "size": http_size,
+            "ttl_days": 30,
+            **totals.get("requests-cache", {"hits": 0, "misses": 0}),
+        }
+    )
+    reference = os.path.join(DIR_CACHE, "reference")
+    stats.append(
+        {
+            "cache": "reference",
+            "entries": (
+                len(os.listdir(reference)) if os.path.exists(reference) else 0
+            ),
+            "size": _disk_size(reference) if os.path.exists(reference) else 0,
+            **totals.get("reference", {"hits": 0, "misses": 0}),
+        }
+    )
+
+    stats = pd.DataFrame(stats).set_index("cache")
+    stats["hit_ratio"] = stats["hits"] / (stats["hits"] + stats["misses"])
+    return stats
+
+
+def _projection_date(key: tuple) -> str:
+    "Projection date of a key of the projections' cache"
+    # Note: memoized keys are (function's name, *args, None, *kwargs' items)
+    try:
+        return key[key.index("projection_date") + 1]
+    except (ValueError, IndexError, AttributeError):
+        return None
+
+
+def invalidate_cache(name: str, year: int = None) -> int:
+    """
+    Invalidate the entries of one of french-cities' caches, leaving the other
+    caches (and pynsee's) untouched.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache: any of constants.CACHE_POLICIES, "requests-cache"
+        or "reference".
+    year : int, optional
+        If set, only invalidate the entries of this vintage: projections into
+        this year ("projection"), ultramarine territories at a date of this
+        year ("ultramarine"), or snapshot of this vintage ("reference"). The
+        default is None (invalidate every entry).
+
+    Raises
+    ------
+    ValueError
+        If the cache is unknown, or can't be invalidated by year.
+
+    Returns
+    -------
+    int
+        Number of entries invalidated
+
+    Example
+    -------
+    >>> invalidate_cache("projection", year=2024)
+
+    """
+    from french_cities.lookup import clear_indexes
+    from french_cities.referential import clear_referentials
+
+    if year is not None and name not in (
+        "projection",
+        "ultramarine",
+        "reference",
+    ):
+        raise ValueError(f"cache {name} can't be invalidated by year")
+
+    count = 0
+    if name in CACHE_POLICIES:
+        with open_cache(name) as cache:
+            if year is None:
+                count = cache.clear()
+            else:
+                for key in list(cache.iterkeys()):
+                    if name == "projection":
+                        match = _projection_date(key) == f"{year}-01-01"
+                    else:
+                        match = str(key).startswith(str(year))
+                    if match and cache.delete(key):
+                        count += 1
+    elif name == "requests-cache":
+        from french_cities.sessions import clear_sessions
+
+        clear_sessions()
+        for f in os.scandir(DIR_CACHE):
+            if f.name.split(".")[0] in HTTP_CACHES:
+                if f.is_dir():
+                    shutil.rmtree(f.path, ignore_errors=True)
+                else:
+                    os.unlink(f.path)
+                count += 1
+    elif name == "reference":
+        from french_cities.reference_store import clear_snapshots
+
+        # Note: memory-mapped snapshots can't be deleted on Windows
+        clear_snapshots()
+        reference = os.path.join(DIR_CACHE, "reference")
+        if os.path.exists(reference):
+            for file in os.listdir(reference):
+                if year is None or file == f"cog-{year}.parquet":
+                    os.unlink(os.path.join(reference, file))
+                    count += 1
+    else:
+        raise ValueError(f"unknown cache: {name}")
+
+    # Referentials stored in memory are built from the caches
+    clear_referentials()
+    clear_indexes()
+    logger.info("%s entries invalidated from cache %s", count, name)
+    return count
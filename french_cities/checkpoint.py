@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 10:12:31 2026
+
+Checkpoints allowing to resume long runs: each resolution stage stores the
+results of the distinct keys it handled into a checkpoint directory, so that
+a restarted run with the same inputs skips the completed stages and keys.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, Union
+
+import pandas as pd
+
+from french_cities.metrics import stage as measure_stage
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_rows(df: pd.DataFrame) -> pd.Series:
+    "Hash each row of a DataFrame (whatever its index) into a stable key"
+    # Note: missing values may be either NaN or None (after a roundtrip
+    # through parquet files for instance)
+    df = df[sorted(df.columns)].astype(object)
+    df = df.where(df.notnull(), "").astype(str)
+    return pd.util.hash_pandas_object(df, index=False)
+
+
+class Checkpoint:
+    """
+    Checkpoint of a run, stored into a directory. Without a directory, the
+    checkpoint is disabled and stages are simply run. In any case, each stage
+    is measured (see french_cities.metrics) as "<name>:<stage>".
+
+    Parameters
+    ----------
+    directory : str
+        Checkpoint directory (None to disable checkpointing).
+    name : str
+        Name of the run (for instance, the function's name)
+    **params :
+        Any parameter changing the results of the stages: results of runs
+        with different parameters are stored separately.
+
+    """
+
+    def __init__(self, directory: str, name: str, **params):
+        self.name = name
+        self.directory = None
+        if directory:
+            params = json.dumps(params, sort_keys=True, default=str)
+            digest = hashlib.sha256(params.encode("utf8")).hexdigest()[:16]
+            self.directory = os.path.join(directory, f"{name}-{digest}")
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.directory, f"{stage}.parquet")
+
+    def _write(self, df: pd.DataFrame, path: str):
+        # write to a temporary file first, a run may die at any time
+        df.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+
+    def run(
+        self, stage: str, rows: pd.DataFrame, func: Callable
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """
+        Run a stage which computes one result per row.
+
+        Parameters
+        ----------
+        stage : str
+            Stage's name
+        rows : pd.DataFrame
+            Rows to process: all columns make up the rows' keys.
+        func : Callable
+            Stage's function: takes a subset of rows' index and returns the
+            results for those rows, either as a pd.Series or as a
+            pd.DataFrame (the first column then being the main result).
+
+        Returns
+        -------
+        Union[pd.Series, pd.DataFrame]
+            Results of the stage, indexed like rows.
+
+        """
+        with measure_stage(f"{self.name}:{stage}", len(rows)) as info:
+            results = self._run(stage, rows, func)
+            if isinstance(results, pd.DataFrame):
+                info["rows_out"] = results.iloc[:, 0].notnull().sum()
+            else:
+                info["rows_out"] = results.notnull().sum()
+        return results
+
+    def _run(self, stage: str, rows: pd.DataFrame, func: Callable):
+        if not self.directory:
+            return func(rows.index).reindex(rows.index)
+
+        # Note: results given as pd.Series are stored under a "value" column
+        path = self._path(stage)
+        keys = _hash_rows(rows)
+        try:
+            done = pd.read_parquet(path).set_index("key")
+        except FileNotFoundError:
+            done = pd.DataFrame(index=pd.Index([], dtype=keys.dtype))
+
+        known = keys.isin(done.index)
+        logger.info(
+            "checkpoint %s: %s keys already handled, %s to process",
+            stage,
+            known.sum(),
+            (~known).sum(),
+        )
+        if not known.all():
+            todo = rows.index[~known.to_numpy()]
+            new = func(todo).reindex(todo)
+            if isinstance(new, pd.Series):
+                new = new.to_frame("value")
+            new.index = keys[~known].to_numpy()
+            done = pd.concat([done, new.astype(object)])
+            done = done[~done.index.duplicated(keep="last")]
+            stored = done.where(done.notnull(), None)
+            self._write(stored.rename_axis("key").reset_index(), path)
+
+        results = done.reindex(keys.to_numpy()).set_axis(rows.index)
+        if list(results.columns) == ["value"]:
+            return results["value"]
+        return results
+
+    def run_table(
+        self,
+        stage: str,
+        df: pd.DataFrame,
+        func: Callable,
+        resolved: str = None,
+    ) -> pd.DataFrame:
+        """
+        Run a stage which transforms a whole table; the stage is skipped if
+        it has already been run on the same table.
+
+        Parameters
+        ----------
+        stage : str
+            Stage's name
+        df : pd.DataFrame
+            Stage's input
+        func : Callable
+            Stage's function: takes df and returns a new DataFrame
+        resolved : str, optional
+            Column of the output storing the stage's results (only used to
+            count the rows resolved by the stage). The default is None.
+
+        Returns
+        -------
+        pd.DataFrame
+            Stage's output
+
+        """
+        with measure_stage(f"{self.name}:{stage}", len(df)) as info:
+            result = self._run_table(stage, df, func)
+            if resolved:
+                info["rows_out"] = result[resolved].notnull().sum()
+        return result
+
+    def _run_table(self, stage: str, df: pd.DataFrame, func: Callable):
+        if not self.directory:
+            return func(df)
+
+        m = hashlib.sha256()
+        m.update(",".join(map(str, df.columns)).encode("utf8"))
+        m.update(_hash_rows(df).to_numpy().tobytes())
+        path = self._path(f"{stage}-{m.hexdigest()[:16]}")
+        try:
+            result = pd.read_parquet(path)
+            logger.info("checkpoint %s: stage already handled", stage)
+            return result
+        except FileNotFoundError:
+            pass
+
+        result = func(df)
+        self._write(result, path)
+        return result
@@ -5,72 +5,160 @@ Created on Thu Jul  6 11:38:34 2023
 Module used to recognize cities.
 
 """
-from datetime import date, timedelta
-from functools import lru_cache
+
+import asyncio
+from datetime import date
+from functools import lru_cache, partial
 import hashlib
-import io
 import logging
 import os
+import re
 import socket
+import threading
 import time
-from typing import Union
-import warnings
+from typing import TYPE_CHECKING, Union
+from urllib.parse import urlparse
 
-import diskcache
-import geopandas as gpd
 import numpy as np
 import pandas as pd
-from pebble import ThreadPool
-from pynsee.geodata import get_geodata
-from pyproj import Transformer
-from requests_cache import CachedSession
 from requests import Session
 from rapidfuzz import fuzz
-from rapidfuzz.process import cdist
+from rapidfuzz.process import cdist, cpdist
 from tqdm import tqdm
 from unidecode import unidecode
 
-try:
-    # Optional dependencies
-    from geopy.extra.rate_limiter import RateLimiter
-    from geopy.geocoders import Nominatim
-except ModuleNotFoundError:
-    pass
+if TYPE_CHECKING:
+    import geopandas as gpd
 
 from french_cities import DIR_CACHE
-from french_cities.constants import THREADS
+from french_cities.async_tools import TokenBucket, run_coroutine
+from french_cities.caches import cache_expire, open_cache
+from french_cities.constants import (
+    BAN_CSV_BACKOFF,
+    BAN_CSV_MAX_BYTES,
+    BAN_CSV_MAX_ROWS,
+    BAN_CSV_RETRIES,
+    BAN_SEARCH_BACKOFF,
+    BAN_SEARCH_RATE,
+    BAN_SEARCH_RETRIES,
+    NOMINATIM_PUBLIC_DELAY,
+    NOMINATIM_URL,
+)
 from french_cities.vintage import set_vintage
 from french_cities.departement_finder import find_departements
+from french_cities.sessions import get_session
 from french_cities.utils import init_pynsee, silence_sirene_logs
-from french_cities.ultramarine_pseudo_cog import get_cities_and_ultramarines
-
+from french_cities.referential import get_cities_referential
+from french_cities.executor import get_executor, single_flight
+from french_cities.geocoders import Geocoder, GeocoderError, get_geocoder
+from french_cities.metrics import (
+    record_cache,
+    record_failure,
+    record_http,
+)
+from french_cities.checkpoint import Checkpoint
 
 logger = logging.getLogger(__name__)
 
+_user_agent = None
+
+
+def get_default_session() -> Session:
+    """
+    Get the web session used by default by find_city (a CachedSession with
+    30 days expiration, using http_proxy and https_proxy environment
+    variables, shared by the whole process).
+
+    Returns
+    -------
+    Session
+        Web session
+
+    """
+    # Note: results of BAN's CSV geocoder are cached on a row basis
+    return get_session("find-city", allowable_methods=("GET",))
+
 
 def get_machine_user_agent() -> str:
     """
     Get a fixed User Agent for a given machine. Used to fullfill Nominatim's
     usage policy.
 
+    The User Agent can be set with configure_user_agent, or with the
+    FRENCH_CITIES_USER_AGENT environment variable (read on each call).
+    Otherwise, it is computed once (from the machine's IP, or from its
+    hostname when no network route is available) and stored in the cache
+    directory.
+
     Returns
     -------
     str
         User-Agent string
     """
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    s.connect(("8.8.8.8", 80))
-    ip = s.getsockname()[0]
+    user_agent = _user_agent or os.environ.get("FRENCH_CITIES_USER_AGENT")
+    if user_agent:
+        return user_agent
+    return _get_stored_user_agent()
+
+
+def configure_user_agent(user_agent: str = None):
+    """
+    Set the User Agent sent to Nominatim by french-cities, for the whole
+    process.
+
+    Parameters
+    ----------
+    user_agent : str, optional
+        User Agent. The default is None (FRENCH_CITIES_USER_AGENT environment
+        variable, or User Agent computed for the machine).
+
+    Example
+    -------
+    >>> configure_user_agent("my-application-contact@example.org")
+
+    """
+    global _user_agent
+    _user_agent = user_agent
+    _get_stored_user_agent.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _get_stored_user_agent() -> str:
+    "User Agent computed for the machine, stored in the cache directory"
+    path = os.path.join(DIR_CACHE, "user-agent")
+    try:
+        with open(path, encoding="utf8") as f:
+            user_agent = f.read().strip()
+        if user_agent:
+            return user_agent
+    except OSError:
+        pass
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            identity = s.getsockname()[0]
+    except OSError:
+        # no route available (air-gapped machine for instance)
+        identity = socket.gethostname()
 
     m = hashlib.sha256()
-    m.update(bytes(ip, encoding="utf8"))
+    m.update(bytes(identity, encoding="utf8"))
     digest = m.hexdigest()
+    user_agent = f"french-cities-{digest}"
 
-    return f"french-cities-{digest}"
+    try:
+        os.makedirs(DIR_CACHE, exist_ok=True)
+        with open(path, "w", encoding="utf8") as f:
+            f.write(user_agent)
+    except OSError as exc:
+        logger.warning("Could not store User-Agent into %s: %s", path, exc)
+
+    return user_agent
 
 
 def _cleanup_results(
-    df: pd.DataFrame, alias_postcode: str, threads: int = THREADS
+    df: pd.DataFrame, alias_postcode: str, threads: int = None
 ) -> pd.DataFrame:
     """
     Quick and dirty function to remove multiple candidates for cities
@@ -89,7 +177,8 @@ def _cleanup_results(
     alias_postcode : str
         Field used to store the postcode
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
@@ -98,17 +187,7 @@ def _cleanup_results(
 
     """
 
-    init_pynsee()
-
-    cities = get_cities_and_ultramarines(date="*", threads=threads)
-    cities["TITLE_SHORT"] = (
-        cities["TITLE_SHORT"]
-        .str.upper()
-        .apply(unidecode)
-        .str.split(r"\W+")
-        .str.join(" ")
-        .str.strip(" ")
-    )
+    cities = get_cities_referential(threads=threads)
     cities = cities.loc[:, ["TITLE_SHORT", "CODE"]]
 
     df = df.drop_duplicates(keep="first")
@@ -154,19 +233,22 @@ def _cleanup_results(
         .drop_duplicates()
     )
 
-    dups["score"] = dups[["city_cleaned", "TITLE_SHORT"]].apply(
-        lambda xy: fuzz.token_sort_ratio(*xy), axis=1
+    # Score all pairs at once, then keep the best score of each group
+    # (using integer keys for the groups)
+    score = cpdist(
+        dups["city_cleaned"].fillna("").tolist(),
+        dups["TITLE_SHORT"].fillna("").tolist(),
+        scorer=fuzz.token_sort_ratio,
+        workers=1,  # Nota : workers=-1 currently crashes python
     )
+    groups = dups.groupby(keys, dropna=False, sort=False).ngroup().to_numpy()
+    candidates = score > 80
+    best = np.full(groups.max() + 1 if len(groups) else 0, -1.0)
+    np.maximum.at(best, groups[candidates], score[candidates])
+    ok = candidates & (score == best[groups])
 
-    # dups[["city_cleaned", "TITLE_SHORT", "score"]]
-    ok = (
-        dups[dups.score > 80]
-        .fillna("")
-        .groupby(keys, as_index=False)[dups.columns.tolist()]
-        .apply(lambda df: df[df["score"] == df["score"].max()])
-    )
-    ko = set(dups["index"]) - set(ok["index"])
-    df = df.drop(list(ko))
+    ko = np.setdiff1d(dups["index"].to_numpy(), dups["index"].to_numpy()[ok])
+    df = df.drop(ko)
 
     return df
 
@@ -185,7 +267,10 @@ def find_city(
     epsg: int = None,
     session: Session = None,
     use_nominatim_backend: bool = False,
-    threads: int = THREADS,
+    threads: int = None,
+    geocoder: Union[Geocoder, str] = None,
+    checkpoint_dir: str = None,
+    field_provenance: str = None,
 ) -> pd.DataFrame:
     """
     Find cities in a dataframe using multiple methods (either based on
@@ -248,14 +333,34 @@ def find_city(
         Requests Session to use for web queries to APIs. Note that pynsee
         (used under the hood for geolocation recognition) uses it's own
         session. The default is None (and will use a CachedSession with
-        30 days expiration)
+        30 days expiration). Only the default session's HTTP calls are
+        counted in the metrics (see french_cities.metrics): the session given
+        is left untouched.
     use_nominatim_backend : bool, optional
         If set to True, will try to use the Nominatim API in last resort. This
         might slow the process as the API's rate is on one request per second.
         Please read Nominatim Usage Policy at
         https://operations.osmfoundation.org/policies/nominatim/
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
+    geocoder : Union[Geocoder, str], optional
+        Geocoder backend used instead of BAN's public API. Either a Geocoder
+        instance or a string among 'ban', 'addok:<url>' (self-hosted addok
+        instance) or 'local:<directory>' (offline geocoding on BAN's
+        departmental dumps stored in that directory). The default is None
+        (FRENCH_CITIES_GEOCODER environment variable will be used if set,
+        BAN's public API otherwise).
+    checkpoint_dir : str, optional
+        If set, each resolution stage stores the results of the distinct keys
+        it handled into this directory: a restarted run with the same inputs
+        will skip the completed stages and keys. The default is None.
+    field_provenance : str, optional
+        If set, column to store the stage which resolved each row into
+        ("geoloc", "fuzzy", "ban-csv-<components>", "ban-individual-
+        <components>" or "nominatim-<component>"); the score of the match
+        (between 0 and 1, when the stage computes one) is stored into the
+        `f"{field_provenance}_score"` column. The default is None.
 
     Raises
     ------
@@ -272,10 +377,6 @@ def find_city(
 
     """
 
-    index_original_name = df.index.name
-    df.index.name = "#INDEX#"
-    df = df.reset_index(drop=False)
-
     init_pynsee()
 
     if year != "last":
@@ -304,47 +405,55 @@ def find_city(
         raise ValueError(msg)
 
     if not session:
-        session = CachedSession(
-            cache_name=os.path.join(DIR_CACHE, "find-city"),
-            allowable_methods=("GET", "POST"),
-            expire_after=timedelta(days=30),
-        )
-        proxies = {}
-        proxies["http"] = os.environ.get("http_proxy", None)
-        proxies["https"] = os.environ.get("https_proxy", None)
-        session.proxies.update(proxies)
+        session = get_default_session()
 
-    # User geolocation first
+    geocoder = get_geocoder(geocoder)
+    checkpoint = Checkpoint(
+        checkpoint_dir,
+        "find_city",
+        year=year,
+        epsg=epsg,
+        geocoder=geocoder.name,
+        use_nominatim_backend=use_nominatim_backend,
+    )
+
+    # User geolocation first (results are computed positionally, to be safe
+    # on dataframes with duplicated indexes)
+    candidat_0 = np.full(len(df), np.nan, dtype=object)
+    stages = np.full(len(df), np.nan, dtype=object)
+    scores = np.full(len(df), np.nan)
     if len({x, y} - columns) == 0 and epsg:
         # On peut travailler à partir de la géoloc
-        df = _find_from_geoloc(
-            epsg, df, year, x, y, field_output, threads=threads
-        ).rename({field_output: "candidat_0"}, axis=1)
-    try:
-        df["candidat_0"]
-    except KeyError:
-        df = df.assign(candidat_0=np.nan)
-
-    # Preprocess cities names
-    if city in set(df.columns):
-        ix = df[(df[city].notnull()) & (df.candidat_0.isnull())].index
-        unique = df.loc[ix, [city]].drop_duplicates(keep="first")
-        unique["city_cleaned"] = (
-            unique[city]
-            .str.replace(
-                r" \(.*\)$", "", regex=True
-            )  # Neuville-Housset (La) -> Neuville-Housset
-            .str.upper()
-            .apply(unidecode)
-            .str.split(r"\W+")
-            .str.join(" ")
-            .str.replace(r"(^|\s)(ST)\s", " SAINT ", regex=True)
-            .str.replace(r"(^|\s)(STE)\s", " SAINTE ", regex=True)
-            .str.replace(r"[0-9]* ?EME KM", "", regex=True)  # TAMPON 14EME KM
-            .str.strip(" ")
-            .str.replace(r" ?CEDEX$", "", regex=True)  # LOOS CEDEX -> LOOS
-        )
-        df = df.merge(unique, on=city, how="left")
+        located = df[[x, y]].reset_index(drop=True)
+        located = located[located[x].notnull() & located[y].notnull()]
+        if not located.empty:
+
+            def geoloc(index):
+                results = _find_from_geoloc(
+                    epsg,
+                    located.loc[index],
+                    year,
+                    x,
+                    y,
+                    field_output,
+                    threads=threads,
+                )
+                # a point on a boundary may be joined to multiple cities
+                return results[field_output].groupby(level=0).first()
+
+            results = checkpoint.run("geoloc", located, geoloc).dropna()
+            candidat_0[results.index] = results.to_numpy()
+            stages[results.index] = "geoloc"
+
+    # Columns updated in the returned dataframe
+    updated = {}
+
+    # Check that postcodes match 5 digits codes
+    if postcode in columns:
+        s = df[postcode]
+        ix = s.notnull()
+        if not (s[ix].str.len() == 5).all():
+            updated[postcode] = s.where(~ix, s.str.zfill(5))
 
     # Control which configuration can be used
     # Note that the order is relevant here, as this will determine the result's
@@ -355,280 +464,405 @@ def find_city(
         ((address, postcode, "city_cleaned"), None),
         ((dep, "city_cleaned"), "municipality"),
     ]
+    available = columns | {"city_cleaned"} if city in columns else columns
     for test_cols, type_ban_search in to_test:
-        try:
-            df.loc[:, test_cols]
-        except KeyError:
-            pass
-        else:
+        if set(test_cols) <= available:
             to_test_ok.append((test_cols, type_ban_search))
 
-    # Check that postcodes match 5 digits codes
-    try:
-        ix = df[df[postcode].notnull()].index
-        if not (df.loc[ix, postcode].str.len() == 5).all():
-            df.loc[ix, postcode] = df.loc[ix, postcode].str.zfill(5)
-    except KeyError:
-        pass
-
     components_kept = list(
         {field for test_cols, _ in to_test_ok for field in test_cols}
+        - {"city_cleaned"}
     )
 
-    init = pd.get_option("future.no_silent_downcasting")
-    pd.set_option("future.no_silent_downcasting", True)
+    # Note: mask keeps the dtypes (unlike replace, which would need the
+    # global future.no_silent_downcasting option)
     for f in components_kept:
-        df[f] = df[f].replace("", np.nan)
-    pd.set_option("future.no_silent_downcasting", init)
+        values = updated.get(f, df[f])
+        updated[f] = values.mask(values == "")
+
+    best = candidat_0
+    missing = pd.isnull(candidat_0)
+    if city in columns and missing.any():
+        # Build the table of distinct lookup keys (among rows not already
+        # located) once and for all: every lexical stage will be run on this
+        # table only.
+        lookup = pd.DataFrame(
+            {f: updated.get(f, df[f]).to_numpy() for f in components_kept}
+        )
+
+        # Preprocess cities names (on unique values only)
+        codes, uniques = pd.factorize(df[city])
+        cleaned = _clean_cities_labels(pd.Series(uniques, dtype=object))
+        lookup["city_cleaned"] = (
+            cleaned.replace("", np.nan).reindex(codes).to_numpy()
+        )
+        lookup = lookup[missing]
+
+        keys = lookup.groupby(
+            components_kept + ["city_cleaned"], dropna=False, sort=False
+        ).ngroup()
+        first = ~keys.duplicated()
+        addresses = lookup[first].assign(**{"#KEY#": keys[first]})
+        addresses = addresses.reset_index(drop=True)
+
+        addresses = _resolve_lookup_keys(
+            addresses=addresses,
+            components_kept=components_kept,
+            to_test_ok=to_test_ok,
+            year=year,
+            dep=dep,
+            postcode=postcode,
+            session=session,
+            use_nominatim_backend=use_nominatim_backend,
+            threads=threads,
+            geocoder=geocoder,
+            checkpoint=checkpoint,
+        )
+
+        # Expand the results back to the original rows with one final take
+        # (keeping the first result of each key)
+        results = (
+            addresses[addresses["best"].notnull()]
+            .drop_duplicates("#KEY#")
+            .set_index("#KEY#")
+            .reindex(range(keys.max() + 1))
+        )
+        take = keys.to_numpy()
+        best = best.copy()
+        best[missing] = results["best"].to_numpy().take(take)
+        stages[missing] = results["#STAGE#"].to_numpy().take(take)
+        scores[missing] = results["#SCORE#"].to_numpy(float).take(take)
+
+    updated = {k: np.asarray(v) for k, v in updated.items()}
+    updated[field_output] = np.where(pd.isnull(best), np.nan, best)
+    if field_provenance:
+        updated[field_provenance] = stages
+        updated[f"{field_provenance}_score"] = scores
+    return df.assign(**updated)
+
 
-    addresses = df.loc[:, components_kept + ["candidat_0"]].drop_duplicates()
+def _clean_city_label(x: str) -> str:
+    """
+    Clean a city's label before any lexical recognition (remove any
+    parenthesis, accents, usual abbreviations, ...)
+    """
+    # Neuville-Housset (La) -> Neuville-Housset
+    x = re.sub(r" \(.*\)$", "", x)
+    x = " ".join(re.split(r"\W+", unidecode(x.upper())))
+    x = re.sub(r"(^|\s)(ST)\s", " SAINT ", x)
+    x = re.sub(r"(^|\s)(STE)\s", " SAINTE ", x)
+    x = re.sub(r"[0-9]* ?EME KM", "", x)  # TAMPON 14EME KM
+    x = x.strip(" ")
+    x = re.sub(r" ?CEDEX$", "", x)  # LOOS CEDEX -> LOOS
+    return x
+
+
+def _clean_cities_labels(s: pd.Series) -> pd.Series:
+    """
+    Clean cities' labels before any lexical recognition (see
+    _clean_city_label)
+    """
+    return s.map(_clean_city_label, na_action="ignore")
+
+
+def _concat_columns(df: pd.DataFrame, columns: list) -> pd.Series:
+    """
+    Concatenate multiple columns into a single string (using whitespaces as
+    separator) and return the result as pd.Series
+    """
+    # https://stackoverflow.com/questions/39291499#answer-62135779
+    return pd.Series(
+        map(" ".join, df[list(columns)].fillna("").values.tolist()),
+        index=df.index,
+        dtype=object,
+    )
+
+
+def _resolve_lookup_keys(
+    addresses: pd.DataFrame,
+    components_kept: list,
+    to_test_ok: list,
+    year: str,
+    dep: Union[str, bool],
+    postcode: Union[str, bool],
+    session: Session,
+    use_nominatim_backend: bool,
+    threads: int = None,
+    geocoder: Geocoder = None,
+    checkpoint: Checkpoint = None,
+) -> pd.DataFrame:
+    """
+    Run every lexical resolution stage on the table of distinct lookup keys.
+
+    Each stage only processes keys which are not resolved yet, hence the
+    result's preference is determined by the stages' order.
+
+    Parameters
+    ----------
+    addresses : pd.DataFrame
+        Table of distinct lookup keys (expected columns are components_kept,
+        'city_cleaned' and '#KEY#')
+    components_kept : list
+        Fields used to build the lookup keys
+    to_test_ok : list
+        BAN configurations to test, as a list of tuples (components,
+        type_ban_search)
+    year : str
+        Desired vintage ("last" or castable to int)
+    dep : Union[str, bool]
+        Field containing the department values (False if not available)
+    postcode : Union[str, bool]
+        Field containing the post office codes (False if not available)
+    session : Session
+        Web session
+    use_nominatim_backend : bool
+        If set to True, will try to use the Nominatim API in last resort.
+    threads : int, optional
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
+    geocoder : Geocoder, optional
+        Geocoder backend. The default is None (see get_geocoder).
+    checkpoint : Checkpoint, optional
+        Checkpoint storing each stage's results. The default is None.
+
+    Returns
+    -------
+    addresses : pd.DataFrame
+        Table of distinct lookup keys, with the resolved codes in column
+        'best', the stages which resolved them in column '#STAGE#' and the
+        scores of the matches in column '#SCORE#' (note that keys may be
+        duplicated when multiple departments have been computed from a
+        postcode)
+
+    """
 
     # Add dep recognition if not already there, just to check the result's
     # coherence (and NOT to compute city recognition using it!)
-    drop_dep = False
     if not dep:
-        drop_dep = True
         dep = "dep"
-    try:
-        if dep not in components_kept:
-            addresses = find_departements(
-                addresses,
-                postcode,
-                dep,
-                "postcode",
-                session,
-                authorize_duplicates=True,
-                threads=threads,
-            )
-    except KeyError:
-        pass
-
+    if dep not in components_kept and postcode in components_kept:
+        addresses = find_departements(
+            addresses,
+            postcode,
+            dep,
+            "postcode",
+            session,
+            authorize_duplicates=True,
+            threads=threads,
+        )
+    if checkpoint is None:
+        checkpoint = Checkpoint(None, "find_city")
     addresses = addresses.drop_duplicates(keep="first")
+    addresses["best"] = pd.Series(np.nan, index=addresses.index, dtype=object)
+    addresses["#STAGE#"] = pd.Series(
+        np.nan, index=addresses.index, dtype=object
+    )
+    addresses["#SCORE#"] = np.nan
+
+    def store(stage, found):
+        "Store a stage's results (codes and optional scores) into addresses"
+        if isinstance(found, pd.Series):
+            found = found.to_frame("best")
+        found = found[found["best"].notnull()]
+        addresses.loc[found.index, "best"] = found["best"]
+        addresses.loc[found.index, "#STAGE#"] = stage
+        if "score" in found.columns:
+            addresses.loc[found.index, "#SCORE#"] = pd.to_numeric(
+                found["score"], errors="coerce"
+            )
 
-    # Where no results, check directly from INSEE's website for obsolete
-    # cities (using dep & city) using fuzzy matching
-    ix = addresses[addresses["candidat_0"].isnull()].index
+    # Check directly from INSEE's website for obsolete cities (using dep &
+    # city) using fuzzy matching
+    ix = addresses[addresses["city_cleaned"].notnull()].index
     if len(ix) > 0:
+        if dep not in addresses.columns:
+            addresses[dep] = np.nan
         missing = (
             addresses.loc[ix, [dep, "city_cleaned"]]
             .rename({dep: "#dep#"}, axis=1)
             .drop_duplicates()
         )
-        addresses = _find_from_fuzzymatch_cities_names(
-            year,
-            missing,
-            "candidat_missing",
+        addresses = checkpoint.run_table(
+            "fuzzy",
             addresses,
-            dep,
-            postcode,
-            threads=threads,
+            partial(
+                _find_from_fuzzymatch_cities_names,
+                year,
+                missing,
+                "candidat_missing",
+                alias_dep=dep,
+                alias_postcode=(
+                    postcode if postcode in addresses.columns else None
+                ),
+                threads=threads,
+            ),
+            resolved="candidat_missing",
         )
+        addresses["best"] = addresses.pop("candidat_missing")
+        addresses["#SCORE#"] = addresses.pop("candidat_missing_score")
+        addresses.loc[addresses["best"].notnull(), "#STAGE#"] = "fuzzy"
+
+    # Note: BAN's CSV geocoder uses every column sent, so keep the
+    # columns of the lookup keys
+    columns = [
+        x
+        for x in addresses.columns
+        if x not in {"#KEY#", "best", "#STAGE#", "#SCORE#"}
+    ]
 
-        addresses = addresses.drop_duplicates()
-
-        candidats = ["candidat_0", "candidat_missing"]
-        addresses["candidat_0"] = _combine(addresses, candidats)
-        addresses = addresses.drop("candidat_missing", axis=1)
-
-    for k, (components, type_ban_search) in enumerate(to_test_ok):
-        cols_candidates = [
-            x
-            for x in addresses.columns
-            if isinstance(x, str) and x.startswith("candidat_")
-        ]
-
+    for components, type_ban_search in to_test_ok:
+        components = list(components)
+        stage = "+".join(components)
         ix = addresses[
-            np.all(
-                [addresses[col].isnull() for col in cols_candidates], axis=0
-            )
-            & np.all([addresses[col].notnull() for col in components], axis=0)
+            addresses["best"].isnull()
+            & addresses[components].notnull().all(axis=1)
         ].index
         if len(ix) == 0:
-            addresses[f"candidat_{k+1}"] = np.nan
             continue
 
-        temp_addresses = addresses.loc[ix].drop(cols_candidates, axis=1)
-        temp_addresses = temp_addresses.drop_duplicates().fillna("")
+        full = _concat_columns(addresses.loc[ix], components)
 
-        def list_map(df, columns):
-            # contatenation of multiple columns
-            "https://stackoverflow.com/questions/39291499#answer-62135779"
-            return pd.Series(
-                map(" ".join, df[list(columns)].values.tolist()),
-                index=df.index,
+        def ban_csv(index):
+            temp_addresses = addresses.loc[index, columns].fillna("")
+            temp_addresses["full"] = full.loc[index]
+            temp_addresses = temp_addresses.drop_duplicates(
+                "full", keep="first"
             )
+            results_api = _query_BAN_csv_geocoder(
+                addresses=temp_addresses,
+                components=components,
+                session=session,
+                dep=dep,
+                city="city_cleaned",
+                geocoder=geocoder,
+            )
+            results = _filter_BAN_results(
+                results_api=results_api,
+                session=session,
+                dep=dep,
+                threads=threads,
+            )
+            return results.reindex(full.loc[index]).set_axis(index)
 
-        if "full" in set(temp_addresses.columns):
-            temp_addresses = temp_addresses.drop("full", axis=1)
-        temp_addresses = temp_addresses.join(
-            list_map(temp_addresses.copy(), components).to_frame("full")
-        )
-        temp_addresses = temp_addresses.drop_duplicates("full", keep="first")
-
-        if "full" in set(addresses.columns):
-            addresses = addresses.drop("full", axis=1)
-        addresses = addresses.join(
-            list_map(addresses.fillna("").copy(), components).to_frame("full")
-        )
-
-        results_api = _query_BAN_csv_geocoder(
-            addresses=temp_addresses,
-            components=components,
-            session=session,
-            dep=dep,
-            city="city_cleaned",
-        )
-        addresses = _filter_BAN_results(
-            results_api=results_api,
-            session=session,
-            rename_candidat=f"candidat_{k+1}",
-            addresses=addresses,
-            dep=dep,
-            threads=threads,
+        store(
+            f"ban-csv-{stage}",
+            checkpoint.run(
+                f"ban-csv-{stage}", addresses.loc[ix, columns], ban_csv
+            ),
         )
 
         if type_ban_search == "municipality":
-            try:
-                addresses[f"candidat_{k+1}"]
-            except KeyError:
-                pass
-            else:
-                ix = addresses[
-                    np.all(
-                        [addresses[col].isnull() for col in cols_candidates],
-                        axis=0,
-                    )
-                    & np.all(
-                        [addresses[col].notnull() for col in components],
-                        axis=0,
-                    )
-                    & (addresses[f"candidat_{k+1}"].isnull())
-                ].index
-
-                if len(ix) > 0:
-                    # Try to use individual geocoding specifying target type
-                    # (ie. "municipality" to get better results)
-
+            ix = addresses[
+                addresses["best"].isnull()
+                & addresses[components].notnull().all(axis=1)
+            ].index
+            if len(ix) > 0:
+                # Try to use individual geocoding specifying target type
+                # (ie. "municipality" to get better results)
+
+                def ban_individual(index):
+                    temp_addresses = addresses.loc[
+                        index, [dep, "city_cleaned"]
+                    ]
+                    temp_addresses["full"] = full.loc[index]
                     results_api = _query_BAN_individual_geocoder(
-                        addresses=addresses.loc[ix],
+                        addresses=temp_addresses,
                         components=components,
                         session=session,
                         dep=dep,
                         threads=threads,
+                        geocoder=geocoder,
                     )
-                    addresses = _filter_BAN_results(
+                    results = _filter_BAN_results(
                         results_api=results_api,
                         session=session,
-                        rename_candidat=f"candidat_{k+1}",
-                        addresses=addresses,
                         dep=dep,
                         threads=threads,
                     )
-
-    # Proceed in two steps to keep best result (in case there are results from
-    # geolocation on lines with nothing other than coordinates)
-    candidats = sorted(
-        [x for x in addresses.columns if x.startswith("candidat")]
-    )
-    addresses["best"] = _combine(addresses, candidats)
-    addresses = addresses.drop(candidats, axis=1)
-    try:
-        addresses = addresses.drop("full", axis=1)
-    except KeyError:
-        pass
-    addresses = addresses.drop_duplicates(components_kept)
-
-    df = df.merge(
-        addresses.replace("", np.nan), how="left", on=components_kept
-    )
-    df["best"] = _combine(df, ["candidat_0", "best"])
-    df = df.drop("candidat_0", axis=1)
+                    return results.reindex(full.loc[index]).set_axis(index)
+
+                store(
+                    f"ban-individual-{stage}",
+                    checkpoint.run(
+                        f"ban-individual-{stage}",
+                        addresses.loc[ix, columns],
+                        ban_individual,
+                    ),
+                )
 
     # Where still no results, give a go at individual requests through geopy
     # with Nominatim geocodage (if use_nominatim_backend set to True)
-    ix = df[df["best"].isnull()].index
+    ix = addresses[addresses["best"].isnull()].index
     if use_nominatim_backend and len(ix) > 0:
 
-        # Cache pynsee adminexpress geodata
-        logger.info("Retrieving adminexpress geodataframes with pynsee")
-        cities = get_geodata("ADMINEXPRESS-COG-CARTO.LATEST:commune")
-        cities = gpd.GeoDataFrame(cities).set_crs("EPSG:3857")
+        @lru_cache(maxsize=1)
+        def get_cities():
+            import geopandas as gpd
+            from pynsee.geodata import get_geodata
 
-        # Hack as the original dataset has evolved (insee_com -> code_insee)
-        cities = cities.rename({"code_insee": "insee_com"}, axis=1)
-        logger.info("done")
+            # Cache pynsee adminexpress geodata
+            logger.info("Retrieving adminexpress geodataframes with pynsee")
+            cities = get_geodata("ADMINEXPRESS-COG-CARTO.LATEST:commune")
+            cities = gpd.GeoDataFrame(cities).set_crs("EPSG:3857")
 
-        for use in [postcode, dep]:
-            ix = df[df["best"].isnull()].index
+            # Hack as the original dataset has evolved (insee_com ->
+            # code_insee)
+            cities = cities.rename({"code_insee": "insee_com"}, axis=1)
+            logger.info("done")
+            return cities
 
-            try:
-                df[use]
-            except KeyError:
-                continue
-            missing = df.loc[ix, [use, "city_cleaned"]]
-            missing = missing.drop_duplicates(keep="first")
-            missing["query"] = missing[use] + " " + missing["city_cleaned"]
-            ix_empty_query = missing[missing["query"].isnull()].index
-            missing = missing.drop(ix_empty_query)
-            if missing.empty:
+        for use in [postcode, dep]:
+            if use not in addresses.columns:
                 continue
-            missing = _find_with_nominatim_geolocation(
-                year=year,
-                look_for=missing[["query"]],
-                alias="insee_com_nominatim",
-                cities=cities,
-                threads=threads,
+            ix = addresses[addresses["best"].isnull()].index
+            query = (
+                addresses.loc[ix, use]
+                + " "
+                + addresses.loc[ix, "city_cleaned"]
             )
-            if missing.empty:
+            query = query.dropna()
+            if query.empty:
                 continue
-            missing = find_departements(
-                missing,
-                source="insee_com_nominatim",
-                alias="dep_nominatim",
-                type_field="insee",
-                threads=threads,
-            )
-            temp = df.loc[ix]
-            temp["query"] = temp[use] + " " + temp["city_cleaned"]
-            temp = temp.merge(missing, on="query")
-            ix = temp[
-                (temp["insee_com_nominatim"].notnull())
-                & (temp[dep] == temp["dep_nominatim"])
-            ].index
-            temp = temp.loc[ix]
-            df = df.merge(
-                temp[[use, "city_cleaned", "insee_com_nominatim"]],
-                on=[use, "city_cleaned"],
-                how="left",
-            )
-            df["best"] = _combine(df, ["best", "insee_com_nominatim"])
-            df = df.drop("insee_com_nominatim", axis=1)
-
-    df = df.drop("city_cleaned", axis=1)
-    df = df.rename({"best": field_output}, axis=1)
-
-    if drop_dep:
-        df = df.drop(dep, axis=1)
-
-    df = df.set_index("#INDEX#")
-    df.index.name = index_original_name
-    return df
 
+            def nominatim(index):
+                missing = _find_with_nominatim_geolocation(
+                    year=year,
+                    look_for=query.loc[index]
+                    .drop_duplicates()
+                    .to_frame("query"),
+                    alias="insee_com_nominatim",
+                    cities=get_cities(),
+                    threads=threads,
+                )
+                if missing.empty:
+                    return pd.Series(dtype=object)
+                missing = find_departements(
+                    missing,
+                    source="insee_com_nominatim",
+                    alias="dep_nominatim",
+                    type_field="insee",
+                    threads=threads,
+                )
+                missing = missing[missing["insee_com_nominatim"].notnull()]
+                missing = missing.drop_duplicates(["query", "dep_nominatim"])
+                temp = (
+                    addresses.loc[index, [dep]]
+                    .assign(query=query.loc[index])
+                    .reset_index(drop=False)
+                    .merge(missing, on="query")
+                )
+                temp = temp[temp[dep] == temp["dep_nominatim"]]
+                temp = temp.drop_duplicates("index").set_index("index")
+                return temp["insee_com_nominatim"]
+
+            results = checkpoint.run(
+                f"nominatim-{use}",
+                addresses.loc[query.index, columns],
+                nominatim,
+            )
+            store(f"nominatim-{use}", results)
 
-def _combine(df: pd.DataFrame, columns: list) -> pd.Series:
-    """
-    coalesce multiple columns (first not null encountered from left to right
-    is kept) and return the result as pd.Series
-    """
-
-    columns = [x for x in columns if x in set(df.columns)]
-    first, *next_ = columns
-    s = df[first]
-    for field in next_:
-        with warnings.catch_warnings():
-            warnings.simplefilter(action="ignore", category=FutureWarning)
-            s = s.combine_first(df[field])
-    return s
+    return addresses
 
 
 @lru_cache(maxsize=None)
@@ -640,16 +874,65 @@ def warn_nominatim():
     )
 
 
+def _get_nominatim_endpoint() -> tuple:
+    """
+    Get the Nominatim endpoint to use (FRENCH_CITIES_NOMINATIM_URL environment
+    variable if set, OSM's public server otherwise).
+
+    Returns
+    -------
+    tuple
+        (scheme, domain, public) where public is True if the endpoint is
+        OSM's public server (which usage policy has to be respected)
+
+    """
+    url = os.environ.get("FRENCH_CITIES_NOMINATIM_URL", NOMINATIM_URL)
+    parsed = urlparse(url if "://" in url else f"https://{url}")
+    domain = (parsed.netloc + parsed.path).rstrip("/")
+    public = domain == urlparse(NOMINATIM_URL).netloc
+    return parsed.scheme, domain, public
+
+
+def _normalize_nominatim_query(x: str) -> str:
+    "Normalize a query, to be used as key in Nominatim's store"
+    return " ".join(re.split(r"\W+", unidecode(x).upper())).strip()
+
+
+_nominatim_lock = threading.Lock()
+_nominatim_last_call = {}
+
+
+def _wait_nominatim_slot(domain: str):
+    """
+    Wait until a request can be sent to a public Nominatim server: requests
+    are spaced by NOMINATIM_PUBLIC_DELAY seconds across every call and thread
+    of the process.
+    """
+    with _nominatim_lock:
+        last = _nominatim_last_call.get(domain)
+        if last is not None:
+            delay = last + NOMINATIM_PUBLIC_DELAY - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        _nominatim_last_call[domain] = time.monotonic()
+
+
 def _find_with_nominatim_geolocation(
     year: str,
     look_for: pd.DataFrame,
     alias: str,
-    cities: gpd.GeoDataFrame,
-    threads: int = THREADS,
+    cities: "gpd.GeoDataFrame",
+    threads: int = None,
 ) -> pd.DataFrame:
     """
     Use Nominatim API to geolocate rows of the dataframe. This can be a lengthy
-    process.
+    process when using OSM's public server, as its usage policy restricts the
+    rate to one request per second; when a private Nominatim is configured
+    (using FRENCH_CITIES_NOMINATIM_URL environment variable), requests are
+    sent concurrently without throttling.
+
+    Results are stored (as tuples (latitude, longitude, type)) on the basis of
+    the normalized queries, each distinct query being sent only once.
 
     Parameters
     ----------
@@ -664,7 +947,8 @@ def _find_with_nominatim_geolocation(
     cities : gpd.GeoDataFrame
         Adminexpress geodataset retrieved with pynsee
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
@@ -674,27 +958,37 @@ def _find_with_nominatim_geolocation(
 
     """
 
-    warn_nominatim()
+    scheme, domain, public = _get_nominatim_endpoint()
+    host = urlparse(f"{scheme}://{domain}").hostname
+    if public:
+        warn_nominatim()
     try:
-        geolocator = Nominatim(user_agent=get_machine_user_agent())
-    except NameError:
+        # Optional dependency
+        from geopy.geocoders import Nominatim
+    except ModuleNotFoundError:
         logger.error(
             "geopy not installed - please install optional dependencies "
             "to use Nominatim geocoder with: pip install french-cities[full]"
         )
         return pd.DataFrame()
+    geolocator = Nominatim(
+        user_agent=get_machine_user_agent(), domain=domain, scheme=scheme
+    )
 
-    cache_nominatim = diskcache.Cache(os.path.join(DIR_CACHE, "nominatim"))
+    def geocode(*args, **kwargs):
+        # Respect the public server's usage policy (no throttling otherwise)
+        if public:
+            _wait_nominatim_slot(domain)
+        return geolocator.geocode(*args, **kwargs)
 
     def french_cities_geocoder(x):
         try:
-            ret = cache_nominatim[x]
-        except KeyError:
             # Look first at settlements
             # doc : A featureType of settlement selects any human inhabited
             # feature from 'state' down to 'neighbourhood'.
             # https://nominatim.org/release-docs/latest/api/Search/
-            ret = geolocator.geocode(
+            record_http(host)
+            ret = geocode(
                 x,
                 language="fr",
                 country_codes="fr",
@@ -702,40 +996,61 @@ def _find_with_nominatim_geolocation(
             )
             if not ret:
                 # if no settlement found, search any kind of location
-                time.sleep(1)
-                ret = geolocator.geocode(
-                    x,
-                    language="fr",
-                    country_codes="fr",
-                )
-            cache_nominatim.set(x, ret, expire=3600 * 24 * 30)
-            logger.debug("Nominatim: new query, waiting !")
-            time.sleep(1)
-        return ret
-
-    # deactivate the minimum delay as it is should be triggered inside
-    # french_cities_geocoder
-    func = RateLimiter(french_cities_geocoder, min_delay_seconds=0)
+                record_http(host)
+                ret = geocode(x, language="fr", country_codes="fr")
+        except Exception as exc:
+            logger.error("Nominatim failed to geocode %s: %s", x, exc)
+            return None
+        if not ret:
+            # store missing results too (as empty tuples)
+            return ()
+        return (ret.latitude, ret.longitude, ret.raw.get("type"))
+
+    queries = look_for["query"].map(_normalize_nominatim_query)
+
+    cache_nominatim = open_cache("nominatim")
+    prefix = f"{domain}|"
+    results = {}
+    for query in queries.unique():
+        ret = cache_nominatim.get(prefix + query)
+        if ret is not None:
+            results[query] = ret
+    new_queries = [x for x in queries.unique() if x not in results]
+    record_cache("nominatim", hits=len(results), misses=len(new_queries))
+
+    if public and new_queries:
+        estimated_time = len(new_queries) / 60
+        logger.warning(
+            "Nominatim API will perform requests at a rate of one request "
+            "per second : this task may take up to %s min...",
+            round(estimated_time) + 1,
+        )
 
-    estimated_time = len(look_for) / 60
-    logger.warning(
-        "Nominatim API will perform requests at a rate of one request "
-        "per second : this task may take up to %s min "
-        "(estimation without cache processing)...",
-        round(estimated_time) + 1,
+    desc = "Querying Nominatim"
+    new_results = get_executor().map(
+        "nominatim",
+        french_cities_geocoder,
+        new_queries,
+        max_workers=1 if public else threads,
     )
-
-    tqdm.pandas(desc="Querying Nominatim", leave=False)
-    results = look_for["query"].progress_apply(func)
+    for query, ret in zip(
+        new_queries,
+        tqdm(new_results, total=len(new_queries), desc=desc, leave=False),
+    ):
+        if ret is None:
+            continue
+        results[query] = ret
+        cache_nominatim.set(
+            prefix + query, ret, expire=cache_expire("nominatim")
+        )
 
     cache_nominatim.close()
 
-    look_for = look_for.assign(results=results)
-    ix = look_for[look_for.results.notnull()].index
-    for f in ["latitude", "longitude"]:
-        look_for.loc[ix, f] = look_for.loc[ix, "results"].apply(
-            lambda loc: getattr(loc, f)
-        )
+    located = queries.map(lambda x: results.get(x) or (np.nan, np.nan, None))
+    look_for = look_for.assign(
+        latitude=[x[0] for x in located],
+        longitude=[x[1] for x in located],
+    )
     logger.info("done with Nominatim")
 
     look_for = _find_from_geoloc(
@@ -748,7 +1063,7 @@ def _find_with_nominatim_geolocation(
         cities=cities,
         threads=threads,
     )
-    look_for = look_for.drop(["latitude", "longitude", "results"], axis=1)
+    look_for = look_for.drop(["latitude", "longitude"], axis=1)
     return look_for
 
 
@@ -759,7 +1074,7 @@ def _find_from_fuzzymatch_cities_names(
     addresses: pd.DataFrame,
     alias_dep: str,
     alias_postcode: str,
-    threads: int = THREADS,
+    threads: int = None,
 ) -> pd.DataFrame:
     """
     Use fuzzy matching to retrieve cities from their names to find best
@@ -782,40 +1097,24 @@ def _find_from_fuzzymatch_cities_names(
     alias_postcode : str
         field used to store the postcode in addresses
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
     match : pd.DataFrame
         DataFrame of positive matches (ie look_for + one mor column under the
-        label `alias`)
+        label `alias` and the scores of the matches, between 0 and 1, under
+        the label f"{alias}_score")
 
     """
-    init_pynsee()
-
-    df = get_cities_and_ultramarines(date="*", threads=threads)
-    df["TITLE_SHORT"] = (
-        df["TITLE_SHORT"]
-        .str.upper()
-        .apply(unidecode)
-        .str.split(r"\W+")
-        .str.join(" ")
-        .str.strip(" ")
-    )
-    df = df.loc[:, ["TITLE_SHORT", "CODE"]]
-
-    df = find_departements(
-        df,
-        source="CODE",
-        alias="dep",
-        type_field="insee",
-        do_set_vintage=False,
-        threads=threads,
-    )
+    df = get_cities_referential(threads=threads)
+    df = df.loc[:, ["TITLE_SHORT", "CODE", "dep"]]
     df = df.drop_duplicates(["TITLE_SHORT", "dep"])
     df = df.reset_index(drop=False)
 
     results = []
+    scores = []
     desc = "fuzzy matching cities / dep"
     for dep in tqdm(look_for["#dep#"].unique(), desc=desc, leave=False):
         if not pd.isnull(dep):
@@ -851,6 +1150,7 @@ def _find_from_fuzzymatch_cities_names(
             )
             this_result = this_result.dropna()
             results.append(this_result)
+            scores.append(best.loc[this_result.index])
         except ValueError:
             pass
 
@@ -884,6 +1184,7 @@ def _find_from_fuzzymatch_cities_names(
             )
             this_result = this_result.dropna()
             results.append(this_result)
+            scores.append(best.loc[this_result.index])
         except ValueError:
             continue
 
@@ -893,7 +1194,11 @@ def _find_from_fuzzymatch_cities_names(
     except ValueError:
         # No objects to concatenate
         addresses[alias] = np.nan
+        addresses[f"{alias}_score"] = np.nan
     else:
+        scores = look_for.join(
+            (pd.concat(scores) / 100).to_frame(f"{alias}_score"), how="inner"
+        ).rename({"#dep#": alias_dep}, axis=1)
         results = results.str[1]
 
         results = look_for.join(results.to_frame("CODE"))
@@ -906,9 +1211,6 @@ def _find_from_fuzzymatch_cities_names(
             results = _cleanup_results(
                 results, alias_postcode=alias_postcode, threads=threads
             )
-        else:
-            pass
-
         try:
             year = int(year)
         except ValueError:
@@ -924,7 +1226,18 @@ def _find_from_fuzzymatch_cities_names(
                 how="inner",
             )
         else:
-            addresses = results
+            addresses = addresses.merge(
+                results, on=[alias_dep, "city_cleaned"], how="left"
+            )
+
+        # Scores of the matches (the matched code being unique for each pair
+        # of department and label)
+        addresses = addresses.merge(
+            scores, on=[alias_dep, "city_cleaned"], how="left"
+        )
+        addresses[f"{alias}_score"] = addresses[f"{alias}_score"].where(
+            addresses["CODE"].notnull()
+        )
 
     addresses = addresses.rename({"CODE": alias}, axis=1)
     return addresses
@@ -937,8 +1250,8 @@ def _find_from_geoloc(
     x: str = "x",
     y: str = "y",
     field_output: str = "insee_com",
-    cities: gpd.GeoDataFrame = None,
-    threads: int = THREADS,
+    cities: "gpd.GeoDataFrame" = None,
+    threads: int = None,
 ) -> pd.DataFrame:
     """
     Find cities codes from coordinates using a spatial join.
@@ -970,7 +1283,8 @@ def _find_from_geoloc(
         Adminexpress geodataset retrieved with pynsee. If None, will be
         retrieved later on. None by default.
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Raises
     ------
@@ -983,6 +1297,9 @@ def _find_from_geoloc(
         output DataFrame with `field_output` containing cities' codes
 
     """
+    import geopandas as gpd
+    from pynsee.geodata import get_geodata
+    from pyproj import Transformer
 
     logger.info("find city through geolocation...")
 
@@ -1031,15 +1348,97 @@ def _find_from_geoloc(
     return df
 
 
+def _split_in_chunks(df: pd.DataFrame, max_rows: int, max_bytes: int) -> list:
+    """
+    Split a DataFrame into chunks, bounded both by a number of rows and by
+    an (approximative) size of the CSV which will be uploaded.
+    """
+    if df.empty:
+        return []
+    sample = df.head(1000)
+    row_size = len(sample.to_csv(index=False, header=False)) / len(sample)
+    rows = int(max(1, min(max_rows, max_bytes // max(row_size, 1))))
+    return [chunk for _, chunk in df.groupby(np.arange(len(df)) // rows)]
+
+
+def _post_BAN_csv_chunk(
+    chunk: pd.DataFrame,
+    session: Session,
+    geocoder: Geocoder,
+    retries: int = BAN_CSV_RETRIES,
+    backoff: float = BAN_CSV_BACKOFF,
+) -> pd.DataFrame:
+    """
+    Query the CSV geocoder with a chunk of addresses, retrying (with an
+    exponential backoff) on network errors, rate limits (HTTP 429) and server
+    errors.
+
+    Parameters
+    ----------
+    chunk : pd.DataFrame
+        Addresses to query the API from.
+    session : Session
+        Web session
+    geocoder : Geocoder
+        Geocoder backend
+    retries : int, optional
+        Maximum number of retries. The default is 5.
+    backoff : float, optional
+        Initial delay (in seconds) between two attempts, doubled at each new
+        attempt. The default is 1.
+
+    Returns
+    -------
+    pd.DataFrame
+        Parsed results (columns ['full', 'result_score', 'result_city',
+        'result_citycode']), or None if the chunk failed.
+
+    """
+    # Concurrent callers sending the same chunk share one query
+    key = (
+        geocoder.name,
+        "search/csv/",
+        hashlib.sha256(chunk.to_csv(index=False).encode("utf8")).hexdigest(),
+    )
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            return single_flight(key, geocoder.csv, chunk, session)
+        except GeocoderError as exc:
+            logger.warning("CSV geocoder failed: %s", exc)
+            if not exc.retryable:
+                # not worth retrying
+                break
+
+    logger.error(
+        "Failed to query the CSV geocoder with a chunk of %s addresses",
+        len(chunk),
+    )
+    return None
+
+
 def _query_BAN_csv_geocoder(
     addresses: pd.DataFrame,
     components: list,
     session: Session,
     dep: str,
     city: str,
+    geocoder: Geocoder = None,
+    max_rows: int = BAN_CSV_MAX_ROWS,
+    max_bytes: int = BAN_CSV_MAX_BYTES,
+    concurrency: int = None,
 ) -> pd.DataFrame:
     """
-    Query the adresse API (BAN = Base Adresse Nationale) CSV geocoder.
+    Query the adresse API (BAN = Base Adresse Nationale) CSV geocoder, or any
+    other geocoder backend.
+
+    The addresses are split into size-bounded chunks, which are sent
+    concurrently. Each chunk is retried on failure; a chunk failing despite
+    the retries will be logged and skipped (its addresses will be left
+    without results) without losing the results of the other chunks. The
+    number of addresses skipped is reported (see french_cities.metrics) and
+    stored in the "failed_rows" attribute of the result.
 
     Parameters
     ----------
@@ -1054,77 +1453,198 @@ def _query_BAN_csv_geocoder(
         Column label containing the departements' codes
     city : str
         Column label containing the cities' labels
+    geocoder : Geocoder, optional
+        Geocoder backend. The default is None (see get_geocoder).
+    max_rows : int, optional
+        Maximum number of addresses sent in a single chunk. The default is
+        5000.
+    max_bytes : int, optional
+        Maximum (approximative) size of the CSV sent in a single chunk. The
+        default is 5 MB.
+    concurrency : int, optional
+        Maximum number of chunks sent concurrently. The default is None
+        (adaptive budget of the geocoder's API, see configure_concurrency).
 
     Returns
     -------
     results_api : pd.DataFrame
         DataFrame (same as original + columns ['result_score', 'result_city',
-        'result_citycode'])
+        'result_citycode']), with the number of addresses of failed chunks
+        in results_api.attrs["failed_rows"]
 
     """
     # Use the BAN's CSV geocoder
     logger.info("request BAN with CSV geocoder and %s...", components)
 
-    files = [
-        ("data", addresses.to_csv(index=False)),
-        # erratic behaviour of BAN API, deactivate type filtering for now
-        # ("type", (None, "municipality")),
-        ("result_columns", (None, "full")),
-        ("result_columns", (None, "result_score")),
-        ("result_columns", (None, "result_city")),
-        ("result_columns", (None, "result_citycode")),
-        ("result_columns", (None, "result_type")),
+    geocoder = get_geocoder(geocoder)
+    columns = ["full", "result_score", "result_city", "result_citycode"]
+
+    # Look for each row into the cache first: the key is the normalized
+    # query built by the API (ie. the concatenation of all columns)
+    cache_ban = open_cache("ban")
+    queries = _concat_columns(
+        addresses.fillna("").astype(str), addresses.columns
+    )
+    queries = (
+        f"{geocoder.name}|search/csv/|"
+        + queries.str.upper().str.split().str.join(" ")
+    )
+    cached = {}
+    if geocoder.cache_results:
+        for query in queries.unique():
+            result = cache_ban.get(query)
+            if result is not None:
+                cached[query] = result
+    ix = queries.isin(cached.keys())
+    if geocoder.cache_results:
+        record_cache(
+            "ban", hits=len(cached), misses=queries.nunique() - len(cached)
+        )
+    results_api = [
+        pd.DataFrame(
+            queries[ix].map(cached).tolist(),
+            columns=columns[1:],
+            index=addresses.index[ix],
+        ).assign(full=addresses.loc[ix, "full"])
     ]
+    logger.info(
+        "%s addresses found in cache, %s to query", ix.sum(), (~ix).sum()
+    )
+
+    # Only query the API for uncached rows
+    to_query = addresses[~ix].assign(**{"#QUERY#": queries[~ix]})
+    chunks = _split_in_chunks(to_query, max_rows, max_bytes)
+    chunks = [chunk.drop("#QUERY#", axis=1) for chunk in chunks]
+    func = partial(_post_BAN_csv_chunk, session=session, geocoder=geocoder)
 
-    # awaiting new API managed by IGN
-    # see https://guides.data.gouv.fr/reutiliser-des-donnees/prendre-en-main-lapi-adresse-portee-par-lign#utilisation-de-lapi-adresse-portee-par-lign-et-les-differences-avec-lapi-adresse-portee-par-la-dinum
-    r = session.post(
-        "https://api-adresse.data.gouv.fr/search/csv/",
-        files=files,
+    desc = "Querying BAN's CSV geocoder"
+    results = get_executor().map(
+        geocoder.csv_api, func, chunks, max_workers=concurrency
     )
-    if not r.ok:
-        raise Exception(
-            f"Failed to query BAN's API with {files=} - response was {r}"
+    failed_rows = 0
+    for chunk, this_result in zip(
+        chunks,
+        tqdm(results, total=len(chunks), desc=desc, leave=False),
+    ):
+        if this_result is None:
+            failed_rows += len(chunk)
+            continue
+        results_api.append(this_result)
+        if not geocoder.cache_results:
+            continue
+
+        # Store each row's result into the cache
+        new_values = (
+            to_query.loc[chunk.index, ["full", "#QUERY#"]]
+            .merge(this_result, on="full", how="inner")
+            .drop_duplicates("#QUERY#")
+            .astype(object)
+        )
+        new_values = new_values.where(new_values.notnull(), None)
+        expire = cache_expire("ban")
+        with cache_ban.transact():
+            for row in new_values.itertuples(index=False):
+                cache_ban.set(row[1], tuple(row[2:]), expire=expire)
+    cache_ban.close()
+
+    if failed_rows:
+        logger.error(
+            "%s addresses left unresolved by failed requests to the CSV "
+            "geocoder",
+            failed_rows,
         )
+        record_failure(f"{geocoder.name}-csv", failed_rows)
 
     logger.info("résultat obtenu")
 
-    try:
-        results_api = (
-            pd.read_csv(
-                io.BytesIO(r.content),
-                dtype={"dep": str, "result_citycode": str},
-            )
-            .drop_duplicates()
-            .loc[
-                :,
-                ["full", "result_score", "result_city", "result_citycode"],
-            ]
-            .merge(
-                addresses[[dep, "full", city]].drop_duplicates(),
-                on="full",
-            )
-        )
-    except Exception as exc:
-        raise ValueError(
-            "Failed to parse BAN's return with following content :\n\n"
-            f"{r.content}"
-        ) from exc
+    results_api = pd.concat(
+        [pd.DataFrame(columns=columns)] + results_api, ignore_index=True
+    )
+    results_api = results_api.drop_duplicates().merge(
+        addresses[[dep, "full", city]].drop_duplicates(),
+        on="full",
+    )
+    results_api.attrs["failed_rows"] = failed_rows
     return results_api
 
 
+async def _pipeline_BAN_individual_queries(
+    queries: list,
+    session: Session,
+    geocoder: Geocoder,
+    concurrency: int,
+    rate: float,
+    retries: int,
+    backoff: float,
+) -> list:
+    """
+    Pipeline queries to the individual geocoder, keeping at most
+    `concurrency` requests in flight (if not None; the geocoder's API budget
+    of the shared executor applies in any case) under a `rate`
+    requests-per-second budget (if rate is not None). Requests failing on
+    network errors, rate limits (HTTP 429) or server errors are retried with
+    an exponential backoff.
+
+    Returns the list of results found for each query (in the same order).
+    """
+    bucket = TokenBucket(rate) if rate else None
+    semaphore = asyncio.Semaphore(concurrency or max(1, len(queries)))
+
+    async def get(x):
+        async with semaphore:
+            for attempt in range(retries + 1):
+                if attempt:
+                    await asyncio.sleep(backoff * 2 ** (attempt - 1))
+                if bucket:
+                    await bucket.acquire()
+                try:
+                    return await asyncio.wrap_future(
+                        get_executor().submit(
+                            geocoder.search_api,
+                            single_flight,
+                            (geocoder.name, "search/", x),
+                            geocoder.search,
+                            x,
+                            session,
+                        )
+                    )
+                except GeocoderError as exc:
+                    logger.warning("geocoder failed: %s", exc)
+                    if not exc.retryable:
+                        return []
+            logger.error("Failed to query the geocoder with q=%s", x)
+            return []
+
+    async def main():
+        tasks = [asyncio.ensure_future(get(x)) for x in queries]
+        with tqdm(
+            total=len(tasks), desc="Querying BAN's geocoder", leave=False
+        ) as pbar:
+            for task in asyncio.as_completed(tasks):
+                await task
+                pbar.update(1)
+        return [task.result() for task in tasks]
+
+    return await main()
+
+
 def _query_BAN_individual_geocoder(
     addresses: pd.DataFrame,
     components: list,
     session: Session,
     dep: str,
-    threads: int = THREADS,
+    threads: int = None,
+    geocoder: Geocoder = None,
+    rate: float = BAN_SEARCH_RATE,
+    retries: int = BAN_SEARCH_RETRIES,
+    backoff: float = BAN_SEARCH_BACKOFF,
 ) -> pd.DataFrame:
     """
-    Query the adresse API (BAN = Base Adresse Nationale) individual geocoder,
-    specifying the output type as municipality (this parameter being not
-    available through the CSV mass geocoder). Uses multithreading as no
-    quota are not used by this API.
+    Query the adresse API (BAN = Base Adresse Nationale) individual geocoder
+    (or any other geocoder backend), specifying the output type as
+    municipality (this parameter being not available through the CSV mass
+    geocoder). Requests are pipelined with asyncio under a
+    requests-per-second budget.
 
     Parameters
     ----------
@@ -1138,7 +1658,18 @@ def _query_BAN_individual_geocoder(
     dep : str
         Column label containing the departements' codes
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of requests in flight. Default is None (adaptive
+        budget, see configure_concurrency).
+    geocoder : Geocoder, optional
+        Geocoder backend. The default is None (see get_geocoder).
+    rate : float, optional
+        Maximum number of requests per second (ignored if the geocoder is
+        not rate limited). Default is 40.
+    retries : int, optional
+        Maximum number of retries for each request. Default is 5.
+    backoff : float, optional
+        Initial delay (in seconds) between two attempts, doubled at each new
+        attempt. Default is 1.
 
     Returns
     -------
@@ -1153,65 +1684,42 @@ def _query_BAN_individual_geocoder(
     # https://github.com/BaseAdresseNationale/adresse.data.gouv.fr/issues/1575
     logger.info("request BAN with individual requests and %s...", components)
 
-    def get(x):
-        r = session.get(
-            "https://data.geopf.fr/geocodage/search/",
-            params={
-                "q": x,
-                "type": "municipality",
-                "autocomplete": 0,
-                "limit": 1,
-            },
-        ).json()
-        try:
-            features = r["features"]
-        except KeyError:
-            logger.error("query was q=%s", x)
-            logger.error(r)
-            raise
-
-        try:
-            query = r["query"]
-        except KeyError:
-            query = x
-        for dict_ in features:
-            dict_["properties"].update({"full": query})
-
-        return features
-
-    args = addresses.full.str.replace(r"\W+", " ", regex=True).tolist()
-    results = []
-    with tqdm(total=len(args), desc="Queuing download", leave=False) as pbar:
-        with ThreadPool(threads) as pool:
-            future = pool.map(get, args)
-            results_iterator = future.result()
-            while True:
-                try:
-                    this_result = next(results_iterator)
-                    if this_result:
-                        results.append(this_result)
-                except StopIteration:
-                    break
-                finally:
-                    pbar.update(1)
+    geocoder = get_geocoder(geocoder)
+    full = addresses["full"].drop_duplicates().tolist()
+    queries = [re.sub(r"\W+", " ", x) for x in full]
+    features = run_coroutine(
+        _pipeline_BAN_individual_queries(
+            queries,
+            session=session,
+            geocoder=geocoder,
+            concurrency=threads,
+            rate=rate if geocoder.rate_limited else None,
+            retries=retries,
+            backoff=backoff,
+        )
+    )
 
     logger.info("results collected")
 
-    results_api = (
-        gpd.GeoDataFrame.from_features(np.array(results).flatten())
-        .loc[:, ["full", "score", "city", "citycode"]]
-        .rename(
-            {
-                "score": "result_score",
-                "city": "result_city",
-                "citycode": "result_citycode",
-            },
-            axis=1,
-        )
-        .merge(
-            addresses[[dep, "full", "city_cleaned"]].drop_duplicates(),
-            on="full",
-        )
+    columns = ["score", "city", "citycode"]
+    results_api = pd.DataFrame(
+        [
+            {"full": x, **{k: dict_.get(k) for k in columns}}
+            for x, this_result in zip(full, features)
+            for dict_ in this_result
+        ],
+        columns=["full"] + columns,
+    )
+    results_api = results_api.rename(
+        {
+            "score": "result_score",
+            "city": "result_city",
+            "citycode": "result_citycode",
+        },
+        axis=1,
+    ).merge(
+        addresses[[dep, "full", "city_cleaned"]].drop_duplicates(),
+        on="full",
     )
     return results_api
 
@@ -1219,14 +1727,12 @@ def _query_BAN_individual_geocoder(
 def _filter_BAN_results(
     results_api: pd.DataFrame,
     session: Session,
-    rename_candidat: str,
-    addresses: pd.DataFrame,
     dep: str = "dep",
     fuzzymatch_threshold: int = 80,
     ban_score_threshold_city_known: float = 0.6,
     ban_score_threshold_city_unknown: float = 0.4,
-    threads: int = THREADS,
-) -> pd.DataFrame:
+    threads: int = None,
+) -> pd.Series:
     """
     Filters the BAN results to keep best results according to specific
     criteria. Results will be kept if :
@@ -1242,10 +1748,6 @@ def _filter_BAN_results(
         Adresse API results
     session : Session
         Web session
-    rename_candidat : str
-        Columnn to rename the results to.
-    addresses : pd.DataFrame
-        Full DataFrame of address to store the kept results into.
     dep : str, optional
         Field (column) containing the department values. Set to False if
         not available. The default is "dep".
@@ -1259,12 +1761,14 @@ def _filter_BAN_results(
         The API score threshold to keep results, the city label being unknown.
         Default is 0.4.
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
-    addresses : pd.DataFrame
-        Consolidated DataFrame of address with selected results.
+    results : pd.DataFrame
+        Selected cities' codes (column "best") and BAN's scores (column
+        "score"), indexed by the "full" addresses sent to the API.
 
     """
     # Control results : same department
@@ -1280,7 +1784,7 @@ def _filter_BAN_results(
     results_api = results_api.loc[ix]
 
     if results_api.empty:
-        return addresses
+        return pd.DataFrame(columns=["best", "score"], dtype=object)
 
     # Control result : fuzzy matching on city label
     results_api["result_city"] = (
@@ -1290,8 +1794,11 @@ def _filter_BAN_results(
         .str.split(r"\W+")
         .str.join(" ")
     )
-    results_api["score"] = results_api[["city_cleaned", "result_city"]].apply(
-        lambda xy: fuzz.token_set_ratio(*xy), axis=1
+    results_api["score"] = cpdist(
+        results_api["city_cleaned"].tolist(),
+        results_api["result_city"].tolist(),
+        scorer=fuzz.token_set_ratio,
+        workers=1,  # Nota : workers=-1 currently crashes python
     )
 
     ix = results_api[
@@ -1313,18 +1820,7 @@ def _filter_BAN_results(
         )
     ].index
 
-    if rename_candidat in addresses.columns:
-        results_api = results_api.loc[ix, ["full", "result_citycode"]]
-        addresses = addresses.merge(results_api, on="full", how="left")
-        ix = addresses[addresses.result_citycode.notnull()].index
-        addresses.loc[ix, rename_candidat] = addresses.loc[
-            ix, "result_citycode"
-        ]
-        addresses = addresses.drop("result_citycode", axis=1)
-
-    else:
-        results_api = results_api.loc[ix, ["full", "result_citycode"]].rename(
-            {"result_citycode": rename_candidat}, axis=1
-        )
-        addresses = addresses.merge(results_api, on="full", how="left")
-    return addresses
+    results = results_api.loc[ix, ["full", "result_citycode", "result_score"]]
+    results = results.drop_duplicates("full", keep="first")
+    results.columns = ["full", "best", "score"]
+    return results.set_index("full")
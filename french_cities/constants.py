@@ -1,3 +1,99 @@
 # -*- coding: utf-8 -*-
 
 THREADS = 10
+
+# Shared executor: number of worker threads, and concurrency budgets of each
+# upstream API. Budgets start at CONCURRENCY_INITIAL and adapt (AIMD) to each
+# API's responses, up to the maxima below (overridable with
+# FRENCH_CITIES_CONCURRENCY)
+EXECUTOR_MAX_WORKERS = 64
+CONCURRENCY_INITIAL = 4
+CONCURRENCY = {
+    "insee": THREADS,
+    "ban": 16,
+    "geopf": 32,
+    "opendatasoft": THREADS,
+    "nominatim": THREADS,
+}
+
+# Hosts of the upstream APIs (throttling and server errors of those hosts
+# are reported to the shared executor)
+API_HOSTS = {
+    "api.insee.fr": "insee",
+    "api-adresse.data.gouv.fr": "ban",
+    "data.geopf.fr": "geopf",
+    "public.opendatasoft.com": "opendatasoft",
+    "nominatim.openstreetmap.org": "nominatim",
+}
+
+# Sessions created by french-cities: HTTP caches, available requests-cache
+# backends, and connections kept alive per host (one per executor's worker)
+HTTP_CACHES = ("find-city", "find-department")
+HTTP_CACHE_BACKENDS = ("sqlite", "filesystem", "memory")
+HTTP_POOL_MAXSIZE = EXECUTOR_MAX_WORKERS
+
+# diskcache's caches: size limits (least recently stored entries are evicted
+# beyond them) and time-to-live of the entries (overridable with the
+# FRENCH_CITIES_CACHE_SIZE and FRENCH_CITIES_CACHE_TTL environment variables)
+CACHE_POLICIES = {
+    "projection": {"size_limit": 256 * 1024**2, "expire": 365 * 24 * 3600},
+    "deps": {"size_limit": 64 * 1024**2, "expire": 365 * 24 * 3600},
+    "nominatim": {"size_limit": 128 * 1024**2, "expire": 30 * 24 * 3600},
+    "ultramarine": {"size_limit": 64 * 1024**2, "expire": 365 * 24 * 3600},
+    "ban": {"size_limit": 1024**3, "expire": 30 * 24 * 3600},
+}
+
+# BAN's CSV geocoder: addresses are sent by size-bounded chunks, concurrently
+BAN_CSV_MAX_ROWS = 5000
+BAN_CSV_MAX_BYTES = 5 * 1024**2
+BAN_CSV_RETRIES = 5
+BAN_CSV_BACKOFF = 1
+
+# BAN's individual geocoder: requests per second budget and retries
+BAN_SEARCH_RATE = 40
+BAN_SEARCH_RETRIES = 5
+BAN_SEARCH_BACKOFF = 1
+
+# Nominatim's public server (overridable with FRENCH_CITIES_NOMINATIM_URL)
+# and minimal delay (in seconds) between two requests sent to it by a process
+NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+NOMINATIM_PUBLIC_DELAY = 1
+
+# Number of rows resolved at once when streaming files or records
+STREAM_CHUNKSIZE = 100_000
+STREAM_BATCH_SIZE = 1000
+
+# OpenDataSoft's API: maximum delay between retries on throttling (seconds)
+OPENDATASOFT_MAX_BACKOFF = 60
+
+# Official postcodes dataset (La Poste)
+# https://datanova.laposte.fr/datasets/laposte-hexasmal
+HEXASMAL_URL = (
+    "https://datanova.laposte.fr/data-fair/api/v1/datasets/"
+    "laposte-hexasmal/raw"
+)
+
+# Reference store: format of the snapshots, levels stored for a vintage (and
+# for the "*" snapshot of all communes ever existing), and sub-communal
+# levels stored with their parent communes
+REFERENCE_FORMAT = 1
+REFERENCE_SUBAREAS = {
+    "arrondissementsMunicipaux": "arrondissementMunicipal",
+    "communesAssociees": "communeAssociee",
+    "communesDeleguees": "communeDeleguee",
+}
+REFERENCE_LEVELS = (
+    "communes",
+    "departements",
+    "collectivitesDOutreMer",
+    *REFERENCE_SUBAREAS,
+    "ultramarines",
+)
+REFERENCE_HISTORY_LEVELS = (
+    "communes",
+    "collectivitesDOutreMer",
+    "ultramarines",
+)
+
+# Format of the cache bundles (see french_cities.cache_bundle)
+BUNDLE_FORMAT = 1
@@ -6,23 +6,22 @@ Module used to recognize departments, either from names, cities' official codes
 or cities' postcodes.
 """
 
-from datetime import timedelta, date
+from datetime import date
 import io
 import logging
-import os
 import time
 
-import diskcache
 import pandas as pd
-from pebble import ThreadPool
 from rapidfuzz import fuzz, process
-from requests_cache import CachedSession
 from requests import Session
 from tqdm import tqdm
 from unidecode import unidecode
 
-from french_cities import DIR_CACHE
-from french_cities.constants import THREADS
+from french_cities.caches import cache_expire, open_cache
+from french_cities.constants import HEXASMAL_URL, OPENDATASOFT_MAX_BACKOFF
+from french_cities.executor import get_executor, single_flight
+from french_cities.metrics import record_cache, stage as measure_stage
+from french_cities.sessions import get_session
 from french_cities.utils import init_pynsee, silence_sirene_logs
 from french_cities.ultramarine_pseudo_cog import (
     get_departements_and_ultramarines,
@@ -33,13 +32,28 @@ from french_cities.vintage import set_vintage
 logger = logging.getLogger(__name__)
 
 
+def get_default_session() -> Session:
+    """
+    Get the web session used by default by find_departements (a CachedSession
+    with 30 days expiration, using http_proxy and https_proxy environment
+    variables, shared by the whole process).
+
+    Returns
+    -------
+    Session
+        Web session
+
+    """
+    return get_session("find-department", allowable_methods=("GET", "POST"))
+
+
 def _process_departements_from_postal(
     df: pd.DataFrame,
     source: str,
     alias: str,
     session: Session = None,
     authorize_duplicates: bool = False,
-    threads: int = THREADS,
+    threads: int = None,
     **kwargs,
 ) -> pd.DataFrame:
     """
@@ -65,7 +79,8 @@ def _process_departements_from_postal(
         either 13 or 83). If False, duplicates will be removed, hence no
         result will be available. False by default.
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
     kwargs : ignored
         **ignored argument, set only for coherence with other functions**
 
@@ -76,29 +91,18 @@ def _process_departements_from_postal(
 
     """
 
-    cache_departments = diskcache.Cache(os.path.join(DIR_CACHE, "deps"))
+    cache_departments = open_cache("deps")
 
     if not session:
-        session = CachedSession(
-            cache_name=os.path.join(DIR_CACHE, "find-department"),
-            allowable_methods=("GET", "POST"),
-            expire_after=timedelta(days=30),
-        )
-        proxies = {}
-        proxies["http"] = os.environ.get("http_proxy", None)
-        proxies["https"] = os.environ.get("https_proxy", None)
-        session.proxies.update(proxies)
+        session = get_default_session()
 
     df["#CachedResult#"] = df[source].apply(cache_departments.get)
+    hits = df["#CachedResult#"].notnull().sum()
+    record_cache("deps", hits=hits, misses=len(df) - hits)
 
     # Download official postcodes dataset from API
     # https://datanova.laposte.fr/datasets/laposte-hexasmal
-    url = (
-        "https://datanova.laposte.fr/data-fair/api/v1/datasets/"
-        "laposte-hexasmal/raw"
-    )
-
-    r = session.get(url)
+    r = session.get(HEXASMAL_URL)
     base = pd.read_csv(
         io.BytesIO(r.content), sep=";", encoding="cp1252", dtype=str
     )
@@ -183,6 +187,7 @@ def _process_departements_from_postal(
     # https://www.data.gouv.fr/fr/datasets/liste-des-cedex/#_
     # https://public.opendatasoft.com/explore/dataset/correspondance-code-cedex-code-insee/information/?flg=fr&q=code%3D68013&lang=fr
     def get(x):
+        delay = 1
         while True:
             r = session.get(
                 # recherche "en masse" grâce à l'API de la BAN
@@ -201,7 +206,10 @@ def _process_departements_from_postal(
             if r.ok:
                 break
             if r.status_code == 429:
-                time.sleep(1)
+                # Throttled: the executor lowers OpenDataSoft's budget (see
+                # french_cities.executor.response_hook), back off meanwhile
+                time.sleep(delay)
+                delay = min(2 * delay, OPENDATASOFT_MAX_BACKOFF)
             else:
                 logger.warning(
                     "Error occured on code %s on OpenDataSoft's API", x
@@ -217,21 +225,19 @@ def _process_departements_from_postal(
         logger.info("postal codes unrecognized - maybe Cedex codes")
         args = postal_codes_cedex[source].dropna().tolist()
         result_cedex = []
-        with tqdm(
-            total=len(args), desc="Querying OpenDataSoft API", leave=False
-        ) as pbar:
-            with ThreadPool(threads) as pool:
-                future = pool.map(get, args)
-                results_iterator = future.result()
-                while True:
-                    try:
-                        this_result = next(results_iterator)
-                        if this_result:
-                            result_cedex += this_result
-                    except StopIteration:
-                        break
-                    finally:
-                        pbar.update(1)
+        # Concurrent callers looking for the same code share one query
+        results = get_executor().map(
+            "opendatasoft",
+            lambda x: single_flight(("cedex", source, x), get, x),
+            args,
+            max_workers=threads,
+        )
+        desc = "Querying OpenDataSoft API"
+        for this_result in tqdm(
+            results, total=len(args), desc=desc, leave=False
+        ):
+            if this_result:
+                result_cedex += this_result
         result_cedex = pd.DataFrame(result_cedex).drop_duplicates()
 
         if not result_cedex.empty:
@@ -300,8 +306,9 @@ def _process_departements_from_postal(
     new_cache_values = new_cache_values.drop_duplicates(source, keep=False)
 
     new_cache_values = dict(new_cache_values.values)
+    expire = cache_expire("deps")
     for key, val in new_cache_values.items():
-        cache_departments[key] = val
+        cache_departments.set(key, val, expire=expire)
 
     df = df.drop("#CachedResult#", axis=1)
 
@@ -314,7 +321,7 @@ def _process_departements_from_insee_code(
     source: str,
     alias: str,
     do_set_vintage: bool = True,
-    threads: int = True,
+    threads: int = None,
     **kwargs,
 ) -> pd.DataFrame:
     """
@@ -340,7 +347,8 @@ def _process_departements_from_insee_code(
         almost any other dataset.
         The default is True.
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
     kwargs : ignored
         **ignored arguments, set only for coherence with other function**
 
@@ -455,7 +463,7 @@ def find_departements(
     session: Session = None,
     authorize_duplicates: bool = False,
     do_set_vintage: bool = True,
-    threads: int = THREADS,
+    threads: int = None,
 ) -> pd.DataFrame:
     """
     Compute departement's codes from postal, official codes (ie. INSEE COG)
@@ -488,7 +496,8 @@ def find_departements(
         almost any other dataset.
         The default is True.
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Raises
     ------
@@ -518,12 +527,15 @@ def find_departements(
         func = _process_departements_from_insee_code
     else:
         func = _find_departements_from_names
-    return func(
-        df=df,
-        source=source,
-        alias=alias,
-        session=session,
-        authorize_duplicates=authorize_duplicates,
-        do_set_vintage=do_set_vintage,
-        threads=threads,
-    )
+    with measure_stage(f"find_departements:{type_field}", len(df)) as info:
+        df = func(
+            df=df,
+            source=source,
+            alias=alias,
+            session=session,
+            authorize_duplicates=authorize_duplicates,
+            do_set_vintage=do_set_vintage,
+            threads=threads,
+        )
+        info["rows_out"] = df[alias].notnull().sum()
+    return df
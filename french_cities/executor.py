@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 23 10:04:18 2026
+
+Process-wide executor shared by every fan-out of the library: one pool of
+worker threads, with a separate concurrency budget for each upstream API
+(ie. a maximum number of tasks running at once for this API, whatever the
+number of callers).
+
+Tasks exceeding their API's budget wait in a queue of their own, so that a
+saturated API never holds workers needed by another one. Tasks submitted from
+a worker (nested fan-outs, such as find_city -> find_departements ->
+set_vintage) are run inline, so that nested calls can't starve the pool.
+
+Budgets are adaptive (AIMD: additive increase, multiplicative decrease): each
+API's budget grows while its requests succeed quickly, and is cut down on
+throttling (HTTP 429), server or network errors and latency spikes, so that
+the throughput approaches each API's real limit.
+
+Identical requests running at once (from overlapping calls of concurrent
+threads) can be coalesced into a single upstream call (see single_flight).
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+from urllib.parse import urlparse
+
+from requests import Response
+from requests.exceptions import ConnectionError, Timeout
+
+from french_cities.constants import (
+    API_HOSTS,
+    CONCURRENCY,
+    CONCURRENCY_INITIAL,
+    EXECUTOR_MAX_WORKERS,
+    THREADS,
+)
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_lock = threading.Lock()
+_executor = None
+_in_flight = {}
+
+
+def _in_worker() -> bool:
+    return getattr(_local, "worker", False)
+
+
+def _mark_worker():
+    _local.worker = True
+
+
+def _parse_limits(value: str, kind: str = "concurrency") -> dict:
+    """
+    Parse concurrency budgets from a string such as "ban=20,insee=5"
+    (FRENCH_CITIES_CONCURRENCY environment variable), or any other integer
+    settings of the same form.
+    """
+    limits = {}
+    for item in filter(None, (x.strip() for x in value.split(","))):
+        try:
+            host, limit = item.split("=")
+            limits[host.strip()] = int(limit)
+        except ValueError:
+            logger.warning("invalid %s setting ignored: %s", kind, item)
+    return limits
+
+
+class AIMDController:
+    """
+    Additive increase / multiplicative decrease controller of an API's
+    concurrency budget.
+
+    The budget grows by `increase` each time a whole budget's worth of
+    requests succeeded, and is multiplied by `decrease` on congestion
+    (throttling, errors, or latency above `latency_factor` times the usual
+    latency). Congestion signals are ignored for one round trip
+    after each decrease, so that a single burst is only penalized once.
+
+    Parameters
+    ----------
+    initial : float
+        Initial budget
+    maximum : float
+        Maximum budget
+    minimum : float, optional
+        Minimum budget. The default is 1.
+    increase : float, optional
+        Additive increase. The default is 1.
+    decrease : float, optional
+        Multiplicative decrease. The default is 0.5.
+    latency_factor : float, optional
+        Latency (relative to the usual latency) considered as a congestion
+        signal. The default is 4.
+
+    """
+
+    def __init__(
+        self,
+        initial: float,
+        maximum: float,
+        minimum: float = 1,
+        increase: float = 1,
+        decrease: float = 0.5,
+        latency_factor: float = 4,
+    ):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.value = min(max(initial, self.minimum), self.maximum)
+        self.latency = None
+        self.baseline = None
+        self.last_decrease = float("-inf")
+
+    @property
+    def limit(self) -> int:
+        return int(self.value)
+
+    def on_success(self, latency: float = None):
+        "Record a successful request (with its latency, in seconds)"
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * latency
+            if self.baseline is None:
+                self.baseline = self.latency
+            else:
+                # Baseline drifts slowly towards the current latency, so
+                # that a lasting change (cached vs live responses, for
+                # instance) is not seen as congestion forever
+                self.baseline = min(
+                    self.latency, 0.95 * self.baseline + 0.05 * self.latency
+                )
+            if self.latency > self.latency_factor * self.baseline:
+                self.on_congestion()
+                return
+        self.value = min(
+            self.maximum, self.value + self.increase / max(1, self.value)
+        )
+
+    def on_congestion(self):
+        "Record a congestion signal (throttling, error or latency spike)"
+        now = time.monotonic()
+        if now - self.last_decrease < max(self.latency or 0, 0.1):
+            return
+        self.last_decrease = now
+        self.value = max(self.minimum, self.value * self.decrease)
+
+
+class _HostQueue:
+    def __init__(self, controller: AIMDController):
+        self.controller = controller
+        self.running = 0
+        self.pending = deque()
+
+    @property
+    def limit(self) -> int:
+        return self.controller.limit
+
+
+class SharedExecutor:
+    """
+    Pool of worker threads with an adaptive concurrency budget per upstream
+    API.
+
+    Parameters
+    ----------
+    limits : dict, optional
+        Maximum concurrency budgets, by API (for instance {"ban": 20}). APIs
+        which are not set use a maximum budget of 10. The default is None.
+    max_workers : int, optional
+        Number of worker threads. The default is 64.
+    initial : int, optional
+        Initial budget of each API (bounded by its maximum budget). The
+        default is 4.
+
+    """
+
+    def __init__(
+        self, limits: dict = None, max_workers: int = None, initial: int = None
+    ):
+        self._limits = dict(limits or {})
+        self._initial = initial or CONCURRENCY_INITIAL
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers or EXECUTOR_MAX_WORKERS,
+            thread_name_prefix="french-cities",
+            initializer=_mark_worker,
+        )
+
+    def _queue(self, host: str) -> _HostQueue:
+        # Note: self._lock should be held
+        queue = self._queues.get(host)
+        if queue is None:
+            controller = AIMDController(
+                self._initial, self._limits.get(host, THREADS)
+            )
+            queue = self._queues[host] = _HostQueue(controller)
+        return queue
+
+    def _release(self, host: str):
+        "Start the pending tasks of an API allowed by its current budget"
+        with self._lock:
+            queue = self._queue(host)
+            tasks = []
+            while queue.pending and queue.running < queue.limit:
+                queue.running += 1
+                tasks.append(queue.pending.popleft())
+        for task in tasks:
+            self._pool.submit(self._work, host, task)
+
+    def set_limit(self, host: str, limit: int):
+        "Set the maximum concurrency budget of an API"
+        limit = max(1, int(limit))
+        with self._lock:
+            self._limits[host] = limit
+            controller = self._queue(host).controller
+            controller.maximum = limit
+            controller.value = min(controller.value, limit)
+        self._release(host)
+
+    def get_limit(self, host: str) -> int:
+        "Get the current concurrency budget of an API"
+        with self._lock:
+            return self._queue(host).limit
+
+    def feedback(self, host: str, latency: float = None, congested=False):
+        """
+        Report the outcome of a request sent to an API, to adapt its
+        concurrency budget.
+
+        Parameters
+        ----------
+        host : str
+            API targeted by the request
+        latency : float, optional
+            Latency of a successful request, in seconds. The default is None.
+        congested : bool, optional
+            True if the request was throttled (HTTP 429) or failed on a
+            server or network error. The default is False.
+
+        """
+        with self._lock:
+            controller = self._queue(host).controller
+            if congested:
+                controller.on_congestion()
+            else:
+                controller.on_success(latency)
+        if not congested:
+            self._release(host)
+
+    def submit(self, host: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedule fn(*args, **kwargs) as a task sent to an upstream API. The
+        task runs with a copy of the caller's context variables.
+
+        Parameters
+        ----------
+        host : str
+            API targeted by the task (for instance "insee", "ban", "geopf",
+            "opendatasoft" or "nominatim")
+        fn : Callable
+            Function to run
+
+        Returns
+        -------
+        Future
+            Future of the task's result
+
+        """
+        future = Future()
+        task = (future, contextvars.copy_context(), fn, args, kwargs)
+        if _in_worker():
+            # Nested call: run inline, the caller already holds a worker
+            self._run(task)
+            return future
+
+        with self._lock:
+            queue = self._queue(host)
+            start = queue.running < queue.limit
+            if start:
+                queue.running += 1
+            else:
+                queue.pending.append(task)
+        if start:
+            self._pool.submit(self._work, host, task)
+        return future
+
+    @staticmethod
+    def _run(task: tuple) -> bool:
+        """
+        Run a task, return False if it failed on a network error or on an
+        error flagged as retryable (throttling or server errors raised by
+        geocoders, see french_cities.geocoders.GeocoderError)
+        """
+        future, context, fn, args, kwargs = task
+        if not future.set_running_or_notify_cancel():
+            return True
+        try:
+            result = context.run(fn, *args, **kwargs)
+        except (ConnectionError, Timeout) as exc:
+            future.set_exception(exc)
+            return False
+        except BaseException as exc:
+            future.set_exception(exc)
+            return not getattr(exc, "retryable", False)
+        else:
+            future.set_result(result)
+        return True
+
+    def _work(self, host: str, task: tuple):
+        # Run the task, then the host's pending tasks (if any) while the
+        # budget allows it; each task's duration is fed to the controller
+        while task:
+            start = time.monotonic()
+            ok = self._run(task)
+            latency = time.monotonic() - start
+            with self._lock:
+                controller = self._queues[host].controller
+                if ok:
+                    controller.on_success(latency)
+                else:
+                    controller.on_congestion()
+            self._release(host)
+            with self._lock:
+                queue = self._queues[host]
+                if queue.pending and queue.running <= queue.limit:
+                    task = queue.pending.popleft()
+                else:
+                    queue.running -= 1
+                    task = None
+
+    def map(
+        self,
+        host: str,
+        fn: Callable,
+        iterable: Iterable,
+        max_workers: int = None,
+    ) -> Iterator:
+        """
+        Apply fn to each item of iterable, yielding the results in order (as
+        soon as they are available).
+
+        Parameters
+        ----------
+        host : str
+            API targeted by the tasks
+        fn : Callable
+            Function to apply
+        iterable : Iterable
+            Items to process
+        max_workers : int, optional
+            Maximum number of tasks of this call running at once (on top of
+            the API's budget). The default is None.
+
+        Yields
+        ------
+        Any
+            fn's results, in the same order as iterable
+
+        """
+        futures = deque()
+        try:
+            for item in iterable:
+                if max_workers and len(futures) >= max_workers:
+                    yield futures.popleft().result()
+                futures.append(self.submit(host, fn, item))
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def get_executor() -> SharedExecutor:
+    """
+    Get the executor shared by the whole process (created on first use,
+    with the budgets set in the FRENCH_CITIES_CONCURRENCY environment
+    variable, for instance "ban=20,opendatasoft=2").
+
+    Returns
+    -------
+    SharedExecutor
+        Shared executor
+
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            limits = dict(CONCURRENCY)
+            limits.update(
+                _parse_limits(os.environ.get("FRENCH_CITIES_CONCURRENCY", ""))
+            )
+            _executor = SharedExecutor(limits)
+        return _executor
+
+
+def single_flight(key, fn: Callable, *args, **kwargs):
+    """
+    Call fn(*args, **kwargs), unless a call sharing the same key is already
+    in flight (in any thread): wait for this call then, and share its result
+    (or exception).
+
+    Parameters
+    ----------
+    key : hashable
+        Identity of the request (calls with equal keys should be
+        interchangeable)
+    fn : Callable
+        Function to run
+
+    Returns
+    -------
+    Any
+        fn's result
+
+    """
+    with _lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+    if not leader:
+        return future.result()
+
+    try:
+        result = fn(*args, **kwargs)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _lock:
+            del _in_flight[key]
+
+
+def response_hook(r: Response, *args, **kwargs) -> Response:
+    """
+    Session's response hook reporting throttling (HTTP 429) and server
+    errors of known APIs to the shared executor.
+    """
+    # Note: responses served by requests-cache are tagged with from_cache
+    # (see french_cities.metrics)
+    if hasattr(r, "from_cache"):
+        return r
+    if r.status_code == 429 or r.status_code >= 500:
+        host = API_HOSTS.get(urlparse(r.url).hostname)
+        if host:
+            get_executor().feedback(host, congested=True)
+    return r
+
+
+def configure_concurrency(**limits):
+    """
+    Set the maximum concurrency budgets of upstream APIs, for the whole
+    process (the actual budgets adapt to each API's responses, within those
+    limits).
+
+    Parameters
+    ----------
+    **limits :
+        Maximum number of requests in flight, by API: "insee", "ban" (BAN's
+        CSV geocoder), "geopf" (BAN's individual geocoder), "opendatasoft"
+        or "nominatim".
+
+    Example
+    -------
+    >>> configure_concurrency(ban=20, opendatasoft=2)
+
+    """
+    executor = get_executor()
+    for host, limit in limits.items():
+        executor.set_limit(host, limit)
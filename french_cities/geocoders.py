@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:20:37 2026
+
+Geocoder backends used to recognize cities from lexical fields: the public
+adresse API (BAN = Base Adresse Nationale), a self-hosted addok instance or
+a local geocoder working offline on BAN's departmental dumps.
+
+The backend used by find_city can be set with the `geocoder` argument, or
+with the FRENCH_CITIES_GEOCODER environment variable, among:
+    * "ban" (default)
+    * "addok:https://my-addok-instance.example"
+    * "local:/path/to/ban/dumps"
+"""
+
+from functools import lru_cache
+import glob
+import io
+import logging
+import os
+import re
+import threading
+
+import pandas as pd
+from rapidfuzz import fuzz, process
+from requests import Session
+from requests.exceptions import RequestException
+from unidecode import unidecode
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+
+logger = logging.getLogger(__name__)
+
+
+class GeocoderError(Exception):
+    """
+    Error raised by a geocoder backend. `retryable` is True if the same query
+    might succeed later (network error, rate limit, server error, ...)
+    """
+
+    def __init__(self, msg: str, retryable: bool = False):
+        super().__init__(msg)
+        self.retryable = retryable
+
+
+class Geocoder:
+    """
+    Base class for geocoder backends. A backend must implement both a batch
+    geocoder (`csv`) and a single query geocoder (`search`).
+    """
+
+    # Identifier of the backend, used to build cache keys
+    name = "geocoder"
+    # Whether results should be stored in french-cities' cache
+    cache_results = True
+    # Whether queries should be throttled (public APIs' usage policies)
+    rate_limited = True
+
+    @property
+    def csv_api(self) -> str:
+        "API targeted by the batch geocoder (see french_cities.executor)"
+        return self.name
+
+    @property
+    def search_api(self) -> str:
+        "API targeted by the single query geocoder"
+        return self.name
+
+    def csv(self, chunk: pd.DataFrame, session: Session) -> pd.DataFrame:
+        """
+        Geocode a batch of addresses. As for BAN's CSV geocoder, the query
+        of each row is the concatenation of all its columns.
+
+        Parameters
+        ----------
+        chunk : pd.DataFrame
+            Addresses to geocode, with a "full" column.
+        session : Session
+            Web session
+
+        Raises
+        ------
+        GeocoderError
+            If the batch could not be geocoded.
+
+        Returns
+        -------
+        pd.DataFrame
+            Results with columns ['full', 'result_score', 'result_city',
+            'result_citycode']
+
+        """
+        raise NotImplementedError
+
+    def search(self, query: str, session: Session) -> list:
+        """
+        Geocode a single query, looking for municipalities only.
+
+        Parameters
+        ----------
+        query : str
+            Query to geocode
+        session : Session
+            Web session
+
+        Raises
+        ------
+        GeocoderError
+            If the query could not be geocoded.
+
+        Returns
+        -------
+        list
+            List of results (dictionaries with keys "score", "city" and
+            "citycode"), best first.
+
+        """
+        raise NotImplementedError
+
+
+def _check_response(r, msg: str):
+    "Raise a GeocoderError if the response is not ok"
+    if not r.ok:
+        raise GeocoderError(
+            f"{msg} - response was {r}",
+            retryable=r.status_code == 429 or r.status_code >= 500,
+        )
+
+
+def _body(r) -> io.RawIOBase:
+    """
+    Body of a response as a file-like object: read from the network as it is
+    parsed when the response is streamed, from memory otherwise (responses
+    served by requests-cache, or session-like mocks).
+    """
+    if getattr(r, "_content_consumed", True) or r.raw is None:
+        return io.BytesIO(r.content)
+    # Note: let urllib3 decompress gzipped bodies
+    r.raw.decode_content = True
+    return r.raw
+
+
+class BANGeocoder(Geocoder):
+    """
+    Public adresse API (BAN = Base Adresse Nationale).
+
+    Parameters
+    ----------
+    csv_url : str, optional
+        URL of the CSV geocoder.
+    search_url : str, optional
+        URL of the individual geocoder.
+
+    """
+
+    name = "ban"
+    csv_api = "ban"
+    search_api = "geopf"
+
+    def __init__(
+        self,
+        csv_url: str = "https://api-adresse.data.gouv.fr/search/csv/",
+        search_url: str = "https://data.geopf.fr/geocodage/search/",
+    ):
+        self.csv_url = csv_url
+        self.search_url = search_url
+
+    def csv(self, chunk: pd.DataFrame, session: Session) -> pd.DataFrame:
+        files = [
+            ("data", chunk.to_csv(index=False)),
+            # erratic behaviour of BAN API, deactivate type filtering for now
+            # ("type", (None, "municipality")),
+            ("result_columns", (None, "full")),
+            ("result_columns", (None, "result_score")),
+            ("result_columns", (None, "result_city")),
+            ("result_columns", (None, "result_citycode")),
+            ("result_columns", (None, "result_type")),
+        ]
+        try:
+            # Note: the response is parsed while it is downloaded
+            r = session.post(self.csv_url, files=files, stream=True)
+        except RequestException as exc:
+            raise GeocoderError(str(exc), retryable=True) from exc
+        try:
+            _check_response(r, f"Failed to query {self.csv_url}")
+            return (
+                pd.read_csv(
+                    _body(r),
+                    dtype={"dep": str, "result_citycode": str},
+                    usecols=[
+                        "full",
+                        "result_score",
+                        "result_city",
+                        "result_citycode",
+                    ],
+                )
+                .loc[
+                    :,
+                    ["full", "result_score", "result_city", "result_citycode"],
+                ]
+                .drop_duplicates()
+            )
+        except GeocoderError:
+            raise
+        except (RequestException, Urllib3Error) as exc:
+            # Note: the body is read from urllib3's stream
+            raise GeocoderError(
+                f"Failed to download BAN's return: {exc}", retryable=True
+            ) from exc
+        except Exception as exc:
+            raise GeocoderError(
+                f"Failed to parse BAN's return: {exc}"
+            ) from exc
+        finally:
+            if hasattr(r, "close"):
+                # release the connection to the pool
+                r.close()
+
+    def search(self, query: str, session: Session) -> list:
+        try:
+            r = session.get(
+                self.search_url,
+                params={
+                    "q": query,
+                    "type": "municipality",
+                    "autocomplete": 0,
+                    "limit": 1,
+                },
+            )
+        except RequestException as exc:
+            raise GeocoderError(str(exc), retryable=True) from exc
+        _check_response(r, f"Failed to query {self.search_url}")
+
+        try:
+            features = r.json()["features"]
+        except (ValueError, KeyError, TypeError) as exc:
+            raise GeocoderError(
+                f"Unexpected response for q={query}: {r}"
+            ) from exc
+        keys = ["score", "city", "citycode"]
+        return [
+            {k: dict_["properties"].get(k) for k in keys} for dict_ in features
+        ]
+
+
+class AddokGeocoder(BANGeocoder):
+    """
+    Self-hosted addok instance (the engine behind BAN's API).
+
+    Parameters
+    ----------
+    url : str
+        Root URL of the addok instance (for instance "http://localhost:7878")
+
+    """
+
+    rate_limited = False
+
+    def __init__(self, url: str):
+        url = url.rstrip("/")
+        super().__init__(
+            csv_url=f"{url}/search/csv/", search_url=f"{url}/search/"
+        )
+        self.name = f"addok:{url}"
+
+
+def _normalize(s: str) -> str:
+    return " ".join(re.split(r"\W+", unidecode(s).upper())).strip()
+
+
+class LocalBANGeocoder(Geocoder):
+    """
+    Offline geocoder working on BAN's departmental dumps stored on disk
+    (files "adresses-XX.csv.gz", downloadable from
+    https://adresse.data.gouv.fr/data/ban/adresses/latest/csv/).
+
+    Note that this geocoder only recognizes municipalities (using postcodes,
+    departments and cities' labels found in the query): the addresses
+    themselves are not geocoded.
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing BAN's dumps.
+
+    """
+
+    cache_results = False
+    rate_limited = False
+    # Minimal score of a municipality for a department found in the query
+    # to be trusted (see _geocode)
+    dep_score_cutoff = 90
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.name = f"local:{directory}"
+        self._lock = threading.Lock()
+        self._municipalities = None
+        self._indexes = None
+
+    @property
+    def municipalities(self) -> pd.DataFrame:
+        "Municipalities found in the dumps (loaded on first use)"
+        with self._lock:
+            if self._municipalities is None:
+                self._municipalities = self._load()
+                self._indexes = self._build_indexes(self._municipalities)
+        return self._municipalities
+
+    @property
+    def indexes(self) -> dict:
+        """
+        Candidates (labels, names and codes of municipalities) by postcode,
+        by department and overall (key None), built on first use.
+        """
+        self.municipalities
+        return self._indexes
+
+    @staticmethod
+    def _build_indexes(municipalities: pd.DataFrame) -> dict:
+        def candidates(df):
+            df = df.drop_duplicates(["code_insee", "label"])
+            return (
+                df["label"].tolist(),
+                df["nom_commune"].tolist(),
+                df["code_insee"].tolist(),
+            )
+
+        return {
+            "code_postal": {
+                key: candidates(df)
+                for key, df in municipalities.groupby("code_postal")
+            },
+            "dep": {
+                key: candidates(df)
+                for key, df in municipalities.groupby("dep")
+            },
+            None: candidates(municipalities),
+        }
+
+    def _load(self) -> pd.DataFrame:
+        paths = sorted(
+            glob.glob(os.path.join(self.directory, "adresses-*.csv"))
+            + glob.glob(os.path.join(self.directory, "adresses-*.csv.gz"))
+        )
+        if not paths:
+            raise GeocoderError(f"No BAN's dump found in {self.directory}")
+        logger.info(
+            "loading %s BAN's dumps from %s", len(paths), self.directory
+        )
+        columns = ["code_postal", "code_insee", "nom_commune"]
+        municipalities = pd.concat(
+            [
+                pd.read_csv(
+                    path, sep=";", usecols=columns, dtype=str
+                ).drop_duplicates()
+                for path in paths
+            ],
+            ignore_index=True,
+        ).drop_duplicates()
+        municipalities["dep"] = municipalities["code_insee"].str[:2]
+        ix = municipalities[municipalities["dep"] == "97"].index
+        municipalities.loc[ix, "dep"] = municipalities.loc[
+            ix, "code_insee"
+        ].str[:3]
+        municipalities["label"] = municipalities["nom_commune"].apply(
+            _normalize
+        )
+        return municipalities.reset_index(drop=True)
+
+    def _candidates(self, field: str, tokens: list) -> tuple:
+        "Candidates of the tokens found in an index (None if none found)"
+        selection = [
+            self.indexes[field][x]
+            for x in dict.fromkeys(tokens)
+            if x in self.indexes[field]
+        ]
+        if not selection:
+            return None
+        return tuple(
+            [x for candidates in selection for x in candidates[i]]
+            for i in range(3)
+        )
+
+    def _geocode(self, query: str) -> dict:
+        tokens = _normalize(query).split()
+        # BAN's CSV queries may contain the same label multiple times
+        text = " ".join(dict.fromkeys(x for x in tokens if not x.isdigit()))
+
+        # Restrict the candidates to the postcodes found in the query or,
+        # failing that, to its departments: short numbers being ambiguous
+        # with house numbers, a department is only trusted if one of its
+        # municipalities matches closely
+        result = None
+        candidates = self._candidates("code_postal", tokens)
+        if candidates is None:
+            candidates = self._candidates("dep", tokens)
+            if candidates is not None:
+                result = process.extractOne(
+                    text,
+                    candidates[0],
+                    scorer=fuzz.WRatio,
+                    score_cutoff=self.dep_score_cutoff,
+                )
+                if not result:
+                    candidates = None
+        if candidates is None:
+            candidates = self.indexes[None]
+        if not result:
+            result = process.extractOne(
+                text, candidates[0], scorer=fuzz.WRatio, score_cutoff=50
+            )
+        if not result:
+            return None
+        _label, score, ix = result
+        _labels, cities, codes = candidates
+        return {
+            "score": score / 100,
+            "city": cities[ix],
+            "citycode": codes[ix],
+        }
+
+    def csv(self, chunk: pd.DataFrame, session: Session) -> pd.DataFrame:
+        queries = chunk.fillna("").astype(str).agg(" ".join, axis=1)
+        results = [self._geocode(x) or {} for x in queries]
+        return pd.DataFrame(
+            {
+                "full": chunk["full"].tolist(),
+                "result_score": [x.get("score") for x in results],
+                "result_city": [x.get("city") for x in results],
+                "result_citycode": [x.get("citycode") for x in results],
+            }
+        ).drop_duplicates()
+
+    def search(self, query: str, session: Session) -> list:
+        result = self._geocode(query)
+        return [result] if result else []
+
+
+@lru_cache(maxsize=None)
+def _get_geocoder(spec: str) -> Geocoder:
+    kind, _, arg = spec.partition(":")
+    if kind == "ban":
+        return BANGeocoder()
+    if kind == "addok" and arg:
+        return AddokGeocoder(arg)
+    if kind == "local" and arg:
+        return LocalBANGeocoder(arg)
+    raise ValueError(
+        "geocoder should be among 'ban', 'addok:<url>' or 'local:<directory>'"
+        f" - found {spec} instead"
+    )
+
+
+def get_geocoder(geocoder=None) -> Geocoder:
+    """
+    Get a geocoder backend.
+
+    Parameters
+    ----------
+    geocoder : Geocoder or str, optional
+        Either a Geocoder instance (which is returned as is) or a string
+        among 'ban', 'addok:<url>' or 'local:<directory>'. The default is
+        None (FRENCH_CITIES_GEOCODER environment variable will be used, or
+        BAN's public API if not set).
+
+    Raises
+    ------
+    ValueError
+        If the geocoder's specification is not understood.
+
+    Returns
+    -------
+    Geocoder
+        Geocoder backend
+
+    """
+    if isinstance(geocoder, Geocoder):
+        return geocoder
+    if not geocoder:
+        geocoder = os.environ.get("FRENCH_CITIES_GEOCODER", "ban")
+    return _get_geocoder(geocoder)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 14:05:52 2026
+
+Scalar lookups (one city, one postcode, one code at a time), answered from
+in-memory indexes built once per process from the referentials. These are
+intended for interactive use (validation of a form's field for instance);
+use find_city, find_departements or set_vintage to process whole datasets.
+"""
+
+from datetime import date
+import logging
+import threading
+from typing import Union
+
+import pandas as pd
+from rapidfuzz import fuzz, process
+
+from french_cities.city_finder import _clean_city_label
+from french_cities.referential import (
+    get_cities_referential,
+    get_postcodes_referential,
+)
+from french_cities.vintage import set_vintage
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def _build_indexes(threads: int = None) -> dict:
+    "Build every in-memory index from the referentials"
+    logger.info("building lookup indexes")
+    cities = get_cities_referential(threads=threads)
+    postcodes = get_postcodes_referential(threads=threads)
+
+    indexes = {}
+
+    # Labels and codes by department (same candidates as find_city's fuzzy
+    # matching stage)
+    labels = cities.drop_duplicates(["TITLE_SHORT", "dep"])
+    indexes["labels"] = {
+        dep: (df["TITLE_SHORT"].tolist(), df["CODE"].tolist())
+        for dep, df in labels.groupby("dep")
+    }
+    indexes["labels"][None] = (
+        labels["TITLE_SHORT"].tolist(),
+        labels["CODE"].tolist(),
+    )
+    exact = {}
+    for label, dep, code in labels[["TITLE_SHORT", "dep", "CODE"]].itertuples(
+        index=False
+    ):
+        exact.setdefault(label, []).append((dep, code))
+    indexes["exact"] = exact
+
+    # Validity periods of each code (ultramarine rows may lack a creation
+    # date: their period is then open at the start)
+    validity = {}
+    for code, start, end in cities[
+        ["CODE", "DATE_CREATION", "DATE_DELETION"]
+    ].itertuples(index=False):
+        validity.setdefault(code, []).append(
+            (
+                None if pd.isnull(start) else start,
+                None if pd.isnull(end) else end,
+            )
+        )
+    indexes["validity"] = validity
+
+    # Departments and cities of each postcode
+    postcodes = postcodes.dropna(subset=["dep"])
+    indexes["postcode_deps"] = {
+        postcode: tuple(sorted(set(df["dep"])))
+        for postcode, df in postcodes.groupby("postcode")
+    }
+    indexes["postcode_codes"] = {
+        postcode: frozenset(df["CODE"])
+        for postcode, df in postcodes.groupby("postcode")
+    }
+
+    # Projections already computed
+    indexes["projections"] = {}
+    return indexes
+
+
+def _get_indexes() -> dict:
+    with _lock:
+        if not _indexes:
+            _indexes.update(_build_indexes())
+        return _indexes
+
+
+def clear_indexes():
+    "Drop the indexes stored in memory (they will be rebuilt if needed)"
+    with _lock:
+        _indexes.clear()
+
+
+def _check_year(year: Union[str, int]) -> int:
+    if year == "last":
+        return date.today().year
+    try:
+        return int(year)
+    except ValueError as exc:
+        raise ValueError(
+            "year should either be castable to int or 'last', "
+            f"found {year} instead"
+        ) from exc
+
+
+def _normalize_postcode(postcode) -> str:
+    if postcode is None or pd.isnull(postcode):
+        return None
+    return str(postcode).strip().zfill(5)
+
+
+def _match_label(label: str, exact: set, labels: list, codes: list) -> str:
+    """
+    Find the code of the best match of label among labels. Exact matches
+    (which codes are given by `exact`) are preferred; fuzzy matches follow
+    find_city's rules (simple ratio above 80, then WRatio above 90). Ties
+    between multiple codes are considered as failures.
+    """
+    found = set(exact)
+    if not found:
+        for scorer, cutoff in ((fuzz.ratio, 80), (fuzz.WRatio, 90)):
+            matches = process.extract(
+                label, labels, scorer=scorer, score_cutoff=cutoff, limit=None
+            )
+            if matches:
+                best = max(score for _, score, _ in matches)
+                found = {codes[k] for _, score, k in matches if score == best}
+                break
+    if len(found) == 1:
+        return found.pop()
+    return None
+
+
+def dep_from_postcode(postcode: str) -> str:
+    """
+    Get the department's code of a postcode.
+
+    Parameters
+    ----------
+    postcode : str
+        Postcode (leading zeros may be omitted)
+
+    Returns
+    -------
+    str
+        Department's code, or None if the postcode is unknown or if multiple
+        departments share this postcode (13780 may be either 13 or 83 for
+        instance).
+
+    Example
+    -------
+    >>> dep_from_postcode("59000")
+    '59'
+
+    """
+    postcode = _normalize_postcode(postcode)
+    deps = _get_indexes()["postcode_deps"].get(postcode, ())
+    if len(deps) == 1:
+        return deps[0]
+    return None
+
+
+def project_code(code: str, year: Union[str, int] = "last") -> str:
+    """
+    Project a city's code into a desired vintage.
+
+    Parameters
+    ----------
+    code : str
+        City's official code
+    year : Union[str, int], optional
+        Desired vintage. year should be of a type castable to int or 'last'.
+        The default is "last".
+
+    Raises
+    ------
+    ValueError
+        If year is neither castable to int nor equal to "last".
+
+    Returns
+    -------
+    str
+        Projected code, or None if no projection has been found.
+
+    Example
+    -------
+    >>> project_code("59298", 2024)
+    '59350'
+
+    """
+    year = _check_year(year)
+    indexes = _get_indexes()
+    when = f"{year}-01-01"
+    periods = indexes["validity"].get(code, [])
+    if any(
+        (start is None or start <= when) and (end is None or end > when)
+        for start, end in periods
+    ):
+        return code
+
+    try:
+        return indexes["projections"][code, year]
+    except KeyError:
+        pass
+    df = set_vintage(pd.DataFrame({"code": [code]}), year, "code")
+    projected = df.at[0, "code"]
+    projected = None if pd.isnull(projected) else projected
+    indexes["projections"][code, year] = projected
+    return projected
+
+
+def city_code(
+    label: str,
+    dep: str = None,
+    postcode: str = None,
+    year: Union[str, int] = "last",
+) -> str:
+    """
+    Get a city's official code from its label.
+
+    Parameters
+    ----------
+    label : str
+        City's label
+    dep : str, optional
+        Department's code. The default is None.
+    postcode : str, optional
+        Postcode (leading zeros may be omitted). The default is None.
+    year : Union[str, int], optional
+        Desired vintage. year should be of a type castable to int or 'last'.
+        The default is "last".
+
+    Raises
+    ------
+    ValueError
+        If year is neither castable to int nor equal to "last".
+
+    Returns
+    -------
+    str
+        City's official code, or None if no city (or multiple cities) have
+        been found.
+
+    Example
+    -------
+    >>> city_code("Lille", dep="59")
+    '59350'
+    >>> city_code("Loos", postcode="59120")
+    '59360'
+
+    """
+    _check_year(year)
+    if not isinstance(label, str) or not label.strip():
+        return None
+    indexes = _get_indexes()
+    label = _clean_city_label(label)
+    postcode = _normalize_postcode(postcode)
+
+    if dep:
+        deps = [dep]
+    else:
+        deps = list(indexes["postcode_deps"].get(postcode, ())) or [None]
+
+    if len(deps) == 1:
+        labels, codes = indexes["labels"].get(deps[0], ([], []))
+    else:
+        labels, codes = [], []
+        for this_dep in deps:
+            these = indexes["labels"].get(this_dep, ([], []))
+            labels = labels + these[0]
+            codes = codes + these[1]
+    exact = {
+        code
+        for this_dep, code in indexes["exact"].get(label, [])
+        if deps == [None] or this_dep in deps
+    }
+
+    code = None
+    if postcode in indexes["postcode_codes"]:
+        # Look first among cities served by this postcode
+        allowed = indexes["postcode_codes"][postcode]
+        ix = [k for k, x in enumerate(codes) if x in allowed]
+        code = _match_label(
+            label,
+            exact & allowed,
+            [labels[k] for k in ix],
+            [codes[k] for k in ix],
+        )
+    if not code:
+        code = _match_label(label, exact, labels, codes)
+    if not code:
+        return None
+    return project_code(code, year)
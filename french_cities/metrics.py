@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 09:27:40 2026
+
+Instrumentation of the resolution pipelines: wall time and rows processed by
+each stage, HTTP calls per host, hits/misses of each cache and rows left
+unresolved because of failed requests.
+
+Measures are only collected while at least one report (see collect_metrics)
+or one callback (see add_metrics_callback) is active. Reports are scoped to
+the context they are collected in (and to the tasks run by the shared
+executor on its behalf), so that concurrent calls get their own metrics.
+"""
+
+from contextlib import contextmanager
+import contextvars
+import logging
+import threading
+import time
+from typing import Callable
+from urllib.parse import urlparse
+
+from requests import Response, Session
+
+from french_cities.executor import response_hook as _throttling_hook
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_reports = contextvars.ContextVar("metrics_reports", default=())
+_callbacks = []
+_cache_totals = {}
+
+
+class MetricsReport:
+    """
+    Metrics collected during a `collect_metrics` block.
+
+    Attributes
+    ----------
+    stages : dict
+        Stages' metrics, by stage's name: number of calls, wall time (in
+        seconds), rows given as input and rows resolved.
+    http : dict
+        Number of HTTP calls sent to the network, by host.
+    caches : dict
+        Hits and misses, by cache's name.
+    failures : dict
+        Rows left unresolved because their requests failed (despite
+        retries), by step.
+    seconds : float
+        Wall time of the whole block.
+
+    """
+
+    def __init__(self, callback: Callable = None):
+        self._callback = callback
+        self.stages = {}
+        self.http = {}
+        self.caches = {}
+        self.failures = {}
+        self.seconds = None
+
+    def _add(self, event: dict):
+        kind = event["kind"]
+        if kind == "stage":
+            stage = self.stages.setdefault(
+                event["name"],
+                {"calls": 0, "seconds": 0.0, "rows_in": 0, "rows_out": 0},
+            )
+            stage["calls"] += 1
+            for key in ("seconds", "rows_in", "rows_out"):
+                stage[key] += event[key] or 0
+        elif kind == "http":
+            self.http[event["host"]] = self.http.get(event["host"], 0) + 1
+        elif kind == "cache":
+            cache = self.caches.setdefault(
+                event["cache"], {"hits": 0, "misses": 0}
+            )
+            cache["hits"] += event["hits"]
+            cache["misses"] += event["misses"]
+        elif kind == "failure":
+            self.failures[event["name"]] = (
+                self.failures.get(event["name"], 0) + event["rows"]
+            )
+
+    def to_dict(self) -> dict:
+        "Export the report as a dict (JSON serializable)"
+        return {
+            "seconds": self.seconds,
+            "stages": {k: dict(v) for k, v in self.stages.items()},
+            "http": dict(self.http),
+            "caches": {k: dict(v) for k, v in self.caches.items()},
+            "failures": dict(self.failures),
+        }
+
+    def __repr__(self):
+        lines = [f"MetricsReport ({self.seconds or 0:.2f}s)"]
+        for name, stage in self.stages.items():
+            lines.append(
+                f"  stage {name}: {stage['seconds']:.2f}s, "
+                f"{stage['calls']} call(s), "
+                f"{stage['rows_in']} rows in, {stage['rows_out']} rows out"
+            )
+        for host, calls in self.http.items():
+            lines.append(f"  http {host}: {calls} call(s)")
+        for name, cache in self.caches.items():
+            lines.append(
+                f"  cache {name}: {cache['hits']} hit(s), "
+                f"{cache['misses']} miss(es)"
+            )
+        for name, rows in self.failures.items():
+            lines.append(f"  failure {name}: {rows} row(s) unresolved")
+        return "\n".join(lines)
+
+
+def _active() -> bool:
+    return bool(_reports.get() or _callbacks)
+
+
+def _emit(event: dict):
+    "Forward an event to the reports of the current context and callbacks"
+    reports = _reports.get()
+    with _lock:
+        callbacks = list(_callbacks)
+        for report in reports:
+            report._add(event)
+    callbacks += [x._callback for x in reports if x._callback]
+    for callback in callbacks:
+        try:
+            callback(event)
+        except Exception as exc:
+            logger.error("metrics callback %s failed: %s", callback, exc)
+
+
+@contextmanager
+def collect_metrics(callback: Callable = None):
+    """
+    Collect metrics of every call made during the block, in the current
+    context (calls made concurrently by other threads are not collected,
+    tasks run by the shared executor on behalf of the block are).
+
+    Parameters
+    ----------
+    callback : Callable, optional
+        Function called with each event (a dict) of the block as soon as it
+        is measured, while the block is running. The default is None.
+
+    Yields
+    ------
+    MetricsReport
+        Report, completed once the block is done.
+
+    Example
+    -------
+    >>> from french_cities import collect_metrics, find_city
+    >>> with collect_metrics() as report:
+    ...     df = find_city(df)
+    >>> print(report.to_dict())
+
+    """
+    report = MetricsReport(callback)
+    token = _reports.set(_reports.get() + (report,))
+    start = time.perf_counter()
+    try:
+        yield report
+    finally:
+        report.seconds = time.perf_counter() - start
+        _reports.reset(token)
+
+
+def add_metrics_callback(callback: Callable):
+    """
+    Register a function called with each event measured from now on
+    (to forward metrics to a monitoring system for instance).
+
+    Events are dicts, with a "kind" key:
+
+    * {"kind": "stage", "name": ..., "seconds": ..., "rows_in": ...,
+      "rows_out": ...}
+    * {"kind": "http", "host": ...}
+    * {"kind": "cache", "cache": ..., "hits": ..., "misses": ...}
+    * {"kind": "failure", "name": ..., "rows": ...}
+
+    Note that callbacks may be called from any thread.
+
+    Parameters
+    ----------
+    callback : Callable
+        Function taking an event as single argument
+
+    """
+    with _lock:
+        _callbacks.append(callback)
+
+
+def remove_metrics_callback(callback: Callable):
+    """
+    Unregister a function previously registered with add_metrics_callback.
+
+    Parameters
+    ----------
+    callback : Callable
+        Function to unregister
+
+    """
+    with _lock:
+        try:
+            _callbacks.remove(callback)
+        except ValueError:
+            pass
+
+
+@contextmanager
+def stage(name: str, rows_in: int = None):
+    """
+    Measure a stage's wall time; the number of rows resolved by the stage may
+    be stored under the "rows_out" key of the yielded dict.
+    """
+    info = {"rows_out": None}
+    if not _active():
+        yield info
+        return
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        _emit(
+            {
+                "kind": "stage",
+                "name": name,
+                "seconds": time.perf_counter() - start,
+                "rows_in": None if rows_in is None else int(rows_in),
+                "rows_out": (
+                    None if info["rows_out"] is None else int(info["rows_out"])
+                ),
+            }
+        )
+
+
+def record_http(host: str):
+    "Count one HTTP call sent to host"
+    if _active():
+        _emit({"kind": "http", "host": host})
+
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    "Count hits and misses of a cache"
+    if not (hits or misses):
+        return
+    with _lock:
+        totals = _cache_totals.setdefault(cache, {"hits": 0, "misses": 0})
+        totals["hits"] += int(hits)
+        totals["misses"] += int(misses)
+    if _active():
+        _emit(
+            {
+                "kind": "cache",
+                "cache": cache,
+                "hits": int(hits),
+                "misses": int(misses),
+            }
+        )
+
+
+def record_failure(name: str, rows: int):
+    "Count rows left unresolved because their requests failed"
+    if _active() and rows:
+        _emit({"kind": "failure", "name": name, "rows": int(rows)})
+
+
+def cache_totals() -> dict:
+    "Hits and misses of each cache since the process started"
+    with _lock:
+        return {cache: dict(x) for cache, x in _cache_totals.items()}
+
+
+def _response_hook(r: Response, *args, **kwargs) -> Response:
+    # Note: with a requests-cache session, responses fetched from the network
+    # go through this hook twice (once as a plain response, then tagged by
+    # requests-cache with from_cache=False)
+    if not hasattr(r, "from_cache"):
+        record_http(urlparse(r.url).hostname)
+    elif r.from_cache:
+        record_cache("requests-cache", hits=1)
+    else:
+        record_cache("requests-cache", misses=1)
+    return r
+
+
+def instrument_session(session: Session) -> Session:
+    """
+    Count the HTTP calls (and requests-cache hits/misses) of a session, and
+    report the throttling of upstream APIs to the shared executor (see
+    french_cities.executor). Sessions are only instrumented once; objects
+    without hooks (session-like mocks for instance) are left untouched.
+    """
+    if not isinstance(getattr(session, "hooks", None), dict):
+        return session
+    hooks = session.hooks.setdefault("response", [])
+    for hook in (_response_hook, _throttling_hook):
+        if hook not in hooks:
+            hooks.append(hook)
+    return session
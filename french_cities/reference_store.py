@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 25 09:36:52 2026
+
+Reference store: versioned snapshots of INSEE's official geographic code (COG).
+
+Each snapshot is a single Parquet file gathering, for a given vintage, every
+level used by french-cities (communes, departements, ultramarine
+collectivities and their territories, municipal districts, associated and
+delegated communes with their parent communes). Snapshots are memory-mapped
+when loaded and used by every module instead of INSEE's API whenever
+available, so that workers sharing a cache directory don't have to warm
+pynsee's caches independently.
+
+Snapshots are built (or rebuilt) in one command, for instance:
+
+    python -m french_cities.reference_store 2024 2025 "*"
+
+("*" being the snapshot of all communes ever existing, used by find_city).
+"""
+
+import argparse
+from datetime import date as dt_date, datetime
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+from pynsee.localdata import get_area_list
+
+from french_cities import DIR_CACHE
+from french_cities.constants import (
+    REFERENCE_FORMAT,
+    REFERENCE_HISTORY_LEVELS,
+    REFERENCE_LEVELS,
+    REFERENCE_SUBAREAS,
+)
+from french_cities.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_tables = {}
+
+
+def _vintage(date: str = None) -> str:
+    """
+    Vintage of the snapshot covering a date ("*" for all vintages, None for
+    the current year), or None if no snapshot can cover it (COG vintages
+    starting on the first of January).
+    """
+    if date is None:
+        return str(dt_date.today().year)
+    if date == "*":
+        return "*"
+    if len(date) == 10 and date.endswith("-01-01"):
+        return date[:4]
+    return None
+
+
+def _path(vintage: str) -> str:
+    name = "all" if vintage == "*" else vintage
+    return os.path.join(DIR_CACHE, "reference", f"cog-{name}.parquet")
+
+
+def _write_snapshot(vintage: str, levels: dict) -> str:
+    """
+    Store the DataFrames of each level into the snapshot of a vintage.
+
+    Parameters
+    ----------
+    vintage : str
+        Vintage ("*" or a year)
+    levels : dict
+        DataFrames of each level
+
+    Returns
+    -------
+    str
+        Path of the snapshot
+
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = {
+        level: [str(x) for x in df.columns] for level, df in levels.items()
+    }
+    # Note: every field is stored as a string (as returned by INSEE's API)
+    df = pd.concat(
+        [df.assign(LEVEL=level) for level, df in levels.items()],
+        ignore_index=True,
+    )
+    df.columns = [str(x) for x in df.columns]
+    df = df.astype(str).where(df.notnull(), None)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {
+        "format": REFERENCE_FORMAT,
+        "vintage": vintage,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "columns": columns,
+    }
+    table = table.replace_schema_metadata(
+        {"french_cities": json.dumps(metadata)}
+    )
+
+    path = _path(vintage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(table, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def _load_snapshot(vintage: str):
+    """
+    Load (memory-mapped) the snapshot of a vintage, with its metadata; return
+    (None, None) if there is no valid snapshot for this vintage.
+    """
+    import pyarrow.parquet as pq
+
+    path = _path(vintage)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+
+    with _lock:
+        # Note: a snapshot rebuilt since it was loaded replaces the previous
+        # one (which is then released)
+        loaded = _tables.get(path)
+        if loaded and loaded[0] == mtime:
+            return loaded[1:]
+        table = pq.read_table(path, memory_map=True)
+        metadata = json.loads(table.schema.metadata[b"french_cities"])
+        if metadata["format"] != REFERENCE_FORMAT:
+            logger.warning(
+                "reference snapshot %s has an obsolete format and will be "
+                "ignored (please rebuild it)",
+                path,
+            )
+            table = metadata = None
+        _tables[path] = mtime, table, metadata
+        return table, metadata
+
+
+def clear_snapshots():
+    "Release the snapshots loaded in memory (they will be reloaded if needed)"
+    with _lock:
+        _tables.clear()
+
+
+def get_level(level: str, date: str = None) -> pd.DataFrame:
+    """
+    Get a level of the reference snapshot covering a date.
+
+    Parameters
+    ----------
+    level : str
+        Level among REFERENCE_LEVELS (ie. get_area_list's areas, or
+        "ultramarines" for the territories of ultramarine collectivities)
+    date : str, optional
+        Date of the COG (see get_area_list). The default is None (current
+        year).
+
+    Returns
+    -------
+    pd.DataFrame
+        Level's data, or None if no snapshot covers this date and level.
+
+    """
+    import pyarrow.compute as pc
+
+    vintage = _vintage(date)
+    if vintage is None:
+        return None
+    table, metadata = _load_snapshot(vintage)
+    if table is None or level not in metadata["columns"]:
+        record_cache("reference", misses=1)
+        return None
+
+    record_cache("reference", hits=1)
+    columns = metadata["columns"][level]
+    table = table.filter(pc.equal(table["LEVEL"], level)).select(columns)
+    return table.to_pandas()
+
+
+def area_list(
+    area: str, date: str = None, update: bool = False
+) -> pd.DataFrame:
+    """
+    Get the list of areas of a given type, from the reference store if
+    available (and update is False), from pynsee's get_area_list otherwise.
+    """
+    if not update:
+        df = get_level(area, date)
+        if df is not None:
+            return df
+    return get_area_list(area, date, update, silent=True)
+
+
+def build_snapshot(vintage, update: bool = False, threads: int = None) -> str:
+    """
+    Build (or rebuild) the snapshot of a vintage from INSEE's API.
+
+    Parameters
+    ----------
+    vintage : Union[int, str]
+        Year of the COG, or "*" for all communes ever existing.
+    update : bool, optional
+        If True, pynsee's locally saved data is updated too. The default is
+        False.
+    threads : int, optional
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
+
+    Returns
+    -------
+    str
+        Path of the snapshot
+
+    """
+    from french_cities.ultramarine_pseudo_cog import _get_ultramarines_cities
+    from french_cities.utils import init_pynsee
+    from french_cities.vintage import _get_parents_from_serie
+
+    vintage = str(vintage)
+    if vintage != "*" and not vintage.isdigit():
+        raise ValueError(f"vintage should be a year or '*', found {vintage}")
+    date = "*" if vintage == "*" else f"{vintage}-01-01"
+
+    init_pynsee()
+    levels = {}
+    names = REFERENCE_HISTORY_LEVELS if vintage == "*" else REFERENCE_LEVELS
+    for level in names:
+        logger.info("building reference level %s for %s", level, vintage)
+        if level == "ultramarines":
+            levels[level] = _get_ultramarines_cities(
+                date, update=update, threads=threads, use_store=False
+            )
+            continue
+        df = get_area_list(level, date, update, silent=True)
+        if level in REFERENCE_SUBAREAS and not df.empty:
+            parents = _get_parents_from_serie(
+                REFERENCE_SUBAREAS[level],
+                df["CODE"].unique(),
+                int(vintage),
+                threads=threads,
+            )
+            df = df.merge(parents, on="CODE", how="left")
+        levels[level] = df
+    return _write_snapshot(vintage, levels)
+
+
+def build_reference_store(
+    *vintages, update: bool = False, threads: int = None
+) -> list:
+    """
+    Build (or rebuild) the reference snapshots of several vintages.
+
+    Parameters
+    ----------
+    *vintages :
+        Years of the COG, or "*" for all communes ever existing. The default
+        is the current year and "*".
+    update : bool, optional
+        If True, pynsee's locally saved data is updated too. The default is
+        False.
+    threads : int, optional
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
+
+    Returns
+    -------
+    list
+        Paths of the snapshots
+
+    Example
+    -------
+    >>> build_reference_store(2024, 2025, "*")
+
+    """
+    vintages = vintages or (dt_date.today().year, "*")
+    return [
+        build_snapshot(x, update=update, threads=threads) for x in vintages
+    ]
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m french_cities.reference_store",
+        description="Build french-cities' reference snapshots of the COG",
+    )
+    parser.add_argument(
+        "vintages",
+        nargs="*",
+        help='years of the COG, or "*" for all communes ever existing '
+        '(default: current year and "*")',
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="update pynsee's locally saved data too",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="maximum number of concurrent requests",
+    )
+    args = parser.parse_args(args)
+    paths = build_reference_store(
+        *args.vintages, update=args.update, threads=args.threads
+    )
+    for path in paths:
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
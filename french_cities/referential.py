@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+
+Process-level referential of french cities (all vintages), lazily built once
+and shared by every stage of cities recognition.
+"""
+
+import io
+import logging
+import threading
+
+import pandas as pd
+from requests import Session
+from unidecode import unidecode
+
+from french_cities.constants import HEXASMAL_URL
+from french_cities.departement_finder import (
+    find_departements,
+    get_default_session,
+)
+from french_cities.ultramarine_pseudo_cog import get_cities_and_ultramarines
+from french_cities.utils import init_pynsee
+
+logger = logging.getLogger(__name__)
+
+# Note: reentrant, as referentials may be built on top of each other
+_lock = threading.RLock()
+_referentials = {}
+
+
+def normalize_labels(s: pd.Series) -> pd.Series:
+    """
+    Normalize cities' labels to allow comparisons (uppercase, no accents, any
+    non alphanumeric character replaced by a whitespace).
+
+    Parameters
+    ----------
+    s : pd.Series
+        Cities' labels
+
+    Returns
+    -------
+    pd.Series
+        Normalized labels
+
+    """
+    return (
+        s.str.upper()
+        .apply(unidecode)
+        .str.split(r"\W+")
+        .str.join(" ")
+        .str.strip(" ")
+    )
+
+
+def get_cities_referential(threads: int = None) -> pd.DataFrame:
+    """
+    Get the referential of all cities (and ultramarine equivalents) known to
+    the COG, whatever their vintage. The referential is computed once per
+    process and shared between callers : it should **NOT** be modified in
+    place.
+
+    Parameters
+    ----------
+    threads : int, optional
+        Maximum number of concurrent requests when the referential has to
+        be built. Default is None (adaptive budgets, see
+        configure_concurrency).
+
+    Returns
+    -------
+    pd.DataFrame
+        Referential with the following columns:
+            * CODE: official code of the city
+            * TITLE_SHORT: normalized label of the city
+            * DATE_CREATION: starting date of validity
+            * DATE_DELETION: ending date of validity (NaN if still valid)
+            * dep: current department's code of the city
+
+    """
+    with _lock:
+        try:
+            return _referentials["cities"]
+        except KeyError:
+            pass
+
+        logger.info("building cities referential")
+        init_pynsee()
+
+        cities = get_cities_and_ultramarines(date="*", threads=threads)
+        cities = cities.reindex(
+            ["CODE", "TITLE_SHORT", "DATE_CREATION", "DATE_DELETION"], axis=1
+        )
+        cities["TITLE_SHORT"] = normalize_labels(cities["TITLE_SHORT"])
+
+        cities = find_departements(
+            cities,
+            source="CODE",
+            alias="dep",
+            type_field="insee",
+            do_set_vintage=False,
+            threads=threads,
+        )
+        cities = cities.drop_duplicates(keep="first").reset_index(drop=True)
+
+        _referentials["cities"] = cities
+        return cities
+
+
+def get_postcodes_referential(
+    session: Session = None, threads: int = None
+) -> pd.DataFrame:
+    """
+    Get the referential of postcodes (official dataset from La Poste). The
+    referential is computed once per process and shared between callers : it
+    should **NOT** be modified in place.
+
+    Parameters
+    ----------
+    session : Session, optional
+        Web session. The default is None (and will use a CachedSession with
+        30 days expiration)
+    threads : int, optional
+        Maximum number of concurrent requests when the referential has to
+        be built. Default is None (adaptive budgets, see
+        configure_concurrency).
+
+    Raises
+    ------
+    ValueError
+        If the dataset could not be downloaded.
+
+    Returns
+    -------
+    pd.DataFrame
+        Referential with the following columns:
+            * postcode: postcode
+            * CODE: official code of the city
+            * dep: department's code of the city
+
+    """
+    with _lock:
+        try:
+            return _referentials["postcodes"]
+        except KeyError:
+            pass
+
+        logger.info("building postcodes referential")
+        if not session:
+            session = get_default_session()
+        r = session.get(HEXASMAL_URL)
+        if not r.ok:
+            raise ValueError(
+                f"Failed to download postcodes dataset - response was {r}"
+            )
+        postcodes = pd.read_csv(
+            io.BytesIO(r.content), sep=";", encoding="cp1252", dtype=str
+        )
+        postcodes = postcodes[["Code_postal", "#Code_commune_INSEE"]]
+        postcodes.columns = ["postcode", "CODE"]
+        postcodes = postcodes.drop_duplicates()
+        postcodes = find_departements(
+            postcodes,
+            source="CODE",
+            alias="dep",
+            type_field="insee",
+            do_set_vintage=False,
+            threads=threads,
+        )
+        postcodes = postcodes.drop_duplicates().reset_index(drop=True)
+
+        _referentials["postcodes"] = postcodes
+        return postcodes
+
+
+def clear_referentials():
+    "Drop the referentials stored in memory (they will be rebuilt if needed)"
+    with _lock:
+        _referentials.clear()
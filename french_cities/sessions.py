@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 24 14:51:09 2026
+
+Web sessions created by french-cities: one session per HTTP cache and per
+process (shared by every call and thread), with connection pools sized to the
+shared executor, so that concurrent workers keep their connections alive
+instead of waiting for (or discarding) pooled connections.
+
+The requests-cache backend can be chosen with configure_http_cache or the
+FRENCH_CITIES_HTTP_CACHE environment variable: "sqlite" (default, in WAL
+mode), "filesystem" (one file per response, no database lock) or "memory"
+(no persistence, fastest).
+"""
+
+from datetime import timedelta
+import logging
+import os
+import threading
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+
+from french_cities import DIR_CACHE, _load_dotenv
+from french_cities.constants import HTTP_CACHE_BACKENDS, HTTP_POOL_MAXSIZE
+from french_cities.metrics import instrument_session
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_sessions = {}
+_backend = None
+
+
+def _get_backend() -> str:
+    backend = _backend or os.environ.get("FRENCH_CITIES_HTTP_CACHE", "sqlite")
+    if backend not in HTTP_CACHE_BACKENDS:
+        logger.warning(
+            "unknown HTTP cache backend %s, sqlite will be used", backend
+        )
+        backend = "sqlite"
+    return backend
+
+
+def _build_session(name: str, allowable_methods: tuple) -> Session:
+    backend = _get_backend()
+    kwargs = {"wal": True} if backend == "sqlite" else {}
+    session = CachedSession(
+        cache_name=os.path.join(DIR_CACHE, name),
+        backend=backend,
+        allowable_methods=allowable_methods,
+        expire_after=timedelta(days=30),
+        # Note: expired responses are still used when the API is unreachable
+        # (on offline workers, see french_cities.cache_bundle)
+        stale_if_error=True,
+        **kwargs,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_MAXSIZE, pool_maxsize=HTTP_POOL_MAXSIZE
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    proxies = {}
+    proxies["http"] = os.environ.get("http_proxy", None)
+    proxies["https"] = os.environ.get("https_proxy", None)
+    session.proxies.update(proxies)
+    return instrument_session(session)
+
+
+def get_session(name: str, allowable_methods: tuple = ("GET",)) -> Session:
+    """
+    Get the session of an HTTP cache (a CachedSession with 30 days
+    expiration, using http_proxy and https_proxy environment variables),
+    created on first use in each process.
+
+    Parameters
+    ----------
+    name : str
+        Name of the HTTP cache (see constants.HTTP_CACHES)
+    allowable_methods : tuple, optional
+        HTTP methods cached. The default is ("GET",).
+
+    Returns
+    -------
+    Session
+        Web session
+
+    """
+    # Note: proxies may be set in a .env file
+    _load_dotenv()
+
+    # Note: sessions (and their connections) are not shared with forked
+    # processes
+    key = (os.getpid(), name)
+    with _lock:
+        try:
+            return _sessions[key]
+        except KeyError:
+            pass
+        session = _sessions[key] = _build_session(name, allowable_methods)
+        return session
+
+
+def clear_sessions():
+    "Close the sessions created by french-cities (rebuilt on next use)"
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+def configure_http_cache(backend: str = "sqlite"):
+    """
+    Set the requests-cache backend of the sessions created by french-cities,
+    for the whole process.
+
+    Parameters
+    ----------
+    backend : str, optional
+        Either "sqlite" (persistent, in WAL mode), "filesystem" (persistent,
+        one file per response: no database lock between concurrent workers)
+        or "memory" (not persistent, fastest). The default is "sqlite".
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown.
+
+    Example
+    -------
+    >>> configure_http_cache("filesystem")
+
+    """
+    global _backend
+    if backend not in HTTP_CACHE_BACKENDS:
+        raise ValueError(
+            f"backend should be one of {HTTP_CACHE_BACKENDS}, "
+            f"found {backend} instead"
+        )
+    _backend = backend
+    clear_sessions()
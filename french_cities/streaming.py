@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:41:12 2026
+
+Streaming entry points, used to process files too large to fit in memory:
+the file is read (and written) chunk by chunk, each chunk being resolved with
+the same session, caches and referentials.
+"""
+
+import inspect
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Iterable, Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from requests import Session
+
+from french_cities import city_finder, departement_finder
+from french_cities.city_finder import find_city
+from french_cities.constants import STREAM_BATCH_SIZE, STREAM_CHUNKSIZE
+from french_cities.departement_finder import find_departements
+
+
+logger = logging.getLogger(__name__)
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+def _is_parquet(path: str) -> bool:
+    return str(path).lower().endswith(PARQUET_SUFFIXES)
+
+
+def _read_chunks(path: str, chunksize: int, dtype: dict, sep: str):
+    "Iterate over chunks of a CSV or a Parquet file"
+    if _is_parquet(path):
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            # Note: as for CSV files, `dtype` columns are read as strings
+            # (Arrow's cast keeps nulls and doesn't add decimals to integers)
+            for i, field in enumerate(batch.schema):
+                if dtype.get(field.name) is str and field.type != pa.string():
+                    batch = batch.set_column(
+                        i, field.name, batch.column(i).cast(pa.string())
+                    )
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, sep=sep, dtype=dtype, chunksize=chunksize)
+
+
+class _ChunksWriter:
+    """
+    Write chunks incrementally to a CSV or a Parquet file. Columns in
+    `strings` will be stored as strings in Parquet files (whatever the type
+    inferred from the first chunk, which may be empty).
+    """
+
+    def __init__(self, path: str, strings: set, sep: str):
+        self.path = path
+        self.strings = strings
+        self.sep = sep
+        self.started = False
+        self.writer = None
+
+    def write(self, df: pd.DataFrame):
+        if not _is_parquet(self.path):
+            df.to_csv(
+                self.path,
+                sep=self.sep,
+                index=False,
+                mode="a" if self.started else "w",
+                header=not self.started,
+            )
+            self.started = True
+            return
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            schema = pa.schema(
+                [
+                    (
+                        pa.field(f.name, pa.string())
+                        if f.name in self.strings or pa.types.is_null(f.type)
+                        else f
+                    )
+                    for f in table.schema
+                ]
+            )
+            self.writer = pq.ParquetWriter(self.path, schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+        self.started = True
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def find_city_in_file(
+    path_in: str,
+    path_out: str,
+    chunksize: int = STREAM_CHUNKSIZE,
+    sep: str = ",",
+    session: Session = None,
+    **kwargs,
+) -> int:
+    """
+    Find cities in a (potentially huge) CSV or Parquet file, with bounded
+    memory: the file is read by chunks (or row groups batches for Parquet
+    files), each chunk being resolved with find_city and written to the
+    output file as soon as it is done.
+
+    Web session, caches and referentials are shared between chunks.
+
+    Parameters
+    ----------
+    path_in : str
+        Path to the input file. Files with a ".parquet" or ".pq" extension are
+        read as Parquet files, any other file as CSV.
+    path_out : str
+        Path to the output file (the format is determined by its extension,
+        as for `path_in`). Any existing file will be overwritten.
+    chunksize : int, optional
+        Number of rows processed in each chunk. The default is 100 000.
+    sep : str, optional
+        Separator of CSV files (both input and output). The default is ",".
+    session : Session, optional
+        Requests Session to use for web queries to APIs. The default is None
+        (and will use a CachedSession with 30 days expiration)
+    **kwargs :
+        Any other argument is passed to find_city (see its documentation).
+
+    Returns
+    -------
+    int
+        Number of rows processed
+
+    """
+    if os.path.abspath(path_in) == os.path.abspath(path_out):
+        raise ValueError("path_in and path_out should be different files")
+
+    if not session:
+        session = city_finder.get_default_session()
+
+    # Lexical fields should always be read as strings
+    params = inspect.signature(find_city).parameters
+    fields = {
+        kwargs.get(k, params[k].default)
+        for k in ("dep", "city", "address", "postcode")
+    }
+    fields = {x for x in fields if x}
+    field_output = kwargs.get("field_output", params["field_output"].default)
+
+    writer = _ChunksWriter(path_out, fields | {field_output}, sep)
+    count = 0
+    try:
+        chunks = _read_chunks(
+            path_in, chunksize, dtype={x: str for x in fields}, sep=sep
+        )
+        for k, chunk in enumerate(chunks):
+            chunk = find_city(chunk, session=session, **kwargs)
+            writer.write(chunk)
+            count += len(chunk)
+            logger.info("chunk %s done - %s rows processed", k, count)
+    finally:
+        writer.close()
+
+    return count
+
+
+_DONE = object()
+
+
+def _batches(
+    records: Iterable, batch_size: int, max_latency: float = None
+) -> Iterator[list]:
+    """
+    Group records into lists of at most `batch_size` records. If
+    `max_latency` is set, the source is consumed in a background thread and a
+    batch is also yielded as soon as its first record has been waiting for
+    `max_latency` seconds.
+    """
+    if not max_latency:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+
+    items = queue.Queue(maxsize=batch_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def feed():
+        try:
+            for record in records:
+                if not put((record, time.monotonic(), None)):
+                    return
+        except Exception as exc:
+            put((_DONE, None, exc))
+        else:
+            put((_DONE, None, None))
+
+    threading.Thread(target=feed, daemon=True).start()
+
+    batch = []
+    deadline = None
+    try:
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            try:
+                record, received, exc = items.get(timeout=timeout)
+            except queue.Empty:
+                yield batch
+                batch = []
+                deadline = None
+                continue
+            if record is _DONE:
+                if batch:
+                    yield batch
+                if exc:
+                    raise exc
+                return
+            batch.append(record)
+            if deadline is None:
+                deadline = received + max_latency
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+                deadline = None
+    finally:
+        stop.set()
+
+
+def _complete_records(batch: list, s: pd.Series) -> Iterator[dict]:
+    "Add the results to the original records (None for missing values)"
+    values = s.astype(object).where(s.notnull(), None)
+    for record, value in zip(batch, values):
+        yield {**record, s.name: value}
+
+
+def find_city_iter(
+    records: Iterable[dict],
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_latency: float = None,
+    session: Session = None,
+    **kwargs,
+) -> Iterator[dict]:
+    """
+    Find cities in an iterable of records (dicts), yielding each record
+    completed with the city's code.
+
+    Records are resolved by batches with find_city, the web session, caches
+    and referentials being shared between batches. The results of each batch
+    are yielded as soon as the batch is done, in the same order as the input
+    records.
+
+    Parameters
+    ----------
+    records : Iterable[dict]
+        Records (for instance {"dep": "59", "city": "Lille"}) to resolve.
+    batch_size : int, optional
+        Maximum number of records resolved at once. The default is 1000.
+    max_latency : float, optional
+        If set, maximum delay (in seconds) a record may wait for its batch to
+        be complete: the batch is then resolved even if it is smaller than
+        batch_size. The default is None (the batches are only bounded by
+        batch_size).
+    session : Session, optional
+        Requests Session to use for web queries to APIs. The default is None
+        (and will use a CachedSession with 30 days expiration)
+    **kwargs :
+        Any other argument is passed to find_city (see its documentation).
+
+    Yields
+    ------
+    dict
+        Copy of the record, with the city's code stored under `field_output`
+        key
+
+    Example
+    -------
+    >>> records = [{"dep": "59", "city": "Lille"}]
+    >>> for record in find_city_iter(records):
+    ...     print(record)
+    {'dep': '59', 'city': 'Lille', 'insee_com': '59350'}
+
+    """
+    if not session:
+        session = city_finder.get_default_session()
+    params = inspect.signature(find_city).parameters
+    field_output = kwargs.get("field_output", params["field_output"].default)
+    for batch in _batches(records, batch_size, max_latency):
+        df = find_city(pd.DataFrame(batch), session=session, **kwargs)
+        yield from _complete_records(batch, df[field_output])
+
+
+def find_departements_iter(
+    records: Iterable[dict],
+    source: str,
+    alias: str,
+    type_field: str,
+    batch_size: int = STREAM_BATCH_SIZE,
+    max_latency: float = None,
+    session: Session = None,
+    **kwargs,
+) -> Iterator[dict]:
+    """
+    Find departements in an iterable of records (dicts), yielding each record
+    completed with the departement's code. Records are resolved by batches
+    with find_departements (see find_city_iter for the batching rules).
+
+    Parameters
+    ----------
+    records : Iterable[dict]
+        Records to resolve.
+    source : str
+        Key of the field containing the source values (see
+        find_departements).
+    alias : str
+        Key used to store the departements' codes.
+    type_field : str
+        Type of the source values (see find_departements).
+    batch_size : int, optional
+        Maximum number of records resolved at once. The default is 1000.
+    max_latency : float, optional
+        If set, maximum delay (in seconds) a record may wait for its batch to
+        be complete. The default is None.
+    session : Session, optional
+        Web session. The default is None (and will use a CachedSession with
+        30 days expiration)
+    **kwargs :
+        Any other argument is passed to find_departements (except
+        authorize_duplicates, as each record should get a single result).
+
+    Raises
+    ------
+    ValueError
+        If authorize_duplicates is set to True.
+
+    Yields
+    ------
+    dict
+        Copy of the record, with the departement's code stored under `alias`
+        key
+
+    """
+    if kwargs.get("authorize_duplicates"):
+        raise ValueError("authorize_duplicates is not supported on records")
+    if not session:
+        session = departement_finder.get_default_session()
+    for batch in _batches(records, batch_size, max_latency):
+        df = find_departements(
+            pd.DataFrame(batch),
+            source,
+            alias,
+            type_field,
+            session=session,
+            **kwargs,
+        )
+        yield from _complete_records(batch, df[alias])
@@ -8,17 +8,16 @@ This allows to recognized ultramarine territories.
 
 import datetime
 import logging
-import os
 
-import diskcache
 import pandas as pd
-from pebble import ThreadPool
 
-from pynsee.localdata import get_area_list, get_descending_area
+from pynsee.localdata import get_descending_area
 from tqdm import tqdm
 
-from french_cities import DIR_CACHE
-from french_cities.constants import THREADS
+from french_cities.caches import cache_expire, open_cache
+from french_cities.executor import get_executor
+from french_cities.metrics import record_cache
+from french_cities.reference_store import area_list, get_level
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +31,8 @@ def set_default_date():
 def _get_ultramarines_cities(
     date: str = None,
     update: bool = None,
-    threads: int = THREADS,
+    threads: int = None,
+    use_store: bool = True,
 ) -> pd.DataFrame:
     """
     Retrieve ultramarine cities.
@@ -50,7 +50,11 @@ def _get_ultramarines_cities(
         Locally saved data is used by default. Trigger an update with
         update=True.
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
+    use_store : bool, optional
+        If True, use the reference store's snapshot covering date (if any).
+        The default is True.
 
     Returns
     -------
@@ -59,25 +63,26 @@ def _get_ultramarines_cities(
 
     """
 
+    if use_store and not update:
+        cities = get_level("ultramarines", date)
+        if cities is not None:
+            return cities
+
     area = "collectivitesDOutreMer"
-    um = get_area_list(
-        area,
-        date,
-        update,
-        silent=True,
-    )
+    um = area_list(area, date, update)
     if date == "*":
         date = set_default_date()
     if not date:
         date = set_default_date()
 
-    cache_ultramarine = diskcache.Cache(os.path.join(DIR_CACHE, "ultramarine"))
+    cache_ultramarine = open_cache("ultramarine")
     try:
         if not update:
             cities = cache_ultramarine[date]
+            record_cache("ultramarine", hits=1)
             return cities
     except KeyError:
-        pass
+        record_cache("ultramarine", misses=1)
 
     def get_descending(code):
         types = ["Commune", "CirconscriptionTerritoriale", "District"]
@@ -99,11 +104,11 @@ def _get_ultramarines_cities(
         return this_territory
 
     desc = "Get descending area for ultra-marine territories"
-    with ThreadPool(threads) as pool:
-        # note: there's a rate limiter built-in pynsee, so this is safe
-        future = pool.map(get_descending, um["CODE"])
-        results = future.result()
-        cities = list(tqdm(results, total=len(um), desc=desc, leave=False))
+    # note: there's a rate limiter built-in pynsee, so this is safe
+    results = get_executor().map(
+        "insee", get_descending, um["CODE"], max_workers=threads
+    )
+    cities = list(tqdm(results, total=len(um), desc=desc, leave=False))
 
     cities = pd.concat(cities)
     cities = cities.rename(
@@ -119,13 +124,13 @@ def _get_ultramarines_cities(
         axis=1,
     )
 
-    cache_ultramarine[date] = cities
+    cache_ultramarine.set(date, cities, expire=cache_expire("ultramarine"))
 
     return cities
 
 
 def get_cities_and_ultramarines(
-    date: str = None, update: bool = None, threads: int = THREADS
+    date: str = None, update: bool = None, threads: int = None
 ) -> pd.DataFrame:
     """
     Retrieve a unified DataFrame of cities (from departements and ultramarine
@@ -140,7 +145,8 @@ def get_cities_and_ultramarines(
         Locally saved data is used by default. Trigger an update with
         update=True.
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
@@ -150,7 +156,7 @@ def get_cities_and_ultramarines(
     """
 
     ultramarine = _get_ultramarines_cities(date, update, threads=threads)
-    cities = get_area_list("communes", date, update, silent=True)
+    cities = area_list("communes", date, update)
     full = pd.concat([ultramarine, cities], ignore_index=True)
     return full
 
@@ -174,16 +180,14 @@ def get_departements_and_ultramarines(date=None, update=None):
     full : pd.DataFrame
 
     """
-    ultramarine = get_area_list(
-        "collectivitesDOutreMer", date, update, silent=True
-    )
+    ultramarine = area_list("collectivitesDOutreMer", date, update)
     ultramarine = (
         ultramarine.sort_values(["TITLE", "DATE_CREATION"], ascending=False)
         .drop_duplicates("TITLE", keep="first")
         .reset_index()
     )
 
-    deps = get_area_list("departements", date, update, silent=True)
+    deps = area_list("departements", date, update)
     deps = deps.drop("chefLieu", axis=1)
     full = pd.concat([ultramarine, deps], ignore_index=True)
     full = (
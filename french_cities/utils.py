@@ -1,16 +1,76 @@
 # -*- coding: utf-8 -*-
 
-from functools import lru_cache
+from contextlib import contextmanager
+import contextvars
+from functools import lru_cache, wraps
 import logging
 import os
+import shutil
 
-import diskcache
+from requests.exceptions import RequestException
 
 import pynsee.utils
 from pynsee.utils import init_conn
 from pynsee.utils._clean_insee_folder import _clean_insee_folder
 
-from french_cities import DIR_CACHE
+from french_cities import DIR_CACHE, _load_dotenv
+from french_cities.constants import CACHE_POLICIES, HTTP_CACHES
+
+logger = logging.getLogger(__name__)
+
+
+# Messages of pynsee's loggers silenced while a silence_logs block is active
+# (in the current thread or task only)
+_silenced = contextvars.ContextVar("silenced_logs", default=frozenset())
+
+PYNSEE_LOGS = (
+    "pynsee.utils._get_credentials",
+    "pynsee.utils.requests_session",
+    "pynsee.utils.init_connection",
+    "pynsee.localdata.get_descending_area",
+    "pynsee.localdata.get_area_projection",
+)
+
+SIRENE_MESSAGES = (
+    # no credentials:
+    "INSEE API credentials have not been found",
+    "Invalid credentials, the following APIs returned error codes",
+    "Remember to subscribe to SIRENE API",
+    # no results, but switch to a more accurate log entry in french-cities
+    # context:
+    "No data found !",
+)
+
+
+class _ContextFilter(logging.Filter):
+    "Drop the records starting with a message silenced in the current context"
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        silenced = _silenced.get()
+        return not (silenced and str(record.msg).startswith(tuple(silenced)))
+
+
+_context_filter = _ContextFilter()
+for log in PYNSEE_LOGS:
+    logging.getLogger(log).addFilter(_context_filter)
+
+
+@contextmanager
+def silence_logs(*messages: str):
+    """
+    Context manager silencing pynsee's log entries starting with any of the
+    messages.
+
+    The loggers' configuration is left untouched: the silenced messages are
+    stored in a context variable, so that concurrent calls (from other
+    threads) are not affected, while tasks run by the shared executor on
+    behalf of the caller are.
+    """
+    token = _silenced.set(_silenced.get() | frozenset(messages))
+    try:
+        yield
+    finally:
+        _silenced.reset(token)
 
 
 def silence_sirene_logs(func):
@@ -20,47 +80,11 @@ def silence_sirene_logs(func):
     context
     """
 
-    def filter_no_credential_or_no_results(record):
-        return (
-            # no credentials:
-            not record.msg.startswith(
-                "INSEE API credentials have not been found"
-            )
-            and not record.msg.startswith(
-                "Invalid credentials, the following APIs returned error codes"
-            )
-            and not record.msg.startswith(
-                "Remember to subscribe to SIRENE API"
-            )
-            # no results, but switch to a more accurate log entry in
-            # french-cities context:
-            and record.msg != "No data found !"
-            and not not record.msg.startswith(
-                "No data found for projection of area"
-            )
-        )
-
+    @wraps(func)
     def wrapper(*args, **kwargs):
         # Note: deactivate pynsee log to substitute by a more accurate
-        pynsee_logs = (
-            "pynsee.utils._get_credentials",
-            "pynsee.utils.requests_session",
-            "pynsee.utils.init_connection",
-            "pynsee.localdata.get_descending_area",
-        )
-        for log in pynsee_logs:
-            pynsee_log = logging.getLogger(log)
-            pynsee_log.propagate = False
-            pynsee_log.addFilter(filter_no_credential_or_no_results)
-        try:
+        with silence_logs(*SIRENE_MESSAGES):
             return func(*args, **kwargs)
-        except Exception:
-            raise
-        finally:
-            for log in pynsee_logs:
-                pynsee_log = logging.getLogger(log)
-                pynsee_log.propagate = True
-                pynsee_log.removeFilter(filter_no_credential_or_no_results)
 
     return wrapper
 
@@ -69,17 +93,27 @@ def clear_all_cache():
     "Clear french-cities cache first, then pynsee's"
 
     # Clear diskcache's caches
-    for cache_name in (
-        "projection",
-        "deps",
-        "nominatim",
-        "ultramarine",
-    ):
-        with diskcache.Cache(os.path.join(DIR_CACHE, cache_name)) as cache:
+    from french_cities.caches import open_cache
+
+    for cache_name in CACHE_POLICIES:
+        with open_cache(cache_name) as cache:
             cache.clear()
 
-    # Clear request-cache's cache
+    # Clear request-cache's cache (sqlite databases are files, filesystem
+    # caches are directories)
+    from french_cities.sessions import clear_sessions
+
+    clear_sessions()
     [os.unlink(f.path) for f in os.scandir(DIR_CACHE) if not f.is_dir()]
+    for cache_name in HTTP_CACHES:
+        shutil.rmtree(os.path.join(DIR_CACHE, cache_name), ignore_errors=True)
+
+    # Clear referentials stored in memory
+    from french_cities.lookup import clear_indexes
+    from french_cities.referential import clear_referentials
+
+    clear_referentials()
+    clear_indexes()
 
     # Clear pynsee's cache
     pynsee.utils.clear_all_cache()
@@ -90,10 +124,21 @@ def clear_all_cache():
 @lru_cache(maxsize=None)
 def init_pynsee():
     """
-    Initiate an INSEE API connection with proxies.
+    Initiate an INSEE API connection with proxies. Without access to INSEE's
+    API (on offline workers for instance), the locally saved data (see
+    french_cities.cache_bundle) will be used.
     """
+    # Note: proxies may be set in a .env file
+    _load_dotenv()
     keys = ["http_proxy", "https_proxy"]
     kwargs = {x: os.environ[x] for x in keys if x in os.environ}
     kwargs["sirene_key"] = None
 
-    init_conn(**kwargs)
+    try:
+        init_conn(**kwargs)
+    except RequestException as exc:
+        logger.warning(
+            "INSEE's API is unreachable, only locally saved data will be "
+            "available: %s",
+            exc,
+        )
@@ -6,29 +6,33 @@ Module used to project a dataset into a known vintage, wether the original
 vintage is known or not.
 """
 from datetime import date, datetime
-import os
 from functools import partial
 import logging
 
-import diskcache
 import pandas as pd
-from pebble import ThreadPool
 
-from pynsee.localdata import get_area_list
 from pynsee.localdata import get_ascending_area
 from pynsee.localdata import get_area_projection
 from tqdm import tqdm
 
-from french_cities import DIR_CACHE
-from french_cities.constants import THREADS
-from french_cities.utils import init_pynsee, silence_sirene_logs
+from french_cities.caches import cache_expire, open_cache
+from french_cities.checkpoint import Checkpoint
+from french_cities.constants import REFERENCE_SUBAREAS
+from french_cities.executor import get_executor, single_flight
+from french_cities.metrics import record_cache
+from french_cities.reference_store import area_list
+from french_cities.utils import (
+    init_pynsee,
+    silence_logs,
+    silence_sirene_logs,
+)
 from french_cities.ultramarine_pseudo_cog import get_cities_and_ultramarines
 
 
 logger = logging.getLogger(__name__)
 
 
-cache_projection = diskcache.Cache(os.path.join(DIR_CACHE, "projection"))
+cache_projection = open_cache("projection")
 
 FIXED_ULTRAMARINE_CODES = {
     # Saint-Pierre-et-Miquelon
@@ -130,7 +134,9 @@ FIXED_ULTRAMARINE_CODES = {
 }
 
 
-@cache_projection.memoize(tag="city_projection")
+@cache_projection.memoize(
+    expire=cache_expire("projection"), tag="city_projection"
+)
 def get_city(
     x: str,
     starting_dates: list,
@@ -201,7 +207,7 @@ def get_city(
 
 
 def _get_cities_year_full(
-    year: int, look_for: set = None, threads: int = THREADS
+    year: int, look_for: set = None, threads: int = None
 ) -> pd.DataFrame:
     """
     Download desired vintage of french official geographic code for cities
@@ -218,7 +224,8 @@ def _get_cities_year_full(
         List of codes we are trying to project in the desired vintage.
         The default is None (will try to reach every available code).
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
@@ -262,7 +269,7 @@ def _get_cities_year_full(
     return cities
 
 
-def _get_cities_year(year: int, threads: int = THREADS) -> pd.DataFrame:
+def _get_cities_year(year: int, threads: int = None) -> pd.DataFrame:
     """
     Download desired vintage of french official geographic code for cities
     from INSEE API; municipal districts are excluded by this API.
@@ -272,7 +279,8 @@ def _get_cities_year(year: int, threads: int = THREADS) -> pd.DataFrame:
     year : int
         Desired vintage
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
@@ -306,7 +314,7 @@ def _get_cities_year(year: int, threads: int = THREADS) -> pd.DataFrame:
 
 
 def _get_parents_from_serie(
-    type_: str, codes: list, year: int, threads: int = THREADS
+    type_: str, codes: list, year: int, threads: int = None
 ) -> pd.DataFrame:
     """
     Get territories' parents codes using INSEE API. The output will be a
@@ -325,7 +333,8 @@ def _get_parents_from_serie(
     year : int
         Desired vintage
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
@@ -351,11 +360,9 @@ def _get_parents_from_serie(
         return {"CODE": x, "PARENT": ret.loc[0, "code"]}
 
     desc = "Get parent from insee"
-    with ThreadPool(threads) as pool:
-        # note: there's a rate limiter built-in pynsee, so this is safe
-        future = pool.map(func, codes)
-        results = future.result()
-        parents = list(tqdm(results, total=len(codes), desc=desc, leave=False))
+    # note: there's a rate limiter built-in pynsee, so this is safe
+    results = get_executor().map("insee", func, codes, max_workers=threads)
+    parents = list(tqdm(results, total=len(codes), desc=desc, leave=False))
 
     parents = pd.DataFrame(parents)
     return parents
@@ -365,7 +372,7 @@ def _get_subareas_year(
     type_: str,
     year: int,
     look_for: set = None,
-    threads: int = THREADS,
+    threads: int = None,
 ) -> pd.DataFrame:
     """
     Download desired vintage of french official geographic code for "subcities"
@@ -383,7 +390,8 @@ def _get_subareas_year(
         List of codes we are trying to project in the desired vintage.
         The default is None (will try to reach every available code).
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
 
     Returns
     -------
@@ -397,7 +405,8 @@ def _get_subareas_year(
     4  13205  13055
 
     """
-    subareas = get_area_list(area=type_, date=f"{year}-01-01", silent=True)
+    # Note: snapshots of the reference store include the parents
+    subareas = area_list(type_, f"{year}-01-01")
     try:
         subareas = subareas.drop("DATE_DELETION", axis=1)
     except KeyError:
@@ -417,16 +426,14 @@ def _get_subareas_year(
     if subareas.empty:
         return pd.DataFrame()
 
-    single_area = {
-        "arrondissementsMunicipaux": "arrondissementMunicipal",
-        "communesAssociees": "communeAssociee",
-        "communesDeleguees": "communeDeleguee",
-    }
-    type_ = single_area[type_]
-    parents = _get_parents_from_serie(
-        type_, subareas.CODE.unique(), year, threads=threads
-    )
-    subareas = subareas.merge(parents, on="CODE", how="left")
+    if "PARENT" not in subareas.columns:
+        parents = _get_parents_from_serie(
+            REFERENCE_SUBAREAS[type_],
+            subareas.CODE.unique(),
+            year,
+            threads=threads,
+        )
+        subareas = subareas.merge(parents, on="CODE", how="left")
 
     return subareas
 
@@ -492,9 +499,113 @@ def ultra_marine_territories_vintage(code: str, projection_date: str) -> str:
         raise KeyError("Not a city from ultramarine collectivities") from exc
 
 
+def _project_codes(
+    uniques: pd.DataFrame,
+    field: str,
+    year: int,
+    index: pd.Index,
+    threads: int = None,
+) -> pd.Series:
+    """
+    Project the unique cities codes of a dataframe (only those at `index`)
+    into a desired vintage.
+
+    Parameters
+    ----------
+    uniques : pd.DataFrame
+        DataFrame of unique cities codes
+    field : str
+        Field (column) of uniques containing the city code
+    year : int
+        Year to project the cities codes into
+    index : pd.Index
+        Index of the codes to project
+    threads : int, optional
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
+
+    Returns
+    -------
+    pd.Series
+        Projected codes (indexed by `index`)
+
+    """
+    codes = uniques.loc[index, field]
+    uniques = uniques.loc[index]
+    cities = _get_cities_year_full(year, set(uniques[field]), threads=threads)
+
+    # Uptodate cities (cities, municipal districts, delegated cities, ...)
+    uniques = uniques.merge(cities, left_on=field, right_on="CODE", how="left")
+    uniques = uniques.rename({"NEW_CODE": "PROJECTED"}, axis=1)
+
+    # Obsolete cities : look for existing projections from old starting dates,
+    # using INSEE API
+    starting_dates = [
+        "1943-01-01",
+        "1960-01-01",
+        "1980-01-01",
+        "2000-01-01",
+        "2010-01-01",
+    ]
+
+    partial_get_city = partial(
+        get_city,
+        starting_dates=starting_dates,
+        projection_date=f"{year}-01-01",
+        log_entries=False,
+    )
+
+    def project(x):
+        # Concurrent callers projecting the same code share one INSEE query
+        key = ("projection", x, tuple(starting_dates), f"{year}-01-01")
+        return single_flight(key, partial_get_city, x)
+
+    ix = uniques[uniques.PROJECTED.isnull()].index
+    tqdm.pandas(desc="Looking for projections from past", leave=False)
+    if len(ix):
+        hits = sum(
+            get_city.__cache_key__(
+                x,
+                starting_dates=starting_dates,
+                projection_date=f"{year}-01-01",
+                log_entries=False,
+            )
+            in cache_projection
+            for x in uniques.loc[ix, field]
+        )
+        record_cache("projection", hits=hits, misses=len(ix) - hits)
+
+    desc = "Looking for projections from past"
+    # Note: deactivate pynsee log to substitute by a more accurate
+    with silence_logs("No data found for projection of area"):
+        # note: there's a rate limiter built-in pynsee, so this is safe
+        results = get_executor().map(
+            "insee",
+            project,
+            uniques.loc[ix, field].tolist(),
+            max_workers=threads,
+        )
+        projected = list(tqdm(results, total=len(ix), desc=desc, leave=False))
+    uniques.loc[ix, "PROJECTED"] = projected
+
+    ix = uniques[uniques.PROJECTED.isnull()].index
+
+    def log_after_tqdm(x):
+        logger.error("No projection found for city %s", x)
+
+    uniques.loc[ix, field].apply(log_after_tqdm)
+
+    projected = dict(uniques[[field, "PROJECTED"]].values)
+    return codes.map(projected)
+
+
 @silence_sirene_logs
 def set_vintage(
-    df: pd.DataFrame, year: int, field: str, threads: int = THREADS
+    df: pd.DataFrame,
+    year: int,
+    field: str,
+    threads: int = None,
+    checkpoint_dir: str = None,
 ) -> pd.DataFrame:
     """
     Project (approximatively) the cities codes of a dataframe into a desired
@@ -517,7 +628,12 @@ def set_vintage(
     field : str
         Field (column) of dataframe containing the city code
     threads : int, optional
-        Number of threads to use. Default is 10.
+        Maximum number of concurrent requests. Default is None (adaptive
+        budgets, see configure_concurrency).
+    checkpoint_dir : str, optional
+        If set, the projected codes are stored into this directory: a
+        restarted run with the same inputs will skip the codes already
+        projected. The default is None.
 
     Returns
     -------
@@ -554,64 +670,23 @@ def set_vintage(
         df = df.rename({field: f"temp_{field}"}, axis=1)
         field = f"temp_{field}"
 
-    uniques = df[[field]].drop_duplicates(keep="first").dropna()
+    uniques = (
+        df[[field]]
+        .drop_duplicates(keep="first")
+        .dropna()
+        .reset_index(drop=True)
+    )
 
     if uniques.empty:
         return df
 
-    cities = _get_cities_year_full(year, set(uniques[field]), threads=threads)
-
-    # Uptodate cities (cities, municipal districts, delegated cities, ...)
-    uniques = uniques.merge(cities, left_on=field, right_on="CODE", how="left")
-    uniques = uniques.rename({"NEW_CODE": "PROJECTED"}, axis=1)
-
-    # Obsolete cities : look for existing projections from old starting dates,
-    # using INSEE API
-    starting_dates = [
-        "1943-01-01",
-        "1960-01-01",
-        "1980-01-01",
-        "2000-01-01",
-        "2010-01-01",
-    ]
-
-    partial_get_city = partial(
-        get_city,
-        starting_dates=starting_dates,
-        projection_date=f"{year}-01-01",
-        log_entries=False,
+    checkpoint = Checkpoint(checkpoint_dir, "set_vintage", year=year)
+    projected = checkpoint.run(
+        "projection",
+        uniques,
+        partial(_project_codes, uniques, field, year, threads=threads),
     )
-
-    def filter_no_data(record):
-        return not record.msg.startswith(
-            "No data found for projection of area"
-        )
-
-    # Note: deactivate pynsee log to substitute by a more accurate
-    pynsee_log = logging.getLogger("pynsee.localdata.get_area_projection")
-    pynsee_log.addFilter(filter_no_data)
-
-    ix = uniques[uniques.PROJECTED.isnull()].index
-    tqdm.pandas(desc="Looking for projections from past", leave=False)
-
-    desc = "Looking for projections from past"
-    with ThreadPool(threads) as pool:
-        # note: there's a rate limiter built-in pynsee, so this is safe
-        future = pool.map(partial_get_city, uniques.loc[ix, field].tolist())
-        results = future.result()
-        projected = list(tqdm(results, total=len(ix), desc=desc, leave=False))
-        uniques.loc[ix, "PROJECTED"] = projected
-
-    pynsee_log.removeFilter(filter_no_data)
-
-    ix = uniques[uniques.PROJECTED.isnull()].index
-
-    def log_after_tqdm(x):
-        logger.error("No projection found for city %s", x)
-
-    uniques.loc[ix, field].apply(log_after_tqdm)
-
-    uniques = dict(uniques[[field, "PROJECTED"]].values)
+    uniques = dict(zip(uniques[field], projected))
 
     df.loc[:, field] = df.loc[:, field].map(uniques)
 
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from unittest import TestCase
+
+from french_cities.async_tools import TokenBucket, run_coroutine
+
+
+async def acquire_all(bucket, n):
+    "Acquire n tokens, returning the time each one was obtained at"
+    times = []
+    for _ in range(n):
+        await bucket.acquire()
+        times.append(time.monotonic())
+    return times
+
+
+class test_token_bucket(TestCase):
+
+    def test_rate(self):
+        bucket = TokenBucket(20, capacity=5)
+        start = time.monotonic()
+        times = asyncio.run(acquire_all(bucket, 15))
+        # the first five tokens are a burst, the ten others come at 20/s
+        self.assertLess(times[4] - start, 0.05)
+        self.assertGreaterEqual(times[-1] - start, 0.45)
+        self.assertLess(times[-1] - start, 1)
+
+    def test_burst_bounded(self):
+        bucket = TokenBucket(10, capacity=3)
+        # tokens are not accumulated beyond the capacity while idle
+        bucket.updated -= 10
+        start = time.monotonic()
+        times = asyncio.run(acquire_all(bucket, 4))
+        self.assertLess(times[2] - start, 0.05)
+        self.assertGreaterEqual(times[3] - start, 0.09)
+
+    def test_concurrent_consumers(self):
+        async def main():
+            bucket = TokenBucket(50, capacity=1)
+            results = await asyncio.gather(
+                *(acquire_all(bucket, 5) for _ in range(4))
+            )
+            return sorted(x for times in results for x in times)
+
+        start = time.monotonic()
+        times = run_coroutine(main())
+        self.assertGreaterEqual(times[-1] - start, 19 / 50 - 0.01)
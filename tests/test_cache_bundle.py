@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+import zipfile
+
+import diskcache
+
+from french_cities import cache_bundle, caches
+from french_cities.cache_bundle import export_cache, import_cache
+from french_cities.caches import open_cache
+
+
+class test_cache_bundle(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = {
+            "french-cities": os.path.join(self.tmp.name, "source", "fc"),
+            "pynsee": os.path.join(self.tmp.name, "source", "pynsee"),
+        }
+        self.target = {
+            "french-cities": os.path.join(self.tmp.name, "target", "fc"),
+            "pynsee": os.path.join(self.tmp.name, "target", "pynsee"),
+        }
+        for path in self.source.values():
+            os.makedirs(path)
+        with diskcache.Cache(
+            os.path.join(self.source["french-cities"], "deps")
+        ) as cache:
+            cache["75007"] = "75"
+        with open(os.path.join(self.source["pynsee"], "data"), "wb") as f:
+            f.write(b"pynsee")
+        self.archive = os.path.join(self.tmp.name, "bundle.zip")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def export(self):
+        with patch.object(cache_bundle, "_roots", return_value=self.source):
+            return export_cache(self.archive)
+
+    def import_(self):
+        with patch.object(cache_bundle, "_roots", return_value=self.target):
+            return import_cache(self.archive)
+
+    def test_roundtrip(self):
+        manifest = self.export()
+        self.assertIn("pynsee/data", manifest["files"])
+        self.assertEqual(self.import_()["files"], manifest["files"])
+        with diskcache.Cache(
+            os.path.join(self.target["french-cities"], "deps")
+        ) as cache:
+            self.assertEqual(cache["75007"], "75")
+        with open(os.path.join(self.target["pynsee"], "data"), "rb") as f:
+            self.assertEqual(f.read(), b"pynsee")
+
+    def test_wrong_format(self):
+        manifest = self.export()
+        manifest["format"] = 0
+        with zipfile.ZipFile(self.archive, "w") as archive:
+            archive.writestr("manifest.json", json.dumps(manifest))
+        with self.assertRaises(ValueError):
+            self.import_()
+
+    def test_corrupted(self):
+        manifest = self.export()
+        with zipfile.ZipFile(self.archive, "w") as archive:
+            archive.writestr("manifest.json", json.dumps(manifest))
+            archive.writestr("pynsee/data", b"corrupted")
+            for arcname in manifest["files"]:
+                if arcname != "pynsee/data":
+                    archive.writestr(arcname, b"")
+        with self.assertRaises(ValueError):
+            self.import_()
+
+    def test_path_traversal(self):
+        with zipfile.ZipFile(self.archive, "w") as archive:
+            manifest = {"format": 1, "files": {"pynsee/../../evil": ""}}
+            archive.writestr("manifest.json", json.dumps(manifest))
+        with self.assertRaises(ValueError):
+            self.import_()
+
+    def test_machine_files(self):
+        path = os.path.join(self.source["french-cities"], "user-agent")
+        with open(path, "w", encoding="utf8") as f:
+            f.write("french-cities-source")
+        manifest = self.export()
+        self.assertNotIn("french-cities/user-agent", manifest["files"])
+
+    def test_open_caches_reconnect(self):
+        with patch.object(caches, "DIR_CACHE", self.target["french-cities"]):
+            cache = open_cache("deps")
+            cache["13001"] = "13"
+            self.export()
+            self.import_()
+            self.assertEqual(cache.get("75007"), "75")
+            self.assertIsNone(cache.get("13001"))
+            cache.close()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import diskcache
+import pandas as pd
+
+from french_cities import caches
+from french_cities.caches import (
+    cache_expire,
+    cache_stats,
+    invalidate_cache,
+    open_cache,
+)
+from french_cities.metrics import record_cache
+
+
+class test_caches(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patcher = patch.object(caches, "DIR_CACHE", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_policies_overrides(self):
+        env = {
+            "FRENCH_CITIES_CACHE_TTL": "ban=7,oops",
+            "FRENCH_CITIES_CACHE_SIZE": "ban=2",
+        }
+        with patch.dict(os.environ, env):
+            self.assertEqual(cache_expire("ban"), 7 * 24 * 3600)
+            with open_cache("ban") as cache:
+                self.assertEqual(cache.size_limit, 2 * 1024**2)
+        self.assertEqual(cache_expire("ban"), 30 * 24 * 3600)
+
+    def test_stats(self):
+        with open_cache("deps") as cache:
+            cache["75007"] = "75"
+        record_cache("deps", hits=3, misses=1)
+        stats = cache_stats()
+        self.assertEqual(stats.loc["deps", "entries"], 1)
+        self.assertGreater(stats.loc["deps", "size"], 0)
+        self.assertGreaterEqual(stats.loc["deps", "hits"], 3)
+        self.assertIn("requests-cache", stats.index)
+        self.assertIn("reference", stats.index)
+
+    def test_invalidate_projection_year(self):
+        with open_cache("projection") as cache:
+            for year in (2023, 2024):
+                key = (
+                    "french_cities.vintage.get_city",
+                    "01001",
+                    None,
+                    "projection_date",
+                    f"{year}-01-01",
+                )
+                cache[key] = "01001"
+        self.assertEqual(invalidate_cache("projection", year=2024), 1)
+        with open_cache("projection") as cache:
+            self.assertEqual(len(cache), 1)
+            self.assertIn("2023-01-01", next(cache.iterkeys()))
+
+    def test_invalidate_errors(self):
+        with self.assertRaises(ValueError):
+            invalidate_cache("pynsee")
+        with self.assertRaises(ValueError):
+            invalidate_cache("ban", year=2024)
+
+    def test_columnar_storage(self):
+        df = pd.DataFrame({"CODE": ["97501", "97502"], "TITLE": ["a", None]})
+        mixed = pd.DataFrame({"CODE": [1, "a"]})
+        with open_cache("ultramarine") as cache:
+            cache["small"] = df
+            cache["large"] = pd.concat([df] * 10_000, ignore_index=True)
+            cache["mixed"] = mixed
+            cache["tuple"] = (48.8, "city", None)
+            cache["none"] = None
+            pd.testing.assert_frame_equal(cache["small"], df)
+            self.assertEqual(len(cache["large"]), 20_000)
+            pd.testing.assert_frame_equal(cache["mixed"], mixed)
+            self.assertEqual(cache["tuple"], (48.8, "city", None))
+            self.assertIsNone(cache["none"])
+
+        # Tabular values are stored as Arrow files, not as pickles
+        with diskcache.Cache(os.path.join(self.tmp.name, "ultramarine")) as c:
+            self.assertTrue(c["small"].startswith(b"ARROW1"))
+
+        # Files read are released: they can be deleted right away
+        with open_cache("ultramarine") as cache:
+            cache["numbers"] = pd.DataFrame({"x": range(100_000)})
+            numbers = cache["numbers"]
+        if os.path.exists("/proc/self/maps"):
+            with open("/proc/self/maps", encoding="utf8") as f:
+                self.assertNotIn(self.tmp.name, f.read())
+        self.assertEqual(invalidate_cache("ultramarine"), 6)
+        self.assertEqual(numbers["x"].sum(), 4_999_950_000)
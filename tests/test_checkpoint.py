@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from unittest import TestCase
+import pandas as pd
+
+from french_cities.checkpoint import Checkpoint
+
+
+class test_checkpoint(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def upper(self, rows):
+        def func(index):
+            self.calls.append(len(index))
+            return rows.loc[index, "city"].str.upper()
+
+        return func
+
+    def test_disabled_checkpoint(self):
+        rows = pd.DataFrame({"city": ["Lille", "Loos"]})
+        checkpoint = Checkpoint(None, "test")
+        checkpoint.run("upper", rows, self.upper(rows))
+        checkpoint.run("upper", rows, self.upper(rows))
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_run_resumes(self):
+        rows = pd.DataFrame({"city": ["Lille", "Loos", None]}, index=[5, 3, 1])
+        checkpoint = Checkpoint(self.directory.name, "test", year=2024)
+        first = checkpoint.run("upper", rows, self.upper(rows))
+        self.assertEqual(first.loc[5], "LILLE")
+        self.assertTrue(pd.isnull(first.loc[1]))
+
+        rows = pd.DataFrame({"city": ["Loos", "Morzine", None]})
+        checkpoint = Checkpoint(self.directory.name, "test", year=2024)
+        second = checkpoint.run("upper", rows, self.upper(rows))
+        self.assertEqual(second.tolist()[:2], ["LOOS", "MORZINE"])
+        self.assertTrue(pd.isnull(second.iloc[2]))
+        self.assertEqual(self.calls, [3, 1])
+
+    def test_params_separate_runs(self):
+        rows = pd.DataFrame({"city": ["Lille"]})
+        for year in (2023, 2024):
+            checkpoint = Checkpoint(self.directory.name, "test", year=year)
+            checkpoint.run("upper", rows, self.upper(rows))
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+    def test_run_table(self):
+        df = pd.DataFrame({"city": ["Lille", "Loos"]})
+        checkpoint = Checkpoint(self.directory.name, "test")
+
+        def func(df):
+            self.calls.append(len(df))
+            return df.assign(upper=df["city"].str.upper())
+
+        first = checkpoint.run_table("upper", df, func)
+        second = checkpoint.run_table("upper", df, func)
+        pd.testing.assert_frame_equal(first, second)
+        checkpoint.run_table("upper", df.head(1), func)
+        self.assertEqual(self.calls, [2, 1])
+
+    def test_run_frames(self):
+        rows = pd.DataFrame({"city": ["Lille", "Loos"]})
+
+        def func(index):
+            self.calls.append(len(index))
+            return pd.DataFrame(
+                {"best": rows.loc[index, "city"].str.upper(), "score": 0.5},
+                index=index,
+            )
+
+        for _ in range(2):
+            checkpoint = Checkpoint(self.directory.name, "test")
+            results = checkpoint.run("frame", rows, func)
+            self.assertEqual(list(results.columns), ["best", "score"])
+            self.assertEqual(results["best"].tolist(), ["LILLE", "LOOS"])
+            self.assertEqual(results["score"].tolist(), [0.5, 0.5])
+        self.assertEqual(self.calls, [2])
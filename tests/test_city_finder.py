@@ -10,10 +10,24 @@ import numpy as np
 
 import logging
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+from french_cities import caches, city_finder
 from french_cities.city_finder import (
     find_city,
     _query_BAN_csv_geocoder,
+    _query_BAN_individual_geocoder,
+    _wait_nominatim_slot,
+    configure_user_agent,
+    get_machine_user_agent,
 )
+from french_cities.geocoders import Geocoder, GeocoderError
+from french_cities.metrics import collect_metrics
 
 input_df = pd.DataFrame(
     [
@@ -263,6 +277,21 @@ class test_find_city(TestCase):
     def test_live(self):
         assert (output_df2["insee_com"] == output_df2["target"]).all()
 
+    def test_provenance(self):
+        df = find_city(
+            input_df.copy(),
+            epsg=4326,
+            use_nominatim_backend=True,
+            session=MockedSession(),
+            field_provenance="provenance",
+        )
+        assert (df["insee_com"] == output_df["insee_com"]).all()
+        stages = df["provenance"].str.split("-").str[0]
+        assert set(stages) <= {"geoloc", "fuzzy", "ban", "nominatim"}
+        assert (df["provenance"] == "geoloc").any()
+        scores = df["provenance_score"].dropna()
+        assert ((scores >= 0) & (scores <= 1)).all()
+
     def test_raises_wrong_vintage_input(self):
 
         df = pd.DataFrame(
@@ -342,5 +371,178 @@ class test_find_city(TestCase):
             )
 
 
+class test_nominatim_throttle(TestCase):
+    def test_shared_across_threads(self):
+        calls = []
+
+        def call(_):
+            _wait_nominatim_slot("nominatim.example.org")
+            calls.append(time.monotonic())
+
+        with patch.object(city_finder, "NOMINATIM_PUBLIC_DELAY", 0.1):
+            with ThreadPoolExecutor(4) as pool:
+                list(pool.map(call, range(6)))
+        gaps = np.diff(sorted(calls))
+        self.assertTrue((gaps >= 0.099).all())
+
+
+class test_user_agent(TestCase):
+    def test_overrides(self):
+        with patch.dict(os.environ, {"FRENCH_CITIES_USER_AGENT": "a"}):
+            self.assertEqual(get_machine_user_agent(), "a")
+            os.environ["FRENCH_CITIES_USER_AGENT"] = "b"
+            self.assertEqual(get_machine_user_agent(), "b")
+            configure_user_agent("c")
+            try:
+                self.assertEqual(get_machine_user_agent(), "c")
+            finally:
+                configure_user_agent(None)
+            self.assertEqual(get_machine_user_agent(), "b")
+
+
+class FailingGeocoder(Geocoder):
+    name = "failing"
+    cache_results = False
+
+    def csv(self, chunk, session):
+        raise GeocoderError("unavailable")
+
+
+class test_ban_csv_failures(TestCase):
+    def test_failed_rows_reported(self):
+        addresses = pd.DataFrame(
+            {
+                "dep": ["59", "62"],
+                "city_cleaned": ["LILLE", "ARRAS"],
+                "full": ["59 LILLE", "62 ARRAS"],
+            }
+        )
+        with collect_metrics() as report:
+            results = _query_BAN_csv_geocoder(
+                addresses,
+                components=["dep", "city_cleaned"],
+                session=None,
+                dep="dep",
+                city="city_cleaned",
+                geocoder=FailingGeocoder(),
+                max_rows=1,
+            )
+        self.assertTrue(results.empty)
+        self.assertEqual(results.attrs["failed_rows"], 2)
+        self.assertEqual(report.failures, {"failing-csv": 2})
+
+
+class CountingGeocoder(Geocoder):
+    name = "counting"
+
+    def __init__(self):
+        self.received = []
+
+    def csv(self, chunk, session):
+        self.received.append(chunk["full"].tolist())
+        return pd.DataFrame(
+            {
+                "full": chunk["full"],
+                "result_score": 0.9,
+                "result_city": chunk["city_cleaned"],
+                "result_citycode": chunk["dep"] + "000",
+            }
+        )
+
+
+class test_ban_csv_cache(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        patcher = patch.object(caches, "DIR_CACHE", tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(tmp.cleanup)
+
+    def query(self, addresses, geocoder):
+        results = _query_BAN_csv_geocoder(
+            addresses,
+            components=["dep", "city_cleaned"],
+            session=None,
+            dep="dep",
+            city="city_cleaned",
+            geocoder=geocoder,
+        )
+        return results.sort_values("full", ignore_index=True)
+
+    def test_only_new_rows_queried(self):
+        addresses = pd.DataFrame(
+            {
+                "dep": ["59", "62", "80"],
+                "city_cleaned": ["LILLE", "ARRAS", "AMIENS"],
+                "full": ["59 LILLE", "62 ARRAS", "80 AMIENS"],
+            }
+        )
+        geocoder = CountingGeocoder()
+        first = self.query(addresses.iloc[:2], geocoder)
+        second = self.query(addresses, geocoder)
+        self.assertEqual(
+            geocoder.received, [["59 LILLE", "62 ARRAS"], ["80 AMIENS"]]
+        )
+        pd.testing.assert_frame_equal(
+            second[second["full"] != "80 AMIENS"], first
+        )
+
+
+class FlakyGeocoder(Geocoder):
+    """
+    Individual geocoder succeeding for Lille, after two retryable failures
+    for Arras, and failing for Amiens (retryable) and Paris (not retryable)
+    """
+
+    name = "flaky"
+    rate_limited = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+    def search(self, query, session):
+        with self.lock:
+            self.calls[query] += 1
+            calls = self.calls[query]
+        if query == "75 PARIS":
+            raise GeocoderError("bad request")
+        if query == "80 AMIENS" or (query == "62 ARRAS" and calls < 3):
+            raise GeocoderError("unavailable", retryable=True)
+        city = query.split()[1]
+        return [{"score": 0.9, "city": city, "citycode": query[:2] + "000"}]
+
+
+class test_ban_individual_failures(TestCase):
+    def test_retries(self):
+        addresses = pd.DataFrame(
+            {
+                "dep": ["59", "62", "80", "75"],
+                "city_cleaned": ["LILLE", "ARRAS", "AMIENS", "PARIS"],
+                "full": ["59 LILLE", "62 ARRAS", "80 AMIENS", "75 PARIS"],
+            }
+        )
+        geocoder = FlakyGeocoder()
+        results = _query_BAN_individual_geocoder(
+            addresses,
+            components=["dep", "city_cleaned"],
+            session=None,
+            dep="dep",
+            geocoder=geocoder,
+            retries=2,
+            backoff=0,
+        )
+        self.assertEqual(
+            geocoder.calls,
+            {"59 LILLE": 1, "62 ARRAS": 3, "80 AMIENS": 3, "75 PARIS": 1},
+        )
+        # as in find_city, rows are aligned on the addresses queried
+        results = results.set_index("full").reindex(addresses["full"])
+        self.assertEqual(
+            results["result_citycode"].tolist()[:2], ["59000", "62000"]
+        )
+        self.assertTrue(results.iloc[2:].isnull().all(axis=None))
+
+
 if __name__ == "__main__":
     test_find_city().test_BAN()
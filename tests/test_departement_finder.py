@@ -105,6 +105,18 @@ class test_find_departements(TestCase):
         )
         assert (test["dep_test"] == test["deps"]).all()
 
+    def test_session_left_untouched(self):
+        session = MockedSession()
+        session.hooks = {"response": []}
+        find_departements(
+            input_df,
+            "code_commune",
+            "dep_test",
+            "insee",
+            session=session,
+        )
+        self.assertEqual(session.hooks, {"response": []})
+
     def test_from_name(self):
         test = find_departements(input_df2, "deps", "DEP_CODE", "label")
         assert (test["DEP_CODE"] == test["codes"]).all()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import contextvars
+import threading
+import time
+from unittest import TestCase
+
+from french_cities.executor import (
+    AIMDController,
+    SharedExecutor,
+    _parse_limits,
+    get_executor,
+    single_flight,
+)
+from french_cities.geocoders import GeocoderError
+
+var = contextvars.ContextVar("var", default=None)
+
+
+class Counter:
+    "Count the maximum number of tasks running at once"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, x):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        return x * 2
+
+
+class test_executor(TestCase):
+    def setUp(self):
+        self.executor = SharedExecutor({"slow": 2}, max_workers=8)
+
+    def test_map_order(self):
+        results = list(self.executor.map("any", lambda x: x * 2, range(50)))
+        self.assertEqual(results, [x * 2 for x in range(50)])
+
+    def test_host_budget(self):
+        counter = Counter()
+        # two concurrent callers share the same budget
+        threads = [
+            threading.Thread(
+                target=lambda: list(
+                    self.executor.map("slow", counter, range(10))
+                )
+            )
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.max_running, 2)
+
+    def test_call_budget(self):
+        counter = Counter()
+        list(self.executor.map("other", counter, range(10), max_workers=1))
+        self.assertEqual(counter.max_running, 1)
+
+    def test_set_limit(self):
+        self.executor.set_limit("slow", 4)
+        counter = Counter()
+        list(self.executor.map("slow", counter, range(20)))
+        self.assertEqual(counter.max_running, 4)
+
+    def test_nested_calls_inline(self):
+        executor = SharedExecutor({"outer": 1, "inner": 1}, max_workers=1)
+
+        def outer(x):
+            return sum(executor.map("inner", lambda y: y, range(x)))
+
+        results = list(executor.map("outer", outer, range(5)))
+        self.assertEqual(results, [0, 0, 1, 3, 6])
+
+    def test_context_copied(self):
+        var.set("value")
+        results = list(self.executor.map("any", lambda x: var.get(), [1, 2]))
+        self.assertEqual(results, ["value", "value"])
+
+    def test_exceptions(self):
+        def fail(x):
+            raise ValueError(x)
+
+        with self.assertRaises(ValueError):
+            list(self.executor.map("any", fail, [1]))
+        # the budget has been released
+        self.assertEqual(self.executor.submit("any", int, "3").result(), 3)
+
+    def test_shared_instance(self):
+        self.assertIs(get_executor(), get_executor())
+
+    def test_parse_limits(self):
+        self.assertEqual(
+            _parse_limits("ban=20, insee=5,wrong"), {"ban": 20, "insee": 5}
+        )
+
+
+class test_aimd(TestCase):
+
+    def test_additive_increase(self):
+        controller = AIMDController(2, maximum=4)
+        for _ in range(3):
+            controller.on_success()
+        self.assertEqual(controller.limit, 3)
+        for _ in range(100):
+            controller.on_success()
+        self.assertEqual(controller.limit, 4)
+
+    def test_multiplicative_decrease(self):
+        controller = AIMDController(8, maximum=10)
+        controller.on_congestion()
+        self.assertEqual(controller.limit, 4)
+        # a burst of congestion signals is only penalized once
+        controller.on_congestion()
+        self.assertEqual(controller.limit, 4)
+        controller.last_decrease -= 1
+        for _ in range(5):
+            controller.on_congestion()
+            controller.last_decrease -= 1
+        self.assertEqual(controller.limit, 1)
+
+    def test_latency_spike(self):
+        controller = AIMDController(8, maximum=10)
+        for _ in range(5):
+            controller.on_success(0.01)
+        self.assertEqual(controller.limit, 8)
+        controller.on_success(1)
+        self.assertEqual(controller.limit, 4)
+
+    def test_executor_feedback(self):
+        executor = SharedExecutor({"api": 8}, initial=8)
+        executor.feedback("api", congested=True)
+        self.assertEqual(executor.get_limit("api"), 4)
+        counter = Counter()
+        list(executor.map("api", counter, range(20)))
+        self.assertLessEqual(counter.max_running, 8)
+        # successful tasks raise the budget again
+        self.assertGreater(executor.get_limit("api"), 4)
+
+    def test_retryable_errors(self):
+        executor = SharedExecutor({"api": 8}, initial=8)
+
+        def fail(retryable):
+            raise GeocoderError("failed", retryable=retryable)
+
+        def wait_idle():
+            # the budget is adapted right after the task's future is set
+            deadline = time.monotonic() + 5
+            while executor._queues["api"].running:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.001)
+
+        with self.assertRaises(GeocoderError):
+            executor.submit("api", fail, False).result()
+        wait_idle()
+        self.assertEqual(executor.get_limit("api"), 8)
+        with self.assertRaises(GeocoderError):
+            executor.submit("api", fail, True).result()
+        wait_idle()
+        self.assertEqual(executor.get_limit("api"), 4)
+
+
+class test_single_flight(TestCase):
+
+    def run_concurrently(self, func, n=5):
+        barrier = threading.Barrier(n)
+        results = []
+
+        def target():
+            barrier.wait()
+            try:
+                results.append(single_flight("key", func))
+            except ValueError as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=target) for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesced(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            time.sleep(0.1)
+            return len(calls)
+
+        self.assertEqual(self.run_concurrently(func), [1] * 5)
+        self.assertEqual(len(calls), 1)
+        # later calls are not coalesced with finished ones
+        self.assertEqual(single_flight("key", func), 2)
+
+    def test_exception_shared(self):
+        def func():
+            time.sleep(0.1)
+            raise ValueError("failed")
+
+        results = self.run_concurrently(func)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len({id(x) for x in results}), 1)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import tempfile
+import threading
+from unittest import TestCase
+import pandas as pd
+from requests import Session
+
+from french_cities.geocoders import (
+    AddokGeocoder,
+    BANGeocoder,
+    LocalBANGeocoder,
+    get_geocoder,
+)
+
+
+class test_get_geocoder(TestCase):
+    def test_default(self):
+        assert isinstance(get_geocoder(), BANGeocoder)
+
+    def test_addok(self):
+        geocoder = get_geocoder("addok:http://localhost:7878/")
+        assert isinstance(geocoder, AddokGeocoder)
+        assert geocoder.csv_url == "http://localhost:7878/search/csv/"
+        assert geocoder.search_url == "http://localhost:7878/search/"
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            get_geocoder("dummy")
+
+
+class BANHandler(BaseHTTPRequestHandler):
+    body = gzip.compress(
+        b"postcode,full,result_score,result_city,result_citycode\r\n"
+        b"59000,59000 LILLE,0.9,Lille,59350\r\n"
+    )
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class test_ban_geocoder(TestCase):
+    def test_csv_streamed(self):
+        server = HTTPServer(("127.0.0.1", 0), BANHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            geocoder = BANGeocoder(
+                csv_url=f"http://127.0.0.1:{server.server_port}/search/csv/"
+            )
+            chunk = pd.DataFrame({"postcode": ["59000"], "full": ["LILLE"]})
+            with Session() as session:
+                results = geocoder.csv(chunk, session)
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert results["result_citycode"].tolist() == ["59350"]
+
+
+class test_local_geocoder(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        dump = pd.DataFrame(
+            {
+                "id": ["1", "2", "3"],
+                "nom_voie": ["Rue A", "Rue B", "Rue C"],
+                "code_postal": ["59000", "59120", "60320"],
+                "code_insee": ["59350", "59360", "60597"],
+                "nom_commune": ["Lille", "Loos", "Saint-Sauveur"],
+            }
+        )
+        for dep, df in dump.groupby(dump["code_insee"].str[:2]):
+            path = os.path.join(self.directory.name, f"adresses-{dep}.csv.gz")
+            df.to_csv(path, sep=";", index=False)
+        self.geocoder = LocalBANGeocoder(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_search(self):
+        result = self.geocoder.search("59120 LOOS", None)
+        assert [x["citycode"] for x in result] == ["59360"]
+        result = self.geocoder.search("60 SAINT SAUVEUR", None)
+        assert [x["citycode"] for x in result] == ["60597"]
+
+    def test_house_number_is_not_a_department(self):
+        # 59 is a department of the dumps, but not Saint-Sauveur's
+        result = self.geocoder.search("59 RUE C SAINT SAUVEUR", None)
+        assert [x["citycode"] for x in result] == ["60597"]
+        # a postcode wins over departments
+        result = self.geocoder.search("60 RUE A 59000 LILLE", None)
+        assert [x["citycode"] for x in result] == ["59350"]
+
+    def test_search_not_found(self):
+        assert self.geocoder.search("59000 ZZZ", None) == []
+
+    def test_csv(self):
+        chunk = pd.DataFrame(
+            {
+                "postcode": ["59000", "59120"],
+                "city_cleaned": ["LILLE", "LOOS"],
+                "full": ["59000 LILLE", "59120 LOOS"],
+            }
+        )
+        results = self.geocoder.csv(chunk, None)
+        assert results.columns.tolist() == [
+            "full",
+            "result_score",
+            "result_city",
+            "result_citycode",
+        ]
+        assert results["result_citycode"].tolist() == ["59350", "59360"]
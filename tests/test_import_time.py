@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+import json
+import subprocess
+import sys
+from unittest import TestCase
+
+HEAVY_MODULES = [
+    "geopandas",
+    "geopy",
+    "pandas",
+    "pynsee",
+    "pyproj",
+    "rapidfuzz",
+    "requests_cache",
+]
+
+SCRIPT = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import french_cities
+duration = time.perf_counter() - start
+print(json.dumps({"duration": duration, "modules": sorted(sys.modules)}))
+"""
+
+
+def import_in_subprocess(script: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+class test_import_time(TestCase):
+    def test_no_heavy_import(self):
+        loaded = set(import_in_subprocess(SCRIPT)["modules"])
+        self.assertEqual(loaded & set(HEAVY_MODULES), set())
+
+    def test_import_time(self):
+        # generous budget: a lazy import should take a few milliseconds
+        self.assertLess(import_in_subprocess(SCRIPT)["duration"], 0.5)
+
+    def test_lazy_attributes(self):
+        script = SCRIPT + (
+            "french_cities.set_vintage\n"
+            "print(json.dumps({'modules': sorted(sys.modules)}))\n"
+        )
+        loaded = set(import_in_subprocess(script)["modules"])
+        self.assertIn("french_cities.vintage", loaded)
+        self.assertNotIn("french_cities.city_finder", loaded)
+
+    def test_public_api(self):
+        import french_cities
+
+        for name in french_cities.__all__:
+            self.assertTrue(callable(getattr(french_cities, name)))
+        self.assertIsInstance(french_cities.__version__, str)
+        with self.assertRaises(AttributeError):
+            french_cities.not_an_attribute
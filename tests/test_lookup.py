@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from french_cities import lookup
+from french_cities.lookup import city_code, dep_from_postcode, project_code
+
+
+class test_dep_from_postcode(TestCase):
+    def test_content(self):
+        assert dep_from_postcode("59000") == "59"
+        assert dep_from_postcode("2140") == "02"
+
+    def test_ambiguous(self):
+        # 13780 may be either 13 or 83
+        assert dep_from_postcode("13780") is None
+
+    def test_unknown(self):
+        assert dep_from_postcode("99999") is None
+
+
+class test_project_code(TestCase):
+    def test_valid(self):
+        assert project_code("59350") == "59350"
+
+    def test_obsolete(self):
+        assert project_code("59298", 2024) == "59350"
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            project_code("59350", "dummy")
+
+    def test_missing_creation_date(self):
+        cities = pd.DataFrame(
+            {
+                "CODE": ["97501", "59350"],
+                "TITLE_SHORT": ["SAINT PIERRE", "LILLE"],
+                "dep": ["975", "59"],
+                "DATE_CREATION": [np.nan, "1943-01-01"],
+                "DATE_DELETION": [np.nan, np.nan],
+            }
+        )
+        postcodes = pd.DataFrame(columns=["postcode", "dep", "CODE"])
+        with patch.object(
+            lookup, "get_cities_referential", return_value=cities
+        ), patch.object(
+            lookup, "get_postcodes_referential", return_value=postcodes
+        ), patch.dict(
+            lookup._indexes, clear=True
+        ):
+            assert project_code("97501", 2024) == "97501"
+
+
+class test_city_code(TestCase):
+    def test_dep(self):
+        assert city_code("Lille", dep="59") == "59350"
+
+    def test_postcode(self):
+        assert city_code("Loos", postcode="59120") == "59360"
+        assert city_code("Le Sourd", postcode="02140") == "02731"
+
+    def test_fuzzy(self):
+        assert city_code("Dunkerke", dep="59") == "59183"
+
+    def test_ambiguous(self):
+        assert city_code("Saint-Sauveur") is None
+
+    def test_empty(self):
+        assert city_code("") is None
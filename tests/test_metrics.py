@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+from unittest import TestCase
+
+from requests import Response, Session
+
+from french_cities.executor import get_executor
+from french_cities.metrics import (
+    add_metrics_callback,
+    collect_metrics,
+    instrument_session,
+    record_cache,
+    record_http,
+    remove_metrics_callback,
+    stage,
+)
+
+
+def dummy_response(url, from_cache=None):
+    r = Response()
+    r.url = url
+    if from_cache is not None:
+        r.from_cache = from_cache
+    return r
+
+
+class test_metrics(TestCase):
+    def test_nothing_collected_outside_reports(self):
+        record_http("example.com")
+        with collect_metrics() as report:
+            pass
+        self.assertEqual(report.http, {})
+        self.assertGreaterEqual(report.seconds, 0)
+
+    def test_report(self):
+        with collect_metrics() as report:
+            for _ in range(2):
+                with stage("fuzzy", 10) as info:
+                    info["rows_out"] = 7
+            record_http("example.com")
+            record_cache("deps", hits=3, misses=1)
+            record_cache("deps", misses=1)
+        self.assertEqual(report.stages["fuzzy"]["calls"], 2)
+        self.assertEqual(report.stages["fuzzy"]["rows_in"], 20)
+        self.assertEqual(report.stages["fuzzy"]["rows_out"], 14)
+        self.assertEqual(report.http, {"example.com": 1})
+        self.assertEqual(report.caches["deps"], {"hits": 3, "misses": 2})
+        json.dumps(report.to_dict())
+
+    def test_callbacks(self):
+        events = []
+        with collect_metrics(callback=events.append):
+            record_http("example.com")
+        record_http("example.com")
+        self.assertEqual(events, [{"kind": "http", "host": "example.com"}])
+
+        add_metrics_callback(events.append)
+        try:
+            record_cache("nominatim", hits=1)
+        finally:
+            remove_metrics_callback(events.append)
+        record_cache("nominatim", hits=1)
+        self.assertEqual(len(events), 2)
+
+    def test_session_hook(self):
+        session = instrument_session(instrument_session(Session()))
+        # metrics' hook, then the executor's throttling hook
+        self.assertEqual(len(session.hooks["response"]), 2)
+        hook = session.hooks["response"][0]
+        with collect_metrics() as report:
+            hook(dummy_response("https://api-adresse.data.gouv.fr/search/"))
+            hook(dummy_response("https://example.com/", from_cache=False))
+            hook(dummy_response("https://example.com/", from_cache=True))
+        self.assertEqual(report.http, {"api-adresse.data.gouv.fr": 1})
+        self.assertEqual(
+            report.caches["requests-cache"], {"hits": 1, "misses": 1}
+        )
+
+    def test_concurrent_reports(self):
+        barrier = threading.Barrier(2)
+
+        def collect(host):
+            with collect_metrics() as report:
+                barrier.wait()
+                record_http(host)
+                # tasks run by the shared executor on behalf of the block
+                get_executor().submit("insee", record_http, host).result()
+                barrier.wait()
+            return report
+
+        with ThreadPoolExecutor(2) as pool:
+            reports = list(pool.map(collect, ["a.fr", "b.fr"]))
+        self.assertEqual(reports[0].http, {"a.fr": 2})
+        self.assertEqual(reports[1].http, {"b.fr": 2})
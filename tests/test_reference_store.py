@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import pandas as pd
+
+from french_cities import reference_store
+from french_cities.reference_store import (
+    _vintage,
+    _write_snapshot,
+    area_list,
+    clear_snapshots,
+    get_level,
+)
+
+communes = pd.DataFrame(
+    {
+        "CODE": ["01001", "75056"],
+        "TITLE": ["L'Abergement-Clémenciat", "Paris"],
+        "DATE_DELETION": [None, None],
+    }
+)
+districts = pd.DataFrame({"CODE": ["75107"], "PARENT": ["75056"]})
+
+
+class test_reference_store(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.patch = patch.object(
+            reference_store, "DIR_CACHE", self.directory.name
+        )
+        self.patch.start()
+        _write_snapshot(
+            "2024",
+            {"communes": communes, "arrondissementsMunicipaux": districts},
+        )
+
+    def tearDown(self):
+        clear_snapshots()
+        self.patch.stop()
+        self.directory.cleanup()
+
+    def test_vintage(self):
+        self.assertEqual(_vintage("2024-01-01"), "2024")
+        self.assertEqual(_vintage("*"), "*")
+        self.assertIsNone(_vintage("2024-06-01"))
+
+    def test_roundtrip(self):
+        df = get_level("communes", "2024-01-01")
+        self.assertEqual(list(df.columns), list(communes.columns))
+        self.assertEqual(df["TITLE"].tolist(), communes["TITLE"].tolist())
+        self.assertTrue(df["DATE_DELETION"].isnull().all())
+        df = get_level("arrondissementsMunicipaux", "2024-01-01")
+        pd.testing.assert_frame_equal(df, districts)
+
+    def test_not_covered(self):
+        self.assertIsNone(get_level("communes", "2023-01-01"))
+        self.assertIsNone(get_level("departements", "2024-01-01"))
+
+    def test_fallback(self):
+        with patch.object(
+            reference_store, "get_area_list", return_value="pynsee"
+        ) as mocked:
+            df = area_list("communes", "2024-01-01")
+            self.assertIsInstance(df, pd.DataFrame)
+            mocked.assert_not_called()
+            self.assertEqual(area_list("communes", "2023-01-01"), "pynsee")
+            mocked.assert_called_once()
+
+    def test_rebuilt_snapshot(self):
+        get_level("communes", "2024-01-01")
+        path = _write_snapshot("2024", {"communes": communes.iloc[:1]})
+        # make sure the rebuilt snapshot's modification time differs
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(len(get_level("communes", "2024-01-01")), 1)
+        # the previous snapshot has been released
+        self.assertEqual(list(reference_store._tables), [path])
+
+    def test_obsolete_format(self):
+        with patch.object(reference_store, "REFERENCE_FORMAT", 0):
+            _write_snapshot("2025", {"communes": communes})
+        self.assertIsNone(get_level("communes", "2025-01-01"))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+import pandas as pd
+
+from french_cities.referential import (
+    get_cities_referential,
+    get_postcodes_referential,
+    normalize_labels,
+)
+
+
+class test_normalize_labels(TestCase):
+    def test_content(self):
+        s = pd.Series(["Saint-Étienne", "L'Haÿ-les-Roses"])
+        assert normalize_labels(s).tolist() == [
+            "SAINT ETIENNE",
+            "L HAY LES ROSES",
+        ]
+
+
+class test_get_cities_referential(TestCase):
+    def setUp(self):
+        self.cities = get_cities_referential()
+
+    def test_class(self):
+        assert isinstance(self.cities, pd.DataFrame)
+
+    def test_columns(self):
+        assert self.cities.columns.tolist() == [
+            "CODE",
+            "TITLE_SHORT",
+            "DATE_CREATION",
+            "DATE_DELETION",
+            "dep",
+        ]
+
+    def test_shared(self):
+        assert get_cities_referential() is self.cities
+
+    def test_content(self):
+        ix = self.cities[self.cities.CODE == "59350"].index
+        assert set(self.cities.loc[ix, "TITLE_SHORT"]) == {"LILLE"}
+        assert set(self.cities.loc[ix, "dep"]) == {"59"}
+
+
+class test_get_postcodes_referential(TestCase):
+    def setUp(self):
+        self.postcodes = get_postcodes_referential()
+
+    def test_columns(self):
+        assert self.postcodes.columns.tolist() == ["postcode", "CODE", "dep"]
+
+    def test_shared(self):
+        assert get_postcodes_referential() is self.postcodes
+
+    def test_content(self):
+        lille = self.postcodes[self.postcodes["postcode"] == "59000"]
+        assert set(lille["dep"]) == {"59"}
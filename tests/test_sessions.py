@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+from unittest import TestCase
+from unittest.mock import patch
+
+import french_cities
+from french_cities.constants import HTTP_POOL_MAXSIZE
+from french_cities.sessions import (
+    clear_sessions,
+    configure_http_cache,
+    get_session,
+)
+
+
+def _session_id(_):
+    return id(get_session("test-sessions"))
+
+
+class test_sessions(TestCase):
+
+    def setUp(self):
+        configure_http_cache("memory")
+
+    def tearDown(self):
+        configure_http_cache("sqlite")
+
+    def test_shared(self):
+        session = get_session("test-sessions")
+        self.assertIs(session, get_session("test-sessions"))
+        self.assertIsNot(session, get_session("test-sessions-2"))
+        clear_sessions()
+        self.assertIsNot(session, get_session("test-sessions"))
+
+    def test_pool_size(self):
+        session = get_session("test-sessions")
+        adapter = session.get_adapter("https://api-adresse.data.gouv.fr")
+        self.assertEqual(adapter._pool_maxsize, HTTP_POOL_MAXSIZE)
+
+    def test_hooks(self):
+        session = get_session("test-sessions")
+        self.assertEqual(len(session.hooks["response"]), 2)
+
+    def test_dotenv(self):
+        french_cities._load_dotenv.cache_clear()
+        self.addCleanup(french_cities._load_dotenv.cache_clear)
+        with patch("dotenv.load_dotenv") as load_dotenv:
+            get_session("test-sessions")
+            get_session("test-sessions-2")
+        load_dotenv.assert_called_once_with(override=True)
+
+    def test_backend(self):
+        session = get_session("test-sessions")
+        self.assertEqual(type(session.cache).__name__, "BaseCache")
+        with self.assertRaises(ValueError):
+            configure_http_cache("wrong")
+
+    def test_not_shared_with_forks(self):
+        session_id = _session_id(None)
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(1) as pool:
+            self.assertNotEqual(pool.map(_session_id, [0])[0], session_id)
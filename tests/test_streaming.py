@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+import pandas as pd
+
+from french_cities.streaming import (
+    _batches,
+    _read_chunks,
+    find_city_in_file,
+    find_city_iter,
+    find_departements_iter,
+)
+
+input_df = pd.DataFrame(
+    {
+        "dep": ["59", "59", "02", "74"],
+        "city": ["Lille", "Loos", "Le Sourd", "Morzine"],
+        "postcode": ["59000", "59120", "2140", "74110"],
+        "target": ["59350", "59360", "02731", "74191"],
+    }
+)
+
+
+class test_find_city_in_file(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _run(self, suffix_in, suffix_out):
+        path_in = os.path.join(self.directory.name, f"input{suffix_in}")
+        path_out = os.path.join(self.directory.name, f"output{suffix_out}")
+        if suffix_in == ".parquet":
+            input_df.to_parquet(path_in)
+        else:
+            input_df.to_csv(path_in, index=False)
+        count = find_city_in_file(path_in, path_out, chunksize=3)
+        if suffix_out == ".parquet":
+            output = pd.read_parquet(path_out)
+        else:
+            output = pd.read_csv(path_out, dtype=str)
+        return count, output
+
+    def test_csv(self):
+        count, output = self._run(".csv", ".csv")
+        assert count == len(input_df)
+        assert (output["target"] == output["insee_com"]).all()
+
+    def test_parquet(self):
+        count, output = self._run(".parquet", ".parquet")
+        assert count == len(input_df)
+        assert (output["target"] == output["insee_com"]).all()
+
+    def test_parquet_integer_fields(self):
+        path = os.path.join(self.directory.name, "input.parquet")
+        pd.DataFrame(
+            {"postcode": [59000, None, 2140], "n": [1, 2, 3]}
+        ).to_parquet(path)
+        chunks = list(_read_chunks(path, 2, dtype={"postcode": str}, sep=","))
+        df = pd.concat(chunks, ignore_index=True)
+        assert df["postcode"].tolist()[::2] == ["59000", "2140"]
+        assert pd.isnull(df.at[1, "postcode"])
+        assert df["n"].tolist() == [1, 2, 3]
+
+    def test_same_path(self):
+        path = os.path.join(self.directory.name, "input.csv")
+        with self.assertRaises(ValueError):
+            find_city_in_file(path, path)
+
+
+class test_batches(TestCase):
+    def test_batch_size(self):
+        assert list(_batches(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+
+    def test_latency(self):
+        def records():
+            yield 0
+            time.sleep(0.5)
+            yield 1
+
+        batches = list(_batches(records(), 10, max_latency=0.1))
+        assert batches == [[0], [1]]
+
+    def test_error(self):
+        def records():
+            yield 0
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            list(_batches(records(), 10, max_latency=0.1))
+
+
+class test_find_city_iter(TestCase):
+    def test_content(self):
+        records = input_df.to_dict("records")
+        results = list(find_city_iter(iter(records), batch_size=3))
+        assert len(results) == len(records)
+        assert all(x["target"] == x["insee_com"] for x in results)
+
+
+class test_find_departements_iter(TestCase):
+    def test_content(self):
+        records = [{"postcode": "59000"}, {"postcode": "02140"}]
+        results = list(
+            find_departements_iter(records, "postcode", "dep", "postcode")
+        )
+        assert [x["dep"] for x in results] == ["59", "02"]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from unittest import TestCase
+
+from french_cities.executor import get_executor
+from french_cities.utils import PYNSEE_LOGS, silence_logs
+
+
+class test_silence_logs(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger(PYNSEE_LOGS[0])
+
+    def test_silenced(self):
+        with self.assertLogs(self.logger, "WARNING") as logs:
+            with silence_logs("No data"):
+                self.logger.warning("No data found !")
+                self.logger.warning("Something else")
+            self.logger.warning("No data found !")
+        self.assertEqual(
+            [x.getMessage() for x in logs.records],
+            ["Something else", "No data found !"],
+        )
+        self.assertTrue(self.logger.propagate)
+
+    def test_executor_tasks(self):
+        with self.assertLogs(self.logger, "WARNING") as logs:
+            with silence_logs("No data"):
+                get_executor().submit(
+                    "any", self.logger.warning, "No data found !"
+                ).result()
+            self.logger.warning("logged")
+        self.assertEqual([x.getMessage() for x in logs.records], ["logged"])
+
+    def test_other_threads(self):
+        event = threading.Event()
+        done = threading.Event()
+
+        def other():
+            event.wait()
+            self.logger.warning("No data found !")
+            done.set()
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        with self.assertLogs(self.logger, "WARNING") as logs:
+            with silence_logs("No data"):
+                event.set()
+                done.wait()
+        thread.join()
+        self.assertEqual(len(logs.records), 1)